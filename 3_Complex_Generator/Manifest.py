@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import argparse
+
+# Job manifest: one record per job of every stage, written by StartUp.py when a complex
+# is generated and carried forward by OrcaFlotte, XTBzuGOAT, Ordnen and SPIN_Cleanup_New.
+# Later stages look the metadata up by job name instead of re-parsing names and inputs.
+#
+# Stages: 'complex' (StartUp input, also the xTB job), 'goat' (GOAT input), 'ensemble' (sorted final ensemble).
+# Derived records keep the metadata of their parent and point to it via 'parent'.
+
+MANIFEST_NAME = "manifest.db"
+
+MANIFEST_COLUMNS = [
+    ("job_name", "TEXT PRIMARY KEY"),
+    ("stage", "TEXT"),
+    ("geometry", "TEXT"),          # German name as in metals.db (e.g. "Oktaedrisch")
+    ("geometry_folder", "TEXT"),   # folder written by StartUp (e.g. "Octahedral")
+    ("geometry_abbr", "TEXT"),     # polyhedral abbreviation (e.g. "OC")
+    ("metal", "TEXT"),
+    ("oxidation", "INTEGER"),
+    ("ligands", "TEXT"),           # ligand names in build order, joined with "_"
+    ("charge", "INTEGER"),
+    ("multiplicity", "INTEGER"),
+    ("parent", "TEXT"),            # job name of the record this one was derived from
+    ("path", "TEXT"),              # main file of the job (input, GOAT input or ensemble)
+    ("status", "TEXT"),            # e.g. "xtb_success" / "xtb_failed", set by OrcaFlotte
+]
+
+def find_manifest(start_dir):
+    """Look for manifest.db in start_dir and its parent directories (None if there is none)."""
+    directory = os.path.abspath(start_dir)
+    while True:
+        candidate = os.path.join(directory, MANIFEST_NAME)
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+class Manifest:
+    """
+    SQLite table with one metadata record per job, keyed by job name.
+    Records are returned as dicts with 'ligands' as a tuple.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # Several stages may write at the same time (OrcaFlotte and XTBzuGOAT --watch): wait for the other's transaction
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        columns = ", ".join(f"{name} {sql_type}" for name, sql_type in MANIFEST_COLUMNS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS jobs ({columns})")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_parent ON jobs (parent)")
+        self.conn.commit()
+        self.pending = 0
+
+    @staticmethod
+    def _to_record(row, names):
+        record = dict(zip(names, row))
+        record['ligands'] = tuple(record['ligands'].split("_")) if record.get('ligands') else ()
+        return record
+
+    @staticmethod
+    def _row(record):
+        """Column names and values of a record (missing keys become NULL)"""
+        names = [name for name, _ in MANIFEST_COLUMNS]
+        values = []
+        for name in names:
+            value = record.get(name)
+            if name == 'ligands' and isinstance(value, (tuple, list)):
+                value = "_".join(value)
+            values.append(value)
+        return names, values
+
+    def add(self, record, commit_every=1000):
+        """Insert or replace a record (missing keys become NULL)."""
+        names, values = self._row(record)
+        placeholders = ", ".join("?" for _ in names)
+        self.conn.execute(f"INSERT OR REPLACE INTO jobs ({', '.join(names)}) VALUES ({placeholders})", values)
+        self.pending += 1
+        if self.pending >= commit_every:
+            self.commit()
+
+    def refresh(self, record, commit_every=1000):
+        """
+        Insert a record, or update the metadata of an existing one: status, path and parent written by
+        later stages are kept (re-runs of a stage that created the record).
+        """
+        names, values = self._row(record)
+        placeholders = ", ".join("?" for _ in names)
+        updates = ", ".join(f"{name} = excluded.{name}" for name in names
+                            if name not in ('job_name', 'status', 'path', 'parent'))
+        self.conn.execute(f"INSERT INTO jobs ({', '.join(names)}) VALUES ({placeholders}) "
+                          f"ON CONFLICT(job_name) DO UPDATE SET {updates}", values)
+        self.pending += 1
+        if self.pending >= commit_every:
+            self.commit()
+
+    def derive(self, parent_record, job_name, stage, **changes):
+        """Add a record for a job created from parent_record (same metadata, new name and stage)."""
+        record = dict(parent_record, job_name=job_name, stage=stage, parent=parent_record['job_name'],
+                      status=None, path=None)
+        record.update(changes)
+        self.add(record)
+        return record
+
+    def set_status(self, job_name, status, path=None):
+        if path is None:
+            self.conn.execute("UPDATE jobs SET status = ? WHERE job_name = ?", (status, job_name))
+        else:
+            self.conn.execute("UPDATE jobs SET status = ?, path = ? WHERE job_name = ?", (status, path, job_name))
+        self.pending += 1
+
+    def get(self, job_name):
+        cursor = self.conn.execute("SELECT * FROM jobs WHERE job_name = ?", (job_name,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return self._to_record(row, [d[0] for d in cursor.description])
+
+    def records(self, stage=None):
+        """All records (of one stage) as a dict job name -> record, for bulk lookups."""
+        if stage:
+            cursor = self.conn.execute("SELECT * FROM jobs WHERE stage = ?", (stage,))
+        else:
+            cursor = self.conn.execute("SELECT * FROM jobs")
+        names = [d[0] for d in cursor.description]
+        return {row[0]: self._to_record(row, names) for row in cursor.fetchall()}
+
+    def lineage(self, job_name):
+        """The record and all its ancestors, newest first."""
+        chain = []
+        record = self.get(job_name)
+        while record is not None:
+            chain.append(record)
+            record = self.get(record['parent']) if record['parent'] else None
+        return chain
+
+    def count(self):
+        return dict(self.conn.execute("SELECT stage, COUNT(*) FROM jobs GROUP BY stage").fetchall())
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the job manifest written by StartUp.py")
+    parser.add_argument("manifest", help="Path to manifest.db")
+    parser.add_argument("--job", "-j", help="Show the record of this job and its ancestors")
+    args = parser.parse_args()
+
+    manifest = Manifest(args.manifest)
+    if args.job:
+        chain = manifest.lineage(args.job)
+        if not chain:
+            print(f"No record for {args.job}")
+        for record in chain:
+            print(", ".join(f"{k}={v}" for k, v in record.items() if v not in (None, ())))
+    else:
+        for stage, count in sorted(manifest.count().items()):
+            print(f"{stage}: {count} records")
+    manifest.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import os
+import re
+import argparse
+import numpy as np
+from collections import defaultdict
+
+from StartUp import fetch_ligands, parse_xyz
+
+# Optional stage between StartUp.py and OrcaFlotte.py: the ligands placed by
+# build_complex are rigid and sit at a fixed 1.5 Å from the metal. A cheap
+# classical model (metal–donor springs, ligand shape springs, soft repulsion)
+# moves them to sensible distances so xTB needs fewer optimization cycles.
+
+PRERELAX_MARKER = "# PreRelax"
+
+# Covalent radii in Å (Cordero et al. 2008)
+COVALENT_RADII = {
+    "H": 0.31, "B": 0.84, "C": 0.76, "N": 0.71, "O": 0.66, "F": 0.57, "P": 1.07, "S": 1.05,
+    "Cl": 1.02, "Br": 1.20, "I": 1.39, "Se": 1.20, "As": 1.19, "Si": 1.11,
+    "Sc": 1.70, "Ti": 1.60, "V": 1.53, "Cr": 1.39, "Mn": 1.39, "Fe": 1.32, "Co": 1.26, "Ni": 1.24, "Cu": 1.32, "Zn": 1.22,
+    "Y": 1.90, "Zr": 1.75, "Nb": 1.64, "Mo": 1.54, "Tc": 1.47, "Ru": 1.46, "Rh": 1.42, "Pd": 1.39, "Ag": 1.45, "Cd": 1.44,
+    "Hf": 1.75, "Ta": 1.70, "W": 1.62, "Re": 1.51, "Os": 1.44, "Ir": 1.41, "Pt": 1.36, "Au": 1.36, "Hg": 1.32,
+}
+
+# Van-der-Waals radii in Å (Bondi), metals default to 2.0 Å
+VDW_RADII = {
+    "H": 1.20, "B": 1.92, "C": 1.70, "N": 1.55, "O": 1.52, "F": 1.47, "P": 1.80, "S": 1.80,
+    "Cl": 1.75, "Br": 1.85, "I": 1.98, "Se": 1.90, "As": 1.85, "Si": 2.10,
+}
+
+# Force constants of the model (arbitrary units, only the ratios matter)
+K_SHAPE = 5.0       # keeps the internal ligand geometry
+K_METAL_DONOR = 1.0 # pulls the donor atom to the covalent bond length
+K_REPULSION = 2.0   # pushes non-bonded atoms of different ligands apart
+REPULSION_SCALE = 0.8  # contact distance = scale * (vdW_i + vdW_j)
+
+# --- Input file handling ---
+
+def read_inp_file(path):
+    """Read an ORCA input written by StartUp.py and return header lines, charge, multiplicity, symbols and coordinates."""
+    header = []
+    symbols = []
+    coords = []
+    chrg = mult = None
+    in_block = False
+    with open(path, "r") as f:
+        for line in f:
+            stripped = line.strip()
+            if not in_block:
+                match = re.match(r"\*\s*xyz\s+(-?\d+)\s+(\d+)", stripped)
+                if match:
+                    chrg, mult = int(match.group(1)), int(match.group(2))
+                    in_block = True
+                elif not stripped.startswith(PRERELAX_MARKER):
+                    header.append(line.rstrip("\n"))
+                continue
+            if stripped == "*":
+                break
+            parts = stripped.split()
+            if len(parts) == 4:
+                symbols.append(parts[0])
+                coords.append([float(x) for x in parts[1:4]])
+    if chrg is None:
+        raise ValueError(f"No '* xyz charge mult' block found in {path}")
+    return header, chrg, mult, symbols, np.array(coords, dtype=float)
+
+def is_prerelaxed(path):
+    with open(path, "r") as f:
+        return any(line.startswith(PRERELAX_MARKER) for line in f)
+
+def write_relaxed_inp_file(path, header, chrg, mult, symbols, coords, info):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(f"{PRERELAX_MARKER}: {info}\n")
+        for line in header:
+            f.write(line + "\n")
+        f.write(f"* xyz {chrg} {mult}\n")
+        for atom, (x, y, z) in zip(symbols, coords):
+            f.write(f"{atom} {x:.6f} {y:.6f} {z:.6f}\n")
+        f.write("*\n")
+    os.replace(tmp_path, path)
+
+# --- Force-field setup ---
+
+def fragments_from_sizes(n_atoms, ligand_sizes, metal_idx=0):
+    """
+    Label every atom with its ligand: build_complex writes the metal first and then
+    the atoms of each ligand as one contiguous block.
+    """
+    fragment = np.zeros(n_atoms, dtype=int)
+    start = metal_idx + 1
+    for label, size in enumerate(ligand_sizes, start=1):
+        fragment[start:start + size] = label
+        start += size
+    if start != n_atoms:
+        raise ValueError(f"Ligand sizes {ligand_sizes} do not add up to {n_atoms - 1} ligand atoms")
+    return fragment
+
+def ligand_sizes_from_name(file_name, ligand_db):
+    """Atom counts of the ligands encoded in a StartUp file name, e.g. OC_Fe_2_Cl_Cl_NH3_NH3_CO_CO_Spin_1.inp"""
+    parts = os.path.splitext(file_name)[0].split("_")
+    ligands = parts[3:parts.index("Spin")] if "Spin" in parts else parts[3:]
+    return [len(parse_xyz(ligand_db[name]["xyz"])) for name in ligands]
+
+def build_terms(symbols, coords, fragment):
+    """
+    Set up the pair terms of the model as flat arrays (i, j, r0, k, repulsive).
+    Harmonic terms hold the ligand shapes and the metal–donor distances,
+    repulsive terms only act while two atoms are closer than their contact distance.
+    """
+    metal_idx = 0
+    cov = np.array([COVALENT_RADII.get(s, 1.5) for s in symbols])
+    vdw = np.array([VDW_RADII.get(s, 2.0) for s in symbols])
+
+    # Donor atom of every fragment: the atom closest to the metal
+    dist_to_metal = np.linalg.norm(coords - coords[metal_idx], axis=1)
+    donors = {}
+    for i, frag in enumerate(fragment):
+        if i == metal_idx:
+            continue
+        if frag not in donors or dist_to_metal[i] < dist_to_metal[donors[frag]]:
+            donors[frag] = i
+    donor_set = set(donors.values())
+
+    ii, jj = np.triu_indices(len(symbols), k=1)
+    same_fragment = (fragment[ii] == fragment[jj]) & (ii != metal_idx) & (jj != metal_idx)
+    initial = np.linalg.norm(coords[ii] - coords[jj], axis=1)
+
+    r0 = REPULSION_SCALE * (vdw[ii] + vdw[jj])
+    k = np.full(len(ii), K_REPULSION)
+    repulsive = np.ones(len(ii), dtype=bool)
+
+    r0[same_fragment] = initial[same_fragment]
+    k[same_fragment] = K_SHAPE
+    repulsive[same_fragment] = False
+
+    for idx in np.nonzero((ii == metal_idx) | (jj == metal_idx))[0]:
+        other = jj[idx] if ii[idx] == metal_idx else ii[idx]
+        if other in donor_set:
+            r0[idx] = cov[metal_idx] + cov[other]
+            k[idx] = K_METAL_DONOR
+            repulsive[idx] = False
+        else:
+            # Non-donor atoms should stay further away than the donor bond
+            r0[idx] = cov[metal_idx] + cov[other] + 0.6
+    return ii, jj, r0, k, repulsive
+
+def energy_and_gradient(coords, ii, jj, r0, k, repulsive):
+    diff = coords[ii] - coords[jj]
+    d = np.maximum(np.linalg.norm(diff, axis=1), 1e-8)
+    dev = d - r0
+    active = ~repulsive | (dev < 0)
+    dev = np.where(active, dev, 0.0)
+    energy = np.sum(k * dev ** 2)
+    coeff = (2 * k * dev / d)[:, None] * diff
+    grad = np.zeros_like(coords)
+    np.add.at(grad, ii, coeff)
+    np.add.at(grad, jj, -coeff)
+    return energy, grad
+
+def prerelax_complex(symbols, coords, ligand_sizes, max_iter=500, gtol=1e-3, max_step=0.1):
+    """
+    Minimize the spring/repulsion model with steepest descent and an adaptive step.
+    Returns the relaxed coordinates (metal kept at its original position) and the iteration count.
+    """
+    coords = np.array(coords, dtype=float)
+    origin = coords[0].copy()
+    terms = build_terms(symbols, coords, fragments_from_sizes(len(symbols), ligand_sizes))
+    energy, grad = energy_and_gradient(coords, *terms)
+    step = 0.05
+    iteration = 0
+    for iteration in range(1, max_iter + 1):
+        if np.max(np.abs(grad)) < gtol:
+            break
+        displacement = -step * grad
+        largest = np.max(np.linalg.norm(displacement, axis=1))
+        if largest > max_step:
+            displacement *= max_step / largest
+        trial = coords + displacement
+        trial_energy, trial_grad = energy_and_gradient(trial, *terms)
+        if trial_energy < energy:
+            coords, energy, grad = trial, trial_energy, trial_grad
+            step *= 1.2
+        else:
+            step *= 0.5
+            if step < 1e-8:
+                break
+    coords += origin - coords[0]
+    return coords, iteration
+
+# --- Directory processing and reporting ---
+
+def prerelax_directory(base_dir, db_ligands, force=False):
+    ligand_db = {l["name"]: l for l in fetch_ligands(db_ligands)}
+    relaxed = 0
+    skipped = 0
+    for root, _, files in os.walk(base_dir):
+        for file in sorted(files):
+            if not file.endswith(".inp"):
+                continue
+            path = os.path.join(root, file)
+            if not force and is_prerelaxed(path):
+                skipped += 1
+                continue
+            header, chrg, mult, symbols, coords = read_inp_file(path)
+            new_coords, iterations = prerelax_complex(symbols, coords, ligand_sizes_from_name(file, ligand_db))
+            shift = np.sqrt(np.mean(np.sum((new_coords - coords) ** 2, axis=1)))
+            write_relaxed_inp_file(path, header, chrg, mult, symbols, new_coords,
+                                   f"{iterations} steps, RMS shift {shift:.3f} A")
+            relaxed += 1
+            if relaxed % 1000 == 0:
+                print(f"Progress: {relaxed} inputs pre-relaxed...", end="\r")
+    print(f"\nPre-relaxed {relaxed} input files, skipped {skipped} already relaxed files.")
+    return relaxed, skipped
+
+def count_optimization_cycles(out_path):
+    cycles = 0
+    with open(out_path, "r", errors="ignore") as f:
+        for line in f:
+            if "GEOMETRY OPTIMIZATION CYCLE" in line:
+                cycles += 1
+    return cycles
+
+def collect_cycles(base_dir):
+    cycles = {}
+    for root, _, files in os.walk(base_dir):
+        for file in files:
+            if file.endswith(".out"):
+                cycles[os.path.splitext(file)[0]] = count_optimization_cycles(os.path.join(root, file))
+    return cycles
+
+def report_cycle_reduction(reference_dir, relaxed_dir):
+    """
+    Compare the xTB optimization cycles of a run without pre-relaxation (reference_dir)
+    with a run on pre-relaxed inputs (relaxed_dir), matched by job name.
+    """
+    reference = collect_cycles(reference_dir)
+    relaxed = collect_cycles(relaxed_dir)
+    common = sorted(set(reference) & set(relaxed))
+    if not common:
+        print("No jobs found in both directories.")
+        return None
+
+    ref_cycles = np.array([reference[name] for name in common], dtype=float)
+    new_cycles = np.array([relaxed[name] for name in common], dtype=float)
+    by_geometry = defaultdict(list)
+    for name, ref, new in zip(common, ref_cycles, new_cycles):
+        by_geometry[name.split("_")[0]].append(ref - new)
+
+    reduction = ref_cycles - new_cycles
+    relative = reduction.sum() / ref_cycles.sum() * 100 if ref_cycles.sum() else 0.0
+    print(f"Compared jobs: {len(common)}")
+    print(f"Average xTB cycles without pre-relaxation: {ref_cycles.mean():.1f}")
+    print(f"Average xTB cycles with pre-relaxation:    {new_cycles.mean():.1f}")
+    print(f"Average cycle reduction: {reduction.mean():.1f} cycles ({relative:.1f}%)")
+    for geom, values in sorted(by_geometry.items()):
+        print(f"  {geom}: {np.mean(values):.1f} cycles saved on average ({len(values)} jobs)")
+    return reduction.mean()
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-relax generated complexes before the xTB optimization")
+    parser.add_argument("--dir", "-d", default="<path_to_folder_Complexes>",
+                        help="Directory with the .inp files written by StartUp.py (searched recursively)")
+    parser.add_argument("--ligands-db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "ligands.db"),
+                        help="Ligand database used by StartUp.py (needed to split the complex into ligands)")
+    parser.add_argument("--force", "-f", action="store_true", help="Relax inputs again even if already marked as pre-relaxed")
+    parser.add_argument("--report", nargs=2, metavar=("REFERENCE_DIR", "RELAXED_DIR"),
+                        help="Only report the average xTB cycle reduction between two finished runs")
+    args = parser.parse_args()
+
+    if args.report:
+        report_cycle_reduction(*args.report)
+    else:
+        prerelax_directory(args.dir, args.ligands_db, force=args.force)
+
+if __name__ == "__main__":
+    main()
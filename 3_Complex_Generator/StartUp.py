@@ -4,6 +4,8 @@ import numpy as np
 from itertools import combinations_with_replacement
 from collections import defaultdict
 
+from Manifest import MANIFEST_NAME, Manifest
+
 # --- Database functions ---
 
 def fetch_metals(db_path, geometry, coordination=None):
@@ -223,6 +225,10 @@ def main():
     ligands = fetch_ligands(db_ligands)
     ligand_db = {l["name"]: l for l in ligands}
 
+    # Metadata of every generated job, used by the later stages instead of parsing names
+    os.makedirs(out_base, exist_ok=True)
+    manifest = Manifest(os.path.join(out_base, MANIFEST_NAME))
+
     elemente = [
         "Fe", "Ru", "Os",    # Gruppe 8
         "Co", "Rh", "Ir",    # Gruppe 9
@@ -268,7 +274,14 @@ def main():
                     os.makedirs(folder, exist_ok=True)
                     file_name = f"{geom_abbr}_{metal['name']}_{metal['oxidation']}_{lig_str}_Spin_{mult}.inp"
                     file_path = os.path.join(folder, file_name)
+                    record = {
+                        "job_name": file_name[:-len(".inp")], "stage": "complex",
+                        "geometry": geom_de, "geometry_folder": geom_en.replace(" ", ""), "geometry_abbr": geom_abbr,
+                        "metal": metal["name"], "oxidation": metal["oxidation"], "ligands": lig_set,
+                        "charge": total_charge, "multiplicity": mult, "path": file_path,
+                    }
                     if os.path.exists(file_path):
+                        manifest.refresh(record)  # keep the manifest complete on re-runs, with the state of later stages
                         continue
                     if mult == 0:
                         print(f"Skipping {file_path} due to zero multiplicity.")
@@ -276,7 +289,9 @@ def main():
                     total_files += 1
                     atoms = build_complex(metal["name"], lig_set, ligand_db, positions)
                     write_inp_file(file_path, atoms, total_charge, mult)
+                    manifest.add(record)
         print(f"\nDone: {geom_en} ({total} complexes generated)")
+    manifest.close()
     print(f"\nTotal complexes generated: {total_complexes}\nTotal files created: {total_files}")
 if __name__ == "__main__":
     main()
\ No newline at end of file
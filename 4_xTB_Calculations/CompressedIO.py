@@ -0,0 +1,171 @@
+import os
+import gzip
+import mmap
+import shutil
+import argparse
+import fnmatch
+
+# Transparent compression of pipeline outputs (.out, .xyz, finalensemble.xyz).
+# Writers pick gzip or zstd; readers use open_text()/resolve_path() and do not
+# need to know whether (or how) a file was compressed.
+
+try:
+    from compression import zstd as _zstd  # Python >= 3.14
+except ImportError:
+    try:
+        import zstandard as _zstd
+    except ImportError:
+        _zstd = None
+
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def zstd_available():
+    return _zstd is not None
+
+def check_compression(compression):
+    """Validate a compression name ('gzip', 'zstd' or None); zstd falls back to gzip if unavailable."""
+    if compression in (None, 'none'):
+        return None
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression == 'zstd' and not zstd_available():
+        return 'gzip'
+    return compression
+
+def compressed_name(path, compression):
+    compression = check_compression(compression)
+    return path + COMPRESSION_SUFFIXES[compression] if compression else path
+
+def strip_compression_suffix(path):
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+def has_extension(filename, extension):
+    """True for 'x.out', 'x.out.gz' and 'x.out.zst' with extension '.out'"""
+    return strip_compression_suffix(filename).endswith(extension)
+
+def resolve_path(path):
+    """Return path itself or its compressed variant, whichever exists (None if neither)."""
+    for candidate in (path, path + '.gz', path + '.zst'):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def open_text(path, mode='r', compression=None, errors='ignore'):
+    """
+    Open a text file that may be compressed.
+    Reading: the format is detected from the first bytes, so renamed files work as well;
+    if path does not exist, path.gz / path.zst are tried.
+    Writing: compression selects the format, path should already carry the suffix.
+    """
+    if 'r' in mode:
+        resolved = resolve_path(path)
+        if resolved is None:
+            raise FileNotFoundError(path)
+        with open(resolved, 'rb') as f:
+            magic = f.read(4)
+        if magic.startswith(GZIP_MAGIC):
+            return gzip.open(resolved, 'rt', errors=errors)
+        if magic == ZSTD_MAGIC:
+            if _zstd is None:
+                raise RuntimeError(f"{resolved} is zstd-compressed but no zstd module is installed")
+            return _zstd.open(resolved, 'rt', errors=errors)
+        return open(resolved, 'r', errors=errors)
+
+    compression = check_compression(compression)
+    if compression == 'gzip':
+        return gzip.open(path, mode if 't' in mode else mode + 't', compresslevel=6)
+    if compression == 'zstd':
+        return _zstd.open(path, mode if 't' in mode else mode + 't')
+    return open(path, mode)
+
+def is_compressed(path):
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    return magic.startswith(GZIP_MAGIC) or magic == ZSTD_MAGIC
+
+def read_tail(path, nbytes=16384):
+    """
+    Last nbytes of a text file as a string. Uncompressed files are read with a single seek
+    from the end; compressed files have to be decompressed as a stream (only nbytes are kept).
+    """
+    resolved = resolve_path(path)
+    if resolved is None:
+        raise FileNotFoundError(path)
+    if not is_compressed(resolved):
+        with open(resolved, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - nbytes))
+            return f.read().decode(errors='ignore')
+    tail = ''
+    with open_text(resolved) as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                return tail
+            tail = (tail + chunk)[-nbytes:]
+
+def file_contains(path, text):
+    """
+    True if text occurs in the file. Uncompressed files are memory-mapped and searched
+    backwards (markers near the end are found without touching the rest of the file).
+    """
+    resolved = resolve_path(path)
+    if resolved is None:
+        raise FileNotFoundError(path)
+    if not is_compressed(resolved):
+        with open(resolved, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return m.rfind(text.encode()) != -1
+    with open_text(resolved) as f:
+        return any(text in line for line in f)
+
+def compress_file(path, compression='gzip', remove_original=True):
+    """Compress an existing file next to itself (written to a temporary name first)."""
+    target = compressed_name(path, compression)
+    tmp_target = target + '.part'
+    with open(path, 'rb') as src:
+        if check_compression(compression) == 'gzip':
+            dst = gzip.open(tmp_target, 'wb', compresslevel=6)
+        else:
+            dst = _zstd.open(tmp_target, 'wb')
+        with dst:
+            shutil.copyfileobj(src, dst)
+    os.replace(tmp_target, target)
+    if remove_original:
+        os.remove(path)
+    return target
+
+def compress_tree(base_dir, patterns, compression='gzip'):
+    """Compress all files below base_dir matching one of the glob patterns (e.g. '*.out')."""
+    count = 0
+    saved = 0
+    for root, _, files in os.walk(base_dir):
+        for file in files:
+            if not any(fnmatch.fnmatch(file, p) for p in patterns):
+                continue
+            path = os.path.join(root, file)
+            size = os.path.getsize(path)
+            target = compress_file(path, compression)
+            saved += size - os.path.getsize(target)
+            count += 1
+    print(f"Compressed {count} files, saved {saved / 1024 ** 2:.1f} MB")
+    return count, saved
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress existing xTB/GOAT outputs in place")
+    parser.add_argument("dir", help="Directory to search recursively")
+    parser.add_argument("--pattern", "-p", nargs="+", default=["*.out", "*.finalensemble.xyz"],
+                        help="File name patterns to compress (default: *.out *.finalensemble.xyz)")
+    parser.add_argument("--compression", "-c", choices=["gzip", "zstd"], default="gzip")
+    args = parser.parse_args()
+    compress_tree(args.dir, args.pattern, check_compression(args.compression))
+
+if __name__ == "__main__":
+    main()
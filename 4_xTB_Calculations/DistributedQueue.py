@@ -0,0 +1,440 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import socket
+import socketserver
+import threading
+import subprocess
+import argparse
+import logging
+import uuid
+from collections import deque
+
+from OrcaFlotte import OrcaJobQueue, goat_handoff
+from Manifest import find_manifest  # on the path through OrcaFlotte
+from PipelineLogging import setup_logging
+
+logger = logging.getLogger('orca_queue')
+
+# Distributed mode for OrcaFlotte: several OrcaFlotte instances (on different nodes)
+# pull jobs from one shared queue. A job is handed out as a lease that the worker
+# has to renew; leases of dead workers expire and the job is handed out again.
+# The shared queue is either a small TCP coordinator or a lease directory on a
+# shared filesystem, both offer lease()/heartbeat()/complete().
+
+DEFAULT_LEASE_TIMEOUT = 600  # seconds
+SLOT_RETRY_DELAY = 5  # seconds before a failed lease/complete call is repeated (doubled each time)
+SLOT_RETRY_MAX_DELAY = 300  # upper bound of that delay
+
+# --- Shared queue: TCP coordinator ---
+
+class LeaseCoordinator:
+    """In-memory lease bookkeeping used by the TCP coordinator."""
+
+    def __init__(self, jobs, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        self.lease_timeout = lease_timeout
+        self.pending = deque(jobs)
+        self.leases = {}  # job -> (worker_id, expiry)
+        self.finished = {}  # job -> success
+        self.lock = threading.Lock()
+        self.all_done = threading.Event()
+        if not self.pending:
+            self.all_done.set()
+
+    def _expire_leases(self):
+        now = time.time()
+        for job, (worker_id, expiry) in list(self.leases.items()):
+            if expiry < now:
+                logger.warning(f"Lease of {os.path.basename(job)} held by {worker_id} expired, requeueing")
+                del self.leases[job]
+                self.pending.appendleft(job)
+
+    def lease(self, worker_id):
+        with self.lock:
+            self._expire_leases()
+            if self.pending:
+                job = self.pending.popleft()
+                self.leases[job] = (worker_id, time.time() + self.lease_timeout)
+                return {'status': 'job', 'job': job}
+            if self.leases:
+                return {'status': 'wait'}
+            return {'status': 'done'}
+
+    def heartbeat(self, worker_id, job):
+        with self.lock:
+            holder = self.leases.get(job)
+            if holder is None or holder[0] != worker_id:
+                return {'status': 'lost'}
+            self.leases[job] = (worker_id, time.time() + self.lease_timeout)
+            return {'status': 'ok'}
+
+    def complete(self, worker_id, job, success):
+        with self.lock:
+            holder = self.leases.get(job)
+            if holder is not None and holder[0] == worker_id:
+                del self.leases[job]
+            elif job in self.finished or job not in self.pending:
+                # Late result of an expired lease that was already finished elsewhere
+                return {'status': 'ignored'}
+            else:
+                # Expired lease, but this worker finished first: take the result
+                self.pending.remove(job)
+            self.finished[job] = success
+            if not self.pending and not self.leases:
+                self.all_done.set()
+            return {'status': 'ok'}
+
+    def status(self):
+        with self.lock:
+            return {'status': 'ok', 'pending': len(self.pending), 'leased': len(self.leases),
+                    'finished': len(self.finished),
+                    'failed': sum(1 for ok in self.finished.values() if not ok)}
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    """One JSON request per line, one JSON answer per line."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                answer = self.server.dispatch(request)
+            except Exception as e:
+                answer = {'status': 'error', 'error': str(e)}
+            self.wfile.write((json.dumps(answer) + '\n').encode())
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, coordinator):
+        super().__init__(address, CoordinatorHandler)
+        self.coordinator = coordinator
+
+    def dispatch(self, request):
+        command = request.get('command')
+        if command == 'lease':
+            return self.coordinator.lease(request['worker'])
+        if command == 'heartbeat':
+            return self.coordinator.heartbeat(request['worker'], request['job'])
+        if command == 'complete':
+            return self.coordinator.complete(request['worker'], request['job'], request['success'])
+        if command == 'status':
+            return self.coordinator.status()
+        return {'status': 'error', 'error': f"Unknown command: {command}"}
+
+class CoordinatorClient:
+    def __init__(self, address, timeout=30):
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.timeout = timeout
+
+    def _request(self, **request):
+        with socket.create_connection(self.address, timeout=self.timeout) as sock:
+            sock.sendall((json.dumps(request) + '\n').encode())
+            with sock.makefile('r') as f:
+                return json.loads(f.readline())
+
+    def lease(self, worker_id):
+        return self._request(command='lease', worker=worker_id)
+
+    def heartbeat(self, worker_id, job):
+        return self._request(command='heartbeat', worker=worker_id, job=job)
+
+    def complete(self, worker_id, job, success):
+        return self._request(command='complete', worker=worker_id, job=job, success=success)
+
+# --- Shared queue: lease files on a shared filesystem ---
+
+class DirectoryLeaseQueue:
+    """
+    Lease queue in a directory on a shared filesystem:
+      pending/<n>.job  - job not yet taken (file content: path of the input file)
+      leased/<n>.job.<worker>.<token>  - job taken by a worker; the mtime is the last heartbeat
+      done/<n>.job, failed/<n>.job - finished jobs
+    A job is taken by renaming it from pending/ to leased/, which only one worker can do. The
+    holder and a token are part of the leased name, so the holder of an expired lease finds its
+    file gone (heartbeat 'lost', complete 'ignored') even when the job is leased again.
+    """
+
+    def __init__(self, queue_dir, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        self.queue_dir = queue_dir
+        self.lease_timeout = lease_timeout
+        for sub in ('pending', 'leased', 'done', 'failed'):
+            os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+
+    def _path(self, state, name):
+        return os.path.join(self.queue_dir, state, name)
+
+    @staticmethod
+    def _read_job(path):
+        with open(path, 'r') as f:
+            return f.read().strip()
+
+    def fill(self, jobs):
+        start = sum(len(os.listdir(os.path.join(self.queue_dir, sub))) for sub in ('pending', 'leased', 'done', 'failed'))
+        for i, job in enumerate(jobs, start=start):
+            tmp_path = self._path('pending', f"{i:08d}.tmp")
+            with open(tmp_path, 'w') as f:
+                f.write(job)
+            os.replace(tmp_path, self._path('pending', f"{i:08d}.job"))
+        return len(jobs)
+
+    @staticmethod
+    def _job_name(lease):
+        """<n>.job of a leased name <n>.job.<worker>.<token>"""
+        return lease.split('.job', 1)[0] + '.job'
+
+    def _expire_leases(self):
+        now = time.time()
+        for name in os.listdir(os.path.join(self.queue_dir, 'leased')):
+            path = self._path('leased', name)
+            try:
+                if os.path.getmtime(path) + self.lease_timeout < now:
+                    os.rename(path, self._path('pending', self._job_name(name)))
+                    logger.warning(f"Lease {name} expired, requeueing")
+            except FileNotFoundError:
+                pass  # finished or requeued by someone else in the meantime
+
+    def lease(self, worker_id):
+        self._expire_leases()
+        holder = re.sub(r'[^\w.-]', '_', worker_id)
+        for name in sorted(os.listdir(os.path.join(self.queue_dir, 'pending'))):
+            if not name.endswith('.job'):
+                continue
+            lease = f"{name}.{holder}.{uuid.uuid4().hex[:8]}"
+            leased_path = self._path('leased', lease)
+            try:
+                os.rename(self._path('pending', name), leased_path)
+            except FileNotFoundError:
+                continue  # another worker was faster
+            os.utime(leased_path)
+            return {'status': 'job', 'job': self._read_job(leased_path), 'lease': lease}
+        if os.listdir(os.path.join(self.queue_dir, 'leased')):
+            return {'status': 'wait'}
+        return {'status': 'done'}
+
+    def heartbeat(self, worker_id, lease):
+        try:
+            os.utime(self._path('leased', lease))
+            return {'status': 'ok'}
+        except FileNotFoundError:
+            return {'status': 'lost'}
+
+    def complete(self, worker_id, lease, success):
+        try:
+            os.rename(self._path('leased', lease), self._path('done' if success else 'failed', self._job_name(lease)))
+            return {'status': 'ok'}
+        except FileNotFoundError:
+            return {'status': 'ignored'}
+
+# --- Worker side ---
+
+def _call_shared(call, worker_id, description, job_queue, *args):
+    """
+    Call the shared queue until it answers: connection errors and error answers are logged and
+    retried with exponential backoff. Returns None if a shutdown is requested in the meantime.
+    """
+    delay = SLOT_RETRY_DELAY
+    while not job_queue.shutdown_requested:
+        try:
+            answer = call(worker_id, *args)
+            if answer.get('status') != 'error':
+                return answer
+            error = answer.get('error')
+        except (OSError, ValueError) as exc:
+            error = exc
+        logger.error(f"{worker_id}: {description} failed ({error}), retrying in {delay:.0f} s")
+        time.sleep(delay)
+        delay = min(delay * 2, SLOT_RETRY_MAX_DELAY)
+    return None
+
+def _slot_loop(shared_queue, job_queue, worker_id, results, heartbeat_interval):
+    """One job slot of a node: lease a job, run it while renewing the lease, report the result."""
+    while not job_queue.shutdown_requested:
+        answer = _call_shared(shared_queue.lease, worker_id, "lease", job_queue)
+        if answer is None or answer['status'] == 'done':
+            return
+        if answer['status'] != 'job':
+            time.sleep(min(heartbeat_interval, 5))
+            continue
+        job = answer['job']
+        lease = answer.get('lease', job)
+        job_name = os.path.basename(job).replace('.inp', '')
+
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def renew():
+            while not stop.wait(heartbeat_interval):
+                try:
+                    status = shared_queue.heartbeat(worker_id, lease)['status']
+                except (OSError, ValueError) as exc:
+                    # Keep trying until the lease timeout: the coordinator may only be briefly unreachable
+                    logger.warning(f"{worker_id}: heartbeat for {os.path.basename(job)} failed ({exc})")
+                    continue
+                if status == 'lost':
+                    # The job is handed out again: stop ORCA before it overwrites the new holder's files
+                    logger.warning(f"{worker_id} lost the lease of {os.path.basename(job)}, stopping the job")
+                    lost.set()
+                    job_queue.abandon(job_name)
+                    return
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            result = job_queue.run_job(job)
+        except Exception as exc:
+            logger.error(f"{worker_id}: job {os.path.basename(job)} raised: {exc}")
+            result = {'job_name': job_name, 'success': False,
+                      'input_file': job, 'error': str(exc), 'attempt': 0}
+        finally:
+            stop.set()
+            renewer.join()
+            job_queue.abandoned.discard(job_name)
+        if lost.is_set():
+            # The job was handed out again: its new holder reports it, this result is dropped
+            logger.warning(f"{worker_id}: dropping the result of {os.path.basename(job)} (lease lost)")
+            continue
+        answer = _call_shared(shared_queue.complete, worker_id, "complete", job_queue, lease, result['success'])
+        if answer is None or answer['status'] == 'ignored':
+            logger.warning(f"{worker_id}: result of {os.path.basename(job)} not accepted by the shared queue")
+            continue
+        results.put(result)
+
+def run_node(shared_queue, job_queue, node_id, heartbeat_interval):
+    """Run max_workers job slots against the shared queue; results are processed in this thread."""
+    results = queue.Queue()
+    slots = [threading.Thread(target=_slot_loop,
+                              args=(shared_queue, job_queue, f"{node_id}-{i}", results, heartbeat_interval),
+                              daemon=True)
+             for i in range(job_queue.max_workers)]
+    logger.info(f"Node {node_id} pulling jobs with {len(slots)} slots")
+    for slot in slots:
+        slot.start()
+    while any(slot.is_alive() for slot in slots) or not results.empty():
+        try:
+            job_queue.process_result(results.get(timeout=1))
+        except queue.Empty:
+            continue
+    job_queue.commit_tables()
+    logger.info(f"\n--- NODE {node_id} SUMMARY ---")
+    job_queue.print_summary(is_final=True)
+
+def collect_jobs(input_dir):
+    collector = OrcaJobQueue(max_workers=1)
+    collector.add_jobs_from_directory(input_dir)
+    return collector.pending_jobs
+
+def main():
+    # Same logs as OrcaFlotte.py (importing OrcaFlotte no longer configures logging)
+    setup_logging('orca_queue.log', event_file='orca_events.jsonl')
+
+    parser = argparse.ArgumentParser(description="Distributed ORCA job queue (several OrcaFlotte nodes, one shared queue)")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    serve = sub.add_parser("serve", help="Run the TCP coordinator for all .inp files of a directory")
+    serve.add_argument("--input-dir", "-i", required=True)
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=5555)
+    serve.add_argument("--lease-timeout", type=float, default=DEFAULT_LEASE_TIMEOUT)
+
+    init_dir = sub.add_parser("init-dir", help="Fill a lease directory on a shared filesystem")
+    init_dir.add_argument("--input-dir", "-i", required=True)
+    init_dir.add_argument("--queue-dir", "-q", required=True)
+
+    local = sub.add_parser("local", help="Coordinator plus several worker processes on this machine (for testing)")
+    local.add_argument("--input-dir", "-i", required=True)
+    local.add_argument("--port", type=int, default=5555)
+    local.add_argument("--processes", type=int, default=2, help="Number of worker processes to start")
+    local.add_argument("--lease-timeout", type=float, default=DEFAULT_LEASE_TIMEOUT)
+
+    for p in (sub.add_parser("worker", help="Pull and run jobs from a coordinator or lease directory"), local):
+        p.add_argument("--orca-path", "-o", default="C:\\orca6\\orca.exe")
+        p.add_argument("--output-dir", "-d", default=None)
+        p.add_argument("--max-workers", "-w", type=int, default=None, help="Job slots per node (default: CPU count - 1)")
+        p.add_argument("--scratch-dir", "-s", default=None)
+        p.add_argument("--results-db", "-r", default=None)
+        p.add_argument("--compress", choices=["gzip", "zstd"], default=None)
+        p.add_argument("--goat-dir", "-g", default=None, help="Write GOAT inputs as jobs finish (see OrcaFlotte.py)")
+        p.add_argument("--manifest", default=None,
+                       help="Job manifest written by StartUp.py for the xTB status and the 'goat' records "
+                            "(default: manifest.db in the input/output directory or above)")
+        p.add_argument("--heartbeat", type=float, default=None, help="Seconds between lease renewals (default: lease timeout / 3)")
+    worker = sub.choices["worker"]
+    worker.add_argument("--coordinator", "-c", default=None, help="host:port of the coordinator")
+    worker.add_argument("--queue-dir", "-q", default=None, help="Lease directory on a shared filesystem")
+    worker.add_argument("--lease-timeout", type=float, default=DEFAULT_LEASE_TIMEOUT)
+    worker.add_argument("--node-id", default=f"{socket.gethostname()}-{os.getpid()}")
+
+    args = parser.parse_args()
+
+    if args.mode == "init-dir":
+        count = DirectoryLeaseQueue(args.queue_dir).fill(collect_jobs(args.input_dir))
+        logger.info(f"Queued {count} jobs in {args.queue_dir}")
+
+    elif args.mode in ("serve", "local"):
+        coordinator = LeaseCoordinator(collect_jobs(args.input_dir), args.lease_timeout)
+        host = "127.0.0.1" if args.mode == "local" else args.host
+        server = CoordinatorServer((host, args.port), coordinator)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Coordinator listening on {host}:{args.port}")
+
+        workers = []
+        if args.mode == "local":
+            for i in range(args.processes):
+                cmd = [sys.executable, os.path.abspath(__file__), "worker",
+                       "--coordinator", f"127.0.0.1:{args.port}", "--orca-path", args.orca_path,
+                       "--lease-timeout", str(args.lease_timeout), "--node-id", f"local{i}"]
+                for option, value in (("--output-dir", args.output_dir), ("--max-workers", args.max_workers),
+                                      ("--scratch-dir", args.scratch_dir), ("--heartbeat", args.heartbeat),
+                                      ("--compress", args.compress), ("--goat-dir", args.goat_dir),
+                                      ("--manifest", args.manifest or find_manifest(args.input_dir))):
+                    if value is not None:
+                        cmd += [option, str(value)]
+                if args.results_db:
+                    # SQLite cannot be shared safely between nodes: one table per worker process
+                    cmd += ["--results-db", f"{os.path.splitext(args.results_db)[0]}_local{i}.db"]
+                workers.append(subprocess.Popen(cmd))
+
+        exited = set()
+        while not coordinator.all_done.wait(10):
+            logger.info(f"Coordinator status: {coordinator.status()}")
+            # Leases of a worker that died expire and go to the others; without workers nothing would finish
+            for i, proc in enumerate(workers):
+                if i not in exited and proc.poll() is not None:
+                    exited.add(i)
+                    logger.warning(f"Worker local{i} exited with code {proc.returncode}")
+            if workers and len(exited) == len(workers):
+                logger.error(f"All {len(workers)} worker processes exited before the jobs were finished: "
+                             f"{coordinator.status()}")
+                server.shutdown()
+                sys.exit(1)
+        for proc in workers:
+            proc.wait()
+        logger.info(f"All jobs finished: {coordinator.status()}")
+        server.shutdown()
+
+    else:
+        if bool(args.coordinator) == bool(args.queue_dir):
+            parser.error("worker needs exactly one of --coordinator or --queue-dir")
+        shared_queue = (CoordinatorClient(args.coordinator) if args.coordinator
+                        else DirectoryLeaseQueue(args.queue_dir, args.lease_timeout))
+        # Same manifest handling as OrcaFlotte.py (the worker has no input directory of its own)
+        manifest = args.manifest or find_manifest(args.output_dir or '.')
+        if manifest:
+            logger.info(f"Recording job status in manifest {manifest}")
+        job_queue = OrcaJobQueue(orca_path=args.orca_path, max_workers=args.max_workers,
+                                 output_dir=args.output_dir, scratch_dir=args.scratch_dir,
+                                 results_db=args.results_db, compression=args.compress, manifest=manifest)
+        if args.goat_dir:
+            job_queue.on_success = goat_handoff(args.goat_dir, job_queue.manifest)
+        heartbeat = args.heartbeat or args.lease_timeout / 3
+        run_node(shared_queue, job_queue, args.node_id, heartbeat)
+        if job_queue.on_success is not None:
+            logger.info(job_queue.on_success.summary())
+
+if __name__ == "__main__":
+    main()
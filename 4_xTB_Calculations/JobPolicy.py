@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import time
+import logging
+
+logger = logging.getLogger('orca_queue')
+
+ESCALATION_MARKER = "# Escalation"
+
+# --- Escalation steps (applied to the lines of the input file) ---
+
+def double_maxiter(lines):
+    """%geom MaxIter N end -> MaxIter 2N (adds the block if it is missing)"""
+    for i, line in enumerate(lines):
+        match = re.search(r"MaxIter\s+(\d+)", line, re.IGNORECASE)
+        if match:
+            lines[i] = line[:match.start(1)] + str(int(match.group(1)) * 2) + line[match.end(1):]
+            return lines
+    # After the keyword line, or at the top if the input has none
+    keyword_idx = next((i for i, line in enumerate(lines) if line.startswith("!")), -1)
+    lines.insert(keyword_idx + 1, "%geom MaxIter 1000 end")
+    return lines
+
+def add_slowconv(lines):
+    """Add SlowConv to the keyword line (more robust SCF convergence)"""
+    for i, line in enumerate(lines):
+        if line.startswith("!") and "SLOWCONV" not in line.upper():
+            lines[i] = line + " SlowConv"
+            break
+    return lines
+
+def normal_opt(lines):
+    """LooseOpt -> Opt (default convergence criteria)"""
+    for i, line in enumerate(lines):
+        if line.startswith("!"):
+            lines[i] = re.sub(r"\bLooseOpt\b", "Opt", line, flags=re.IGNORECASE)
+            break
+    return lines
+
+ESCALATION_STEPS = {
+    'maxiter': double_maxiter,
+    'slowconv': add_slowconv,
+    'normalopt': normal_opt,
+}
+
+# Escalation applied before retry n (index n-1), per failure class
+DEFAULT_ESCALATIONS = {
+    'no_convergence': ['maxiter', 'normalopt'],
+    'process_error': ['slowconv', 'maxiter'],
+    'timeout': [],  # only the longer time limit
+}
+
+def count_atoms(input_file):
+    """Number of atoms in the * xyz block of an ORCA input"""
+    count = 0
+    in_block = False
+    with open(input_file, 'r') as f:
+        for line in f:
+            stripped = line.strip()
+            if not in_block:
+                in_block = re.match(r"\*\s*xyz", stripped) is not None
+            elif stripped == "*":
+                break
+            elif len(stripped.split()) == 4:
+                count += 1
+    return count
+
+class JobPolicy:
+    """
+    Wall-time limits, retries and escalation rules for the jobs of an OrcaJobQueue.
+    The object only holds plain settings, so it is pickled to the worker processes together with the queue.
+    """
+
+    def __init__(self, base_timeout=None, timeout_per_atom=0.0, timeout_growth=2.0, max_retries=0,
+                 backoff=60.0, backoff_factor=2.0, escalations=None, failure_log='job_failures.jsonl'):
+        """
+        base_timeout (float): Wall-time limit in seconds for a job without atoms (None: no limit)
+        timeout_per_atom (float): Seconds added to the limit per atom of the input
+        timeout_growth (float): Factor applied to the limit for every retry
+        max_retries (int): Retries per job after the first attempt
+        backoff (float): Delay in seconds before the first retry, multiplied by backoff_factor for every further retry
+        escalations (dict): failure class -> list of escalation steps (see ESCALATION_STEPS)
+        failure_log (str): JSON lines file with the final classification of every failed or retried job
+        """
+        self.base_timeout = base_timeout
+        self.timeout_per_atom = timeout_per_atom
+        self.timeout_growth = timeout_growth
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.escalations = DEFAULT_ESCALATIONS if escalations is None else escalations
+        self.failure_log = failure_log
+
+    def timeout_for(self, input_file, attempt=0):
+        if self.base_timeout is None:
+            return None
+        limit = self.base_timeout + self.timeout_per_atom * count_atoms(input_file)
+        return limit * self.timeout_growth ** attempt
+
+    @staticmethod
+    def classify(result):
+        if result.get('success'):
+            return 'success'
+        if result.get('timed_out'):
+            return 'timeout'
+        if result.get('error') == 'Shutdown requested':
+            return 'shutdown'
+        if 'error' in result:
+            return 'setup_error'  # e.g. ORCA executable not found, nothing to retry
+        if result.get('process_success'):
+            return 'no_convergence'
+        return 'process_error'
+
+    def should_retry(self, result, attempt):
+        return attempt < self.max_retries and self.classify(result) in ('timeout', 'no_convergence', 'process_error')
+
+    def retry_delay(self, attempt):
+        return self.backoff * self.backoff_factor ** attempt
+
+    def escalate(self, input_file, attempt, failure_class, lines=None):
+        """
+        Escalated input for retry number `attempt` (1, 2, ...) according to the escalation rules.
+        lines: input of the previous attempt (None: the original input file). The input file itself is not
+        changed, the escalated lines are run on a private copy (see OrcaJobQueue.run_job).
+        The applied step is recorded as a comment at the top. Returns (step or None, lines).
+        """
+        steps = self.escalations.get(failure_class, [])
+        if attempt > len(steps):
+            return None, lines
+        step = steps[attempt - 1]
+        if lines is None:
+            with open(input_file, 'r') as f:
+                lines = f.read().splitlines()
+        lines = ESCALATION_STEPS[step](list(lines))
+        lines.insert(0, f"{ESCALATION_MARKER} {attempt}: {step} (after {failure_class})")
+        logger.info(f"Escalated {os.path.basename(input_file)} for retry {attempt}: {step}")
+        return step, lines
+
+    def record_outcome(self, result, attempts):
+        """Append the final classification of a job that failed or needed retries to the failure log."""
+        failure_class = self.classify(result)
+        result['failure_class'] = failure_class
+        result['attempts'] = attempts
+        if not self.failure_log or (failure_class == 'success' and attempts == 1):
+            return failure_class
+        entry = {
+            'job_name': result.get('job_name'),
+            'input_file': result.get('input_file'),
+            'final_class': failure_class,
+            'attempts': attempts,
+            'history': result.get('history', []),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with open(self.failure_log, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        return failure_class
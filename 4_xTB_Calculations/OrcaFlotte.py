@@ -10,20 +10,46 @@ from datetime import datetime
 import pathlib
 import signal
 import sys
+import shutil
+import tempfile
+import heapq
+import queue
+
+from XTBResults import ResultsTable, parse_xtb_output
+from QueueMetrics import QueueMetrics
+from JobPolicy import JobPolicy
+from CompressedIO import check_compression, compressed_name, has_extension, open_text
+from PipelineLogging import setup_logging, worker_logging, log_event, log_sampled
+
+# The job manifest is written by StartUp.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "3_Complex_Generator"))
+from Manifest import Manifest, find_manifest
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('orca_queue.log')
-    ]
-)
 logger = logging.getLogger('orca_queue')
+events = logging.getLogger('orca_queue.events')
+
+def kill_process_tree(process):
+    """Kill ORCA together with the programs it started (xtb, MPI ranks), which hold its output pipe open"""
+    try:
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    process.kill()
+
+def goat_handoff(goat_dir, manifest=None, node=None):
+    """GOAT input writer of XTBzuGOAT.py for OrcaJobQueue(on_success=...), only imported when used"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "5_GOAT_Calculations"))
+    from XTBzuGOAT import GoatHandoff
+    from GoatResources import DEFAULT_NODE, parse_node
+    return GoatHandoff(goat_dir, parse_node(node) if node else DEFAULT_NODE, manifest)
 
 class OrcaJobQueue:
-    def __init__(self, orca_path=None, max_workers=None, output_dir=None):
+    def __init__(self, orca_path=None, max_workers=None, output_dir=None, scratch_dir=None, keep_inp=False,
+                 results_db=None, metrics_file=None, metrics_interval=60, metrics_port=None, policy=None,
+                 compression=None, manifest=None, on_success=None):
         """
         Initialize the ORCA job queue.
         
@@ -31,6 +57,18 @@ class OrcaJobQueue:
         orca_path (str): Path to the ORCA executable
         max_workers (int): Maximum number of parallel jobs (default: CPU count - 1)
         output_dir (str): Directory for output files (default: same as input files)
+        scratch_dir (str): Local directory (e.g. /dev/shm or node-local disk) in which every job
+                           runs in its own private subdirectory (default: run next to the input file)
+        keep_inp (bool): In scratch mode, also copy the input file back to the output directory
+        results_db (str): SQLite results table in which every finished job is recorded (default: none)
+        metrics_file (str): JSON lines file for periodic queue metrics (default: none)
+        metrics_interval (float): Seconds between two metrics snapshots
+        metrics_port (int): Serve Prometheus metrics on http://127.0.0.1:<port>/metrics (default: off)
+        policy (JobPolicy): Time limits, retries and escalation rules (default: no limit, no retries)
+        compression (str): Write the .out files compressed ('gzip' or 'zstd', default: uncompressed)
+        manifest (str): Job manifest written by StartUp.py; the xTB status of every job is recorded in it
+        on_success (callable): Called with the result of every successful job in the main process,
+                               e.g. XTBzuGOAT.GoatHandoff to write GOAT inputs while xTB jobs are still running
         """
         # Determine number of cores
         if max_workers is None:
@@ -42,6 +80,25 @@ class OrcaJobQueue:
         
         # Set output directory
         self.output_dir = output_dir
+
+        # Set local scratch directory
+        self.scratch_dir = scratch_dir
+        self.keep_inp = keep_inp
+
+        # Compression of the output files
+        self.compression = check_compression(compression)
+
+        # Results table (only used in the main process)
+        self.results_table = ResultsTable(results_db) if results_db else None
+        self.manifest = Manifest(manifest) if manifest else None
+        self.on_success = on_success
+
+        # Time limits, retries and escalation
+        self.policy = policy if policy is not None else JobPolicy()
+
+        # Queue metrics (only used in the main process)
+        self.metrics = QueueMetrics(self.max_workers, json_path=metrics_file,
+                                    interval=metrics_interval, http_port=metrics_port)
         
         # Initialize job lists
         self.pending_jobs = []
@@ -50,12 +107,20 @@ class OrcaJobQueue:
 
         # Add tracking for active processes
         self.active_processes = {}
+        self.abandoned = set()  # jobs whose result is no longer wanted (DistributedQueue: lease lost)
         self.shutdown_requested = False
         
         # Set up signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, self.handle_shutdown)
         signal.signal(signal.SIGTERM, self.handle_shutdown)
 
+    def abandon(self, job_name):
+        """Stop a running job whose result is no longer wanted; run_job then writes no output for it"""
+        self.abandoned.add(job_name)
+        process = self.active_processes.get(job_name)
+        if process is not None:
+            kill_process_tree(process)
+
     def handle_shutdown(self, sig, frame):
         """Handle shutdown signals gracefully"""
         if self.shutdown_requested:
@@ -69,17 +134,31 @@ class OrcaJobQueue:
         for job_name, proc in self.active_processes.items():
             logger.info(f"Terminating process for job {job_name}")
             try:
-                proc.terminate()
+                kill_process_tree(proc)
             except:
                 pass
         
         logger.info("Shutdown complete. Exiting.")
         sys.exit(0)
 
+    def __getstate__(self):
+        # The queue is pickled for every job submitted to the worker processes,
+        # the database connection, the metrics threads and the job lists stay in the main process
+        # (pickling the growing result lists for every job made dispatching quadratic)
+        state = self.__dict__.copy()
+        state['results_table'] = None
+        state['manifest'] = None
+        state['on_success'] = None
+        state['metrics'] = None
+        state['pending_jobs'] = []
+        state['completed_jobs'] = []
+        state['failed_jobs'] = []
+        return state
+
     def add_job(self, input_file):
         """Add a job to the queue"""
         self.pending_jobs.append(input_file)
-        logger.info(f"Added job to queue: {os.path.basename(input_file)}")
+        logger.debug(f"Added job to queue: {os.path.basename(input_file)}")
     
     def add_jobs_from_directory(self, base_dir, recursive=True):
         """
@@ -102,6 +181,7 @@ class OrcaJobQueue:
             input_files = glob.glob(os.path.join(base_dir, '*.inp'))
 
         added_count = 0
+        skip_counts = {}
         for input_file in input_files:
             base_name = os.path.splitext(os.path.basename(input_file))[0]
             xyz_file = os.path.join(os.path.dirname(input_file), f"{base_name}.xyz")
@@ -111,15 +191,16 @@ class OrcaJobQueue:
                 self.add_job(input_file)
                 added_count += 1
             else:
-                logger.info(f"Überspringe Job für {base_name}, da {xyz_file} bereits existiert.")
+                log_sampled(logger, skip_counts, 'skipped', f"Überspringe Job für {base_name}, da {xyz_file} bereits existiert.")
 
-        logger.info(f"Added {added_count} jobs from directory '{base_dir}' (recursive={recursive})")
+        self.log_added_jobs(f"directory '{base_dir}' (recursive={recursive})", added_count, skip_counts.get('skipped', 0))
         return added_count
     
     def add_jobs_from_glob(self, pattern):
         """Add multiple jobs using a glob pattern"""
         input_files = glob.glob(pattern, recursive=True)
         added_count = 0
+        skip_counts = {}
         for input_file in input_files:
             base_name = os.path.splitext(os.path.basename(input_file))[0]
             xyz_file = os.path.join(os.path.dirname(input_file), f"{base_name}.xyz")
@@ -127,23 +208,32 @@ class OrcaJobQueue:
                 self.add_job(input_file)
                 added_count += 1
             else:
-                logger.info(f"Überspringe Job für {base_name}, da {xyz_file} bereits existiert.")
-        logger.info(f"Added {added_count} jobs from pattern '{pattern}'")
+                log_sampled(logger, skip_counts, 'skipped', f"Überspringe Job für {base_name}, da {xyz_file} bereits existiert.")
+        self.log_added_jobs(f"pattern '{pattern}'", added_count, skip_counts.get('skipped', 0))
         return added_count
+
+    def log_added_jobs(self, source, added_count, skipped_count):
+        """One summary line (and one event) per scan instead of one line per file"""
+        if skipped_count:
+            logger.info(f"Skipped {skipped_count} jobs whose .xyz file already exists")
+        logger.info(f"Added {added_count} jobs from {source}")
+        log_event(events, 'jobs_added', source=source, added=added_count, skipped=skipped_count)
     
-    def run_job(self, input_file):
+    def run_job(self, input_file, attempt=0, input_lines=None):
         """
         Run a single ORCA calculation job.
         
         Parameters:
         input_file (str): Path to the ORCA input file
+        attempt (int): Number of previous attempts (scales the wall-time limit)
+        input_lines (list): Escalated input of a retry (see JobPolicy.escalate), run on a private copy
         
         Returns:
         dict: Result information including success status and output path
         """
         if self.shutdown_requested:
             return {'job_name': os.path.basename(input_file).replace('.inp', ''), 
-                    'success': False, 'error': 'Shutdown requested'}
+                    'success': False, 'error': 'Shutdown requested', 'input_file': input_file, 'attempt': attempt}
 
         job_name = os.path.basename(input_file).replace('.inp', '')
         start_time = time.time()  # Define start time for job execution tracking
@@ -153,7 +243,9 @@ class OrcaJobQueue:
         os.makedirs(output_dir, exist_ok=True)
         
         # Prepare output file path
-        output_file = os.path.join(output_dir, f"{job_name}.out")
+        output_name = compressed_name(f"{job_name}.out", self.compression)
+        output_file = os.path.join(output_dir, output_name)
+        scratch = None
         
         try:
             # Check if ORCA path exists
@@ -165,8 +257,18 @@ class OrcaJobQueue:
             orca_dir = os.path.dirname(self.orca_path)
             env['PATH'] = f"{orca_dir};{env.get('PATH', '')}"
             
-            # Change to the directory of the input file
+            # Change to the directory of the input file, or to a private scratch directory
+            # (escalated retries always run on a private copy, the original input stays unchanged)
             working_dir = os.path.dirname(input_file)
+            if self.scratch_dir or input_lines is not None:
+                if self.scratch_dir:
+                    os.makedirs(self.scratch_dir, exist_ok=True)
+                scratch = tempfile.mkdtemp(prefix=f"{job_name}_", dir=self.scratch_dir)
+                shutil.copy2(input_file, scratch)
+                if input_lines is not None:
+                    with open(os.path.join(scratch, os.path.basename(input_file)), 'w') as f:
+                        f.write('\n'.join(input_lines) + '\n')
+                working_dir = scratch
             
             # Run ORCA with the input file and redirect output
             process = subprocess.Popen(
@@ -174,31 +276,53 @@ class OrcaJobQueue:
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 universal_newlines=True,
-                cwd=working_dir,  # Run from the input file's directory
-                env=env
+                cwd=working_dir,  # Run from the input file's directory (or the scratch directory)
+                env=env,
+                start_new_session=(os.name != 'nt')  # own process group, so a timeout can kill all of it
             )
             
             # Store the process in active_processes
             self.active_processes[job_name] = process
+            if job_name in self.abandoned:
+                kill_process_tree(process)  # abandoned while it was being started
             
-            stdout, stderr = process.communicate()
+            # Kill the process if it exceeds its wall-time limit
+            timeout = self.policy.timeout_for(input_file, attempt)
+            timed_out = False
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                kill_process_tree(process)
+                stdout, stderr = process.communicate()
+                timed_out = True
             
             # Remove from active processes
             self.active_processes.pop(job_name, None)
+
+            if job_name in self.abandoned:
+                # Another worker runs this job now: leave its output alone
+                logger.warning(f"Job {job_name} abandoned, output discarded")
+                return {'job_name': job_name, 'success': False, 'error': 'Abandoned', 'input_file': input_file,
+                        'attempt': attempt}
             
-            # Write output to file
-            with open(output_file, 'w') as f:
+            # Write output to file (inside the scratch directory in scratch mode)
+            job_output_file = os.path.join(scratch, output_name) if scratch else output_file
+            with open_text(job_output_file, 'w', self.compression) as f:
                 f.write(stdout)
             
             # Write errors if any
             if stderr:
-                with open(f"{output_file}.err", 'w') as f:
+                with open(os.path.join(os.path.dirname(job_output_file), f"{job_name}.out.err"), 'w') as f:
                     f.write(stderr)
+
+            if scratch:
+                self.copy_back_results(scratch, job_name, input_file, output_dir)
             
             elapsed_time = time.time() - start_time
             
-            # Check for "HURRAY" in the output file to determine success
-            hurray_found = "HURRAY" in stdout
+            # Parse the output in memory, "HURRAY" determines success
+            parsed = parse_xtb_output(stdout.splitlines())
+            hurray_found = parsed['hurray_found']
             process_success = process.returncode == 0
             
             # Success only if both return code is 0 and HURRAY is found
@@ -213,16 +337,24 @@ class OrcaJobQueue:
                 'output_file': output_file,
                 'time_taken': elapsed_time,
                 'return_code': process.returncode,
+                'timed_out': timed_out,
+                'attempt': attempt,
                 'completion_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
+            result.update(parsed)
             
-            if success:
+            if timed_out:
+                status = f"timed out after {timeout:.0f} s"
+            elif success:
                 status = "completed successfully (HURRAY found)"
             elif process_success:
                 status = "completed but without HURRAY"
             else:
                 status = "failed with return code " + str(process.returncode)
-            logger.info(f"Job {job_name} {status} in {elapsed_time:.2f} seconds")
+            if success:
+                logger.debug(f"Job {job_name} {status} in {elapsed_time:.2f} seconds")
+            else:
+                logger.warning(f"Job {job_name} {status} in {elapsed_time:.2f} seconds")
             
             return result
             
@@ -239,17 +371,70 @@ class OrcaJobQueue:
                 'hurray_found': False,
                 'input_file': input_file,
                 'error': error_msg,
+                'attempt': attempt,
                 'completion_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
+
+        finally:
+            # Remove the whole scratch directory in one operation
+            if scratch:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+    def copy_back_results(self, scratch, job_name, input_file, output_dir):
+        """
+        Copy the whitelisted result files of a job from its scratch directory back to the shared filesystem.
+        Each file is first copied next to its destination and then renamed, so readers never see partial files.
+        The .xyz file goes next to the input file, where the unscratched run would have written it.
+        """
+        copies = [
+            (compressed_name(f"{job_name}.out", self.compression), output_dir),
+            (f"{job_name}.out.err", output_dir),
+            (f"{job_name}.xyz", os.path.dirname(input_file)),
+        ]
+        if self.keep_inp and os.path.abspath(output_dir) != os.path.abspath(os.path.dirname(input_file)):
+            copies.append((f"{job_name}.inp", output_dir))
+
+        for file_name, dest_dir in copies:
+            src = os.path.join(scratch, file_name)
+            if not os.path.isfile(src):
+                continue
+            dest = os.path.join(dest_dir, file_name)
+            tmp_dest = f"{dest}.part"
+            shutil.copyfile(src, tmp_dest)
+            os.replace(tmp_dest, dest)
     
     def process_result(self, result):
         """Process a completed job result"""
+        self.policy.record_outcome(result, result.get('attempt', 0) + 1)
+        self.metrics.job_finished(result)
+        log_event(events, 'job_finished', **result)
+        if self.results_table is not None:
+            self.results_table.add_result(result)
+        if self.manifest is not None:
+            self.manifest.set_status(result['job_name'], 'xtb_success' if result['success'] else 'xtb_failed')
         if result['success']:
             self.completed_jobs.append(result)
-            # Clean up files for successful jobs
-            self.cleanup_job_files(result)
+            # Clean up files for successful jobs (nothing to clean up when the job ran in scratch)
+            if not self.scratch_dir:
+                self.cleanup_job_files(result)
+            # Hand the job on to the next stage (a failing hook must not stop the queue)
+            if self.on_success is not None:
+                try:
+                    self.on_success(result)
+                except Exception as e:
+                    logger.error(f"Hand-off of {result['job_name']} failed: {str(e)}")
         else:
             self.failed_jobs.append(result)
+        # Commit right away, an open transaction would lock other stages out of the manifest for the whole run
+        if self.manifest is not None:
+            self.manifest.commit()
+
+    def commit_tables(self):
+        """Write pending rows of the results table and the manifest"""
+        if self.results_table is not None:
+            self.results_table.commit()
+        if self.manifest is not None:
+            self.manifest.commit()
 
     def cleanup_job_files(self, job_info):
         """Clean up unnecessary files after job completion"""
@@ -266,14 +451,14 @@ class OrcaJobQueue:
             
             # Check each file
             for file in all_files:
-                # If the file doesn't end with .out, .inp, or .xyz, delete it
-                if not (file.endswith('.out') or file.endswith('.inp') or file.endswith('.xyz')):
+                # If the file doesn't end with .out, .inp, or .xyz (possibly compressed), delete it
+                if not (has_extension(file, '.out') or file.endswith('.inp') or has_extension(file, '.xyz')):
                     file_path = os.path.join(job_dir, file)
                     os.remove(file_path)
                     deleted_files.append(file)
             
             if deleted_files:
-                logger.info(f"Cleaned up {len(deleted_files)} files for job {base_name}: {', '.join(deleted_files)}")
+                logger.debug(f"Cleaned up {len(deleted_files)} files for job {base_name}: {', '.join(deleted_files)}")
         
         except Exception as e:
             logger.error(f"Error cleaning up files for {job_info['job_name']}: {str(e)}")
@@ -295,15 +480,75 @@ class OrcaJobQueue:
         processed_jobs = 0
         summary_interval = 200  # Print summary every 200 jobs
         
-        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all jobs and get the futures
-            futures = [executor.submit(self.run_job, job) for job in jobs_to_process]
+        self.metrics.start()
+        
+        attempts = {}  # input file -> number of finished attempts
+        history = {}   # input file -> classification of the failed attempts
+        escalated = {}  # input file -> escalated input lines for its next attempt
+        retry_heap = []  # (time at which the retry may start, input file)
+        
+        # Finished futures are put on a queue by a callback, which keeps collecting a result O(1)
+        # (waiting on the whole set of futures for the first completed one is O(number of jobs))
+        done_queue = queue.Queue()
+        futures = {}
+        
+        with ProcessPoolExecutor(max_workers=self.max_workers, **worker_logging()) as executor:
+            def submit(job, attempt=0):
+                future = executor.submit(self.run_job, job, attempt, escalated.get(job))
+                futures[future] = job
+                future.add_done_callback(done_queue.put)
+            
+            # Submit all jobs
+            for job in jobs_to_process:
+                submit(job)
+            self.metrics.jobs_submitted(len(futures))
             
-            # Process results as they complete
-            for future in futures:
+            # Process results as they complete, resubmitting failed jobs after their backoff delay
+            while futures or retry_heap:
+                now = time.time()
+                while retry_heap and retry_heap[0][0] <= now:
+                    _, job = heapq.heappop(retry_heap)
+                    submit(job, attempts[job])
+                if not futures:
+                    time.sleep(max(0.0, retry_heap[0][0] - now))
+                    continue
+                wait_time = max(0.0, retry_heap[0][0] - now) if retry_heap else None
                 try:
-                    result = future.result()
-                    self.process_result(result)
+                    done = [done_queue.get(timeout=wait_time)]
+                except queue.Empty:
+                    continue
+                
+                for future in done:
+                    job = futures.pop(future)
+                    try:
+                        result = future.result()
+                        attempt = attempts.get(job, 0)
+                        attempts[job] = attempt + 1
+                        
+                        if self.policy.should_retry(result, attempt):
+                            failure_class = self.policy.classify(result)
+                            step, escalated[job] = self.policy.escalate(job, attempt + 1, failure_class,
+                                                                        escalated.get(job))
+                            history.setdefault(job, []).append({'attempt': attempt + 1, 'class': failure_class,
+                                                                'next_escalation': step})
+                            delay = self.policy.retry_delay(attempt)
+                            logger.warning(f"Retrying {result['job_name']} ({failure_class}) in {delay:.0f} s "
+                                           f"(retry {attempt + 1}/{self.policy.max_retries})")
+                            heapq.heappush(retry_heap, (time.time() + delay, job))
+                            continue
+                    except Exception as exc:
+                        # The job still counts as failed (job lists, manifest, failure log)
+                        logger.error(f"Job processing exception for {os.path.basename(job)}: {exc}")
+                        result = {'job_name': os.path.basename(job).replace('.inp', ''), 'success': False,
+                                  'input_file': job, 'error': f"Job processing exception: {exc}",
+                                  'attempt': max(attempts.get(job, 1) - 1, 0)}
+                    
+                    escalated.pop(job, None)
+                    result['history'] = history.pop(job, [])
+                    try:
+                        self.process_result(result)
+                    except Exception as exc:
+                        logger.error(f"Processing the result of {result['job_name']} failed: {exc}")
                     
                     # Count processed jobs
                     processed_jobs += 1
@@ -316,11 +561,10 @@ class OrcaJobQueue:
                     if processed_jobs % summary_interval == 0:
                         logger.info(f"\n--- INTERMEDIATE SUMMARY (after {processed_jobs}/{total_jobs} jobs) ---")
                         self.print_summary(is_final=False)
-                        
-                except Exception as exc:
-                    logger.error(f"Job processing exception: {exc}")
-                    processed_jobs += 1
         
+        self.metrics.stop()
+        self.commit_tables()
+
         # Print final summary after completion
         logger.info("\n--- FINAL JOB SUMMARY ---")
         self.print_summary(is_final=True)
@@ -342,11 +586,13 @@ class OrcaJobQueue:
         
         # Count jobs that had process errors
         process_error_count = failed_count - without_hurray_count
+        timed_out_count = len([j for j in self.failed_jobs if j.get('timed_out', False)])
         
         logger.info(f"Total jobs processed: {completed_count + failed_count}")
         logger.info(f"Successful jobs (HURRAY found): {completed_count}")
         logger.info(f"Jobs completed but without HURRAY: {without_hurray_count}")
         logger.info(f"Jobs failed with process errors: {process_error_count}")
+        logger.info(f"Jobs killed after their wall-time limit: {timed_out_count}")
         logger.info(f"Pending jobs: {len(self.pending_jobs)}")
         
         # For intermediate summaries, don't show detailed error lists
@@ -363,10 +609,13 @@ class OrcaJobQueue:
         if process_errors:
             logger.warning("\nJobs with process errors:")
             for job in process_errors:
-                error_msg = job.get('error', 'Unknown error')
+                error_msg = 'wall-time limit exceeded' if job.get('timed_out') else job.get('error', 'Unknown error')
                 logger.warning(f"  - {job['job_name']}: {error_msg}")
 
 def main():
+    # Configure logging (asynchronous, human-readable log and machine-readable event log)
+    setup_logging('orca_queue.log', event_file='orca_events.jsonl')
+
     parser = argparse.ArgumentParser(description="ORCA Job Queue Manager")
     parser.add_argument("--orca-path", "-o", type=str, default="C:\\orca6\\orca.exe",
                         help="Path to the ORCA executable (default: C:\\orca6\\orca.exe)")
@@ -380,15 +629,67 @@ def main():
                         help=f"Maximum number of parallel jobs (default: CPU count - 1)")
     parser.add_argument("--no-recursive", action="store_true",
                         help="Do not search recursively in subdirectories")
+    parser.add_argument("--scratch-dir", "-s", type=str, default=None,
+                        help="Run every job in a private subdirectory of this local directory (e.g. /dev/shm) "
+                             "and only copy .out/.xyz back (default: run next to the input files)")
+    parser.add_argument("--results-db", "-r", type=str, default=None,
+                        help="SQLite results table for energies, gaps, cycles and timings of all jobs (default: none)")
+    parser.add_argument("--metrics-file", type=str, default=None,
+                        help="JSON lines file for periodic queue metrics, e.g. orca_metrics.jsonl (default: none)")
+    parser.add_argument("--metrics-interval", type=float, default=60,
+                        help="Seconds between two metrics snapshots (default: 60)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics (default: off)")
+    parser.add_argument("--timeout-base", type=float, default=None,
+                        help="Wall-time limit per job in seconds before adding the per-atom part (default: no limit)")
+    parser.add_argument("--timeout-per-atom", type=float, default=0.0,
+                        help="Seconds added to the wall-time limit per atom of the input (default: 0)")
+    parser.add_argument("--max-retries", type=int, default=0,
+                        help="Retries per failed or timed-out job with escalated settings (default: 0)")
+    parser.add_argument("--retry-backoff", type=float, default=60.0,
+                        help="Delay before the first retry in seconds, doubled for every further retry (default: 60)")
+    parser.add_argument("--failure-log", type=str, default="job_failures.jsonl",
+                        help="JSON lines file with the final classification of failed or retried jobs")
+    parser.add_argument("--compress", choices=["gzip", "zstd"], default=None,
+                        help="Write the .out files compressed (zstd falls back to gzip if not installed)")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="Job manifest written by StartUp.py (default: manifest.db in the input directory or above)")
+    parser.add_argument("--keep-inp", action="store_true",
+                        help="In scratch mode, also copy the input file back to the output directory")
+    parser.add_argument("--goat-dir", "-g", type=str, default=None,
+                        help="Write the GOAT input of every successful job to this directory as soon as it "
+                             "finishes (see XTBzuGOAT.py; default: off, run XTBzuGOAT afterwards)")
+    parser.add_argument("--goat-node", type=str, default=None,
+                        help="Cluster node the GOAT jobs are sized for, 'cores,memory_GB' (default: 8,32)")
     
     args = parser.parse_args()
+
+    manifest = args.manifest or find_manifest(args.input_dir or '.')
+    if manifest:
+        logger.info(f"Recording job status in manifest {manifest}")
     
     # Create job queue
     job_queue = OrcaJobQueue(
         orca_path=args.orca_path,
         max_workers=args.max_workers,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        scratch_dir=args.scratch_dir,
+        keep_inp=args.keep_inp,
+        results_db=args.results_db,
+        metrics_file=args.metrics_file,
+        metrics_interval=args.metrics_interval,
+        metrics_port=args.metrics_port,
+        policy=JobPolicy(base_timeout=args.timeout_base, timeout_per_atom=args.timeout_per_atom,
+                         max_retries=args.max_retries, backoff=args.retry_backoff,
+                         failure_log=args.failure_log),
+        compression=args.compress,
+        manifest=manifest
     )
+    handoff = None
+    if args.goat_dir:
+        handoff = goat_handoff(args.goat_dir, job_queue.manifest, args.goat_node)
+        job_queue.on_success = handoff
+        logger.info(f"Writing GOAT inputs to {args.goat_dir} as jobs finish")
     
     # Add jobs based on input method
     num_jobs = 0
@@ -411,6 +712,8 @@ def main():
     
     # Run all jobs
     job_queue.run_all_jobs()
+    if handoff is not None:
+        logger.info(handoff.summary())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
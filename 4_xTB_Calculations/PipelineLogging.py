@@ -0,0 +1,125 @@
+import json
+import time
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+class EventFilter(logging.Filter):
+    """Lets only event records (or only non-event records) through."""
+
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def filter(self, record):
+        return hasattr(record, 'event') == self.events
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes at most max_per_second INFO/DEBUG records per second to the console handler.
+    Warnings and errors always pass; the number of dropped records is reported by the handler
+    on a line of its own (the record itself is shared with the file handler and left unchanged).
+    """
+
+    def __init__(self, max_per_second=20):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.window_start = 0.0
+        self.in_window = 0
+        self.suppressed = 0
+
+    def filter(self, record):
+        now = time.time()
+        if now - self.window_start >= 1.0:
+            self.window_start = now
+            self.in_window = 0
+        if record.levelno < logging.WARNING and self.in_window >= self.max_per_second:
+            self.suppressed += 1
+            return False
+        self.in_window += 1
+        return True
+
+class RateLimitedStreamHandler(logging.StreamHandler):
+    """Console handler with a RateLimitFilter; writes '(n messages suppressed)' before the next passed record."""
+
+    def __init__(self, max_per_second=20):
+        super().__init__()
+        self.rate_limit = RateLimitFilter(max_per_second)
+        self.addFilter(self.rate_limit)
+
+    def emit(self, record):
+        if self.rate_limit.suppressed:
+            self.stream.write(f"({self.rate_limit.suppressed} messages suppressed){self.terminator}")
+            self.rate_limit.suppressed = 0
+        super().emit(record)
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': round(record.created, 3), 'event': record.event}
+        entry.update(record.fields)
+        return json.dumps(entry, default=str)
+
+def setup_logging(log_file, event_file=None, level=logging.INFO, max_per_second=20):
+    """
+    Configure non-blocking logging for a pipeline script.
+
+    All records are put on a multiprocessing queue (worker processes log through it, see worker_logging)
+    and written by a listener thread: human-readable messages go to the console and log_file,
+    event records (see log_event) go as JSON lines to event_file.
+    """
+    log_queue = multiprocessing.Queue(-1)
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    # Only the console is rate-limited, the log file keeps every record
+    human_handlers = [RateLimitedStreamHandler(max_per_second), logging.FileHandler(log_file)]
+    for handler in human_handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(EventFilter(events=False))
+    handlers = list(human_handlers)
+
+    if event_file:
+        event_handler = logging.FileHandler(event_file)
+        event_handler.setFormatter(JsonLinesFormatter())
+        event_handler.addFilter(EventFilter(events=True))
+        handlers.append(event_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    attach_worker(log_queue, level)
+    return listener
+
+def attach_worker(log_queue, level=logging.INFO):
+    """Send all records of this process to the listener of setup_logging (also used as process pool initializer)."""
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+
+def worker_logging():
+    """
+    Keyword arguments for a ProcessPoolExecutor whose workers log through the queue of setup_logging.
+    Spawned workers (Windows) do not inherit the handlers; without setup_logging nothing is passed.
+    """
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            return {'initializer': attach_worker, 'initargs': (handler.queue, logging.getLogger().level)}
+    return {}
+
+def log_event(logger, event, **fields):
+    """Record a machine-readable event (only written to the event log)."""
+    logger.info(event, extra={'event': event, 'fields': fields})
+
+def log_sampled(logger, counts, key, message, sample=5):
+    """
+    Log only the first `sample` messages of a kind at INFO level (the rest at DEBUG),
+    counting all of them in counts[key] so a summary can be logged afterwards.
+    """
+    counts[key] = counts.get(key, 0) + 1
+    if counts[key] <= sample:
+        logger.info(message)
+    else:
+        logger.debug(message)
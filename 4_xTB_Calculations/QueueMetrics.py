@@ -0,0 +1,205 @@
+import json
+import time
+import threading
+import logging
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('orca_queue')
+
+# Upper bounds (seconds) of the wall-time histogram buckets
+WALL_TIME_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, float('inf')]
+
+# Window for the "current" throughput (seconds)
+RATE_WINDOW = 300
+
+def job_labels(job_name):
+    """Geometry abbreviation and metal from a StartUp job name, e.g. OC_Fe_2_..._Spin_1 -> ('OC', 'Fe')"""
+    parts = job_name.split('_')
+    geometry = parts[0] if parts else 'UNK'
+    metal = parts[1] if len(parts) > 1 else 'UNK'
+    return geometry, metal
+
+class WallTimeHistogram:
+    def __init__(self):
+        self.counts = [0] * len(WALL_TIME_BUCKETS)
+        self.total = 0.0
+        self.n = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(WALL_TIME_BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+        self.n += 1
+        self.max = max(self.max, seconds)
+
+    def to_dict(self):
+        buckets = {('+Inf' if b == float('inf') else str(b)): c for b, c in zip(WALL_TIME_BUCKETS, self.counts)}
+        return {'count': self.n, 'sum': round(self.total, 3), 'max': round(self.max, 3), 'buckets': buckets}
+
+class QueueMetrics:
+    """
+    Throughput, utilization and latency metrics of an OrcaJobQueue run.
+    Snapshots are appended periodically to a JSON lines file and can optionally
+    be scraped in Prometheus text format from a local HTTP endpoint.
+    """
+
+    def __init__(self, max_workers, json_path=None, interval=60, http_port=None, n_slowest=5):
+        self.max_workers = max_workers
+        self.json_path = json_path
+        self.interval = interval
+        self.http_port = http_port
+        self.n_slowest = n_slowest
+
+        self.lock = threading.Lock()
+        self.start_time = None  # set by start(), so the input scan does not count
+        self.total_jobs = 0
+        self.submitted = 0
+        self.finished = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.recent = deque()  # completion timestamps inside RATE_WINDOW
+        self.by_geometry = defaultdict(WallTimeHistogram)
+        self.by_metal = defaultdict(WallTimeHistogram)
+        self.slowest = []  # (time_taken, job_name)
+
+        self.stop_event = threading.Event()
+        self.emit_thread = None
+        self.http_server = None
+
+    # --- Recording ---
+
+    def jobs_submitted(self, count):
+        with self.lock:
+            self.submitted += count
+            self.total_jobs += count
+
+    def job_finished(self, result):
+        now = time.time()
+        job_name = result.get('job_name', 'UNK')
+        time_taken = result.get('time_taken')
+        geometry, metal = job_labels(job_name)
+        with self.lock:
+            self.finished += 1
+            if not result.get('success', False):
+                self.failed += 1
+            self.recent.append(now)
+            # Jobs that never ran (e.g. exceptions before ORCA started) have no wall time
+            if time_taken is None:
+                return
+            self.busy_seconds += time_taken
+            self.by_geometry[geometry].observe(time_taken)
+            self.by_metal[metal].observe(time_taken)
+            self.slowest.append((time_taken, job_name))
+            self.slowest.sort(reverse=True)
+            del self.slowest[self.n_slowest:]
+
+    # --- Reporting ---
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            while self.recent and self.recent[0] < now - RATE_WINDOW:
+                self.recent.popleft()
+            elapsed = max(now - (self.start_time or now), 1e-9)
+            in_flight = self.submitted - self.finished
+            running = min(in_flight, self.max_workers)
+            return {
+                'timestamp': now,
+                'elapsed_seconds': round(elapsed, 1),
+                'total_jobs': self.total_jobs,
+                'finished_jobs': self.finished,
+                'failed_jobs': self.failed,
+                'failure_rate': round(self.failed / self.finished, 4) if self.finished else 0.0,
+                'jobs_per_minute': round(self.finished / elapsed * 60, 2),
+                'jobs_per_minute_recent': round(len(self.recent) / min(elapsed, RATE_WINDOW) * 60, 2),
+                'queue_depth': in_flight - running,
+                'running_jobs': running,
+                'worker_utilization': round(min(self.busy_seconds / (self.max_workers * elapsed), 1.0), 4),
+                'wall_time_by_geometry': {k: v.to_dict() for k, v in sorted(self.by_geometry.items())},
+                'wall_time_by_metal': {k: v.to_dict() for k, v in sorted(self.by_metal.items())},
+                'slowest_jobs': [{'job_name': name, 'time_taken': round(t, 2)} for t, name in self.slowest],
+            }
+
+    def emit(self):
+        """Append one snapshot to the JSON lines file."""
+        if not self.json_path:
+            return
+        with open(self.json_path, 'a') as f:
+            f.write(json.dumps(self.snapshot()) + '\n')
+
+    def prometheus_text(self):
+        snap = self.snapshot()
+        lines = []
+
+        def gauge(name, value, help_text):
+            lines.append(f"# HELP orca_queue_{name} {help_text}")
+            lines.append(f"# TYPE orca_queue_{name} gauge")
+            lines.append(f"orca_queue_{name} {value}")
+
+        gauge('total_jobs', snap['total_jobs'], 'Jobs submitted to the queue')
+        gauge('finished_jobs', snap['finished_jobs'], 'Jobs finished (successful or not)')
+        gauge('failed_jobs', snap['failed_jobs'], 'Jobs finished without success')
+        gauge('failure_rate', snap['failure_rate'], 'Fraction of finished jobs that failed')
+        gauge('jobs_per_minute', snap['jobs_per_minute_recent'], f'Finished jobs per minute over the last {RATE_WINDOW} s')
+        gauge('queue_depth', snap['queue_depth'], 'Submitted jobs waiting for a worker')
+        gauge('running_jobs', snap['running_jobs'], 'Jobs currently running')
+        gauge('worker_utilization', snap['worker_utilization'], 'Busy worker time / available worker time')
+
+        for label, key in (('geometry', 'wall_time_by_geometry'), ('metal', 'wall_time_by_metal')):
+            name = f"orca_queue_job_seconds_by_{label}"
+            lines.append(f"# HELP {name} Job wall time by {label}")
+            lines.append(f"# TYPE {name} histogram")
+            for value, hist in snap[key].items():
+                cumulative = 0
+                for bound, count in hist['buckets'].items():
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {hist["sum"]}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {hist["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    # --- Background emitters ---
+
+    def start(self):
+        self.start_time = time.time()
+        if self.json_path:
+            self.emit_thread = threading.Thread(target=self._emit_loop, daemon=True)
+            self.emit_thread.start()
+        if self.http_port:
+            metrics = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = metrics.prometheus_text().encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.http_server = ThreadingHTTPServer(('127.0.0.1', self.http_port), MetricsHandler)
+            threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+            logger.info(f"Metrics available at http://127.0.0.1:{self.http_port}/metrics")
+
+    def _emit_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.emit()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.emit_thread is not None:
+            self.emit_thread.join()
+        self.emit()  # final snapshot
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
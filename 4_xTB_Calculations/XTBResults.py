@@ -0,0 +1,185 @@
+import os
+import re
+import sqlite3
+import argparse
+import logging
+
+from CompressedIO import has_extension, open_text, strip_compression_suffix
+
+logger = logging.getLogger('orca_queue')
+
+# --- Streaming parser for xTB/ORCA output files ---
+
+ENERGY_RE = re.compile(r"FINAL SINGLE POINT ENERGY\s+(-?\d+\.\d+)")
+GAP_RE = re.compile(r"HOMO-LUMO GAP\s*:?\s*(-?\d+\.\d+)\s*eV", re.IGNORECASE)
+CYCLE_RE = re.compile(r"GEOMETRY OPTIMIZATION CYCLE\s+(\d+)")
+RUN_TIME_RE = re.compile(r"TOTAL RUN TIME:\s*(\d+) days\s+(\d+) hours\s+(\d+) minutes\s+(\d+) seconds\s+(\d+) msec")
+
+RESULT_COLUMNS = [
+    ("job_name", "TEXT PRIMARY KEY"),
+    ("input_file", "TEXT"),
+    ("output_file", "TEXT"),
+    ("success", "INTEGER"),
+    ("return_code", "INTEGER"),
+    ("final_energy", "REAL"),        # Eh, last FINAL SINGLE POINT ENERGY
+    ("homo_lumo_gap", "REAL"),       # eV, last printed gap
+    ("opt_cycles", "INTEGER"),
+    ("opt_converged", "INTEGER"),
+    ("hurray_found", "INTEGER"),
+    ("terminated_normally", "INTEGER"),
+    ("wall_time", "REAL"),           # seconds, as reported by ORCA
+    ("time_taken", "REAL"),          # seconds, as measured by OrcaFlotte
+    ("attempts", "INTEGER"),
+    ("failure_class", "TEXT"),       # final classification from JobPolicy
+    ("completion_time", "TEXT"),
+]
+
+def parse_xtb_output(lines):
+    """
+    Extract the key results from the lines of an xTB/ORCA output in a single pass.
+    Works on any iterable of lines (open file, stdout.splitlines(), ...), nothing is kept in memory.
+    """
+    parsed = {
+        'final_energy': None,
+        'homo_lumo_gap': None,
+        'opt_cycles': 0,
+        'opt_converged': False,
+        'hurray_found': False,
+        'terminated_normally': False,
+        'wall_time': None,
+    }
+    for line in lines:
+        if "FINAL SINGLE POINT ENERGY" in line:
+            match = ENERGY_RE.search(line)
+            if match:
+                parsed['final_energy'] = float(match.group(1))
+        elif "GAP" in line or "gap" in line:
+            match = GAP_RE.search(line)
+            if match:
+                parsed['homo_lumo_gap'] = float(match.group(1))
+        elif "GEOMETRY OPTIMIZATION CYCLE" in line:
+            match = CYCLE_RE.search(line)
+            if match:
+                parsed['opt_cycles'] = max(parsed['opt_cycles'], int(match.group(1)))
+        elif "THE OPTIMIZATION HAS CONVERGED" in line:
+            parsed['opt_converged'] = True
+        elif "HURRAY" in line:
+            parsed['hurray_found'] = True
+        elif "ORCA TERMINATED NORMALLY" in line:
+            parsed['terminated_normally'] = True
+        elif "TOTAL RUN TIME" in line:
+            match = RUN_TIME_RE.search(line)
+            if match:
+                days, hours, minutes, seconds, msec = (int(x) for x in match.groups())
+                parsed['wall_time'] = ((days * 24 + hours) * 60 + minutes) * 60 + seconds + msec / 1000
+    return parsed
+
+def parse_xtb_output_file(out_path):
+    with open_text(out_path) as f:
+        return parse_xtb_output(f)
+
+# --- Results table ---
+
+class ResultsTable:
+    """
+    SQLite table with one row per xTB job, keyed by job name.
+    Written by OrcaFlotte as results come in and queried by XTBzuGOAT and the analysis scripts.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        columns = ", ".join(f"{name} {sql_type}" for name, sql_type in RESULT_COLUMNS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS results ({columns})")
+        # Tables created by older versions lack the newer columns
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(results)")}
+        for name, sql_type in RESULT_COLUMNS:
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE results ADD COLUMN {name} {sql_type}")
+        self.conn.commit()
+        self.pending = 0
+
+    def add_result(self, result, commit_every=50):
+        """Insert or replace the row of a job from an OrcaFlotte result dict (missing keys become NULL)."""
+        names = [name for name, _ in RESULT_COLUMNS]
+        values = []
+        for name in names:
+            value = result.get(name)
+            values.append(int(value) if isinstance(value, bool) else value)
+        placeholders = ", ".join("?" for _ in names)
+        self.conn.execute(f"INSERT OR REPLACE INTO results ({', '.join(names)}) VALUES ({placeholders})", values)
+        self.pending += 1
+        if self.pending >= commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def get(self, job_name):
+        cursor = self.conn.execute("SELECT * FROM results WHERE job_name = ?", (job_name,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+    def completion_status(self):
+        """Map of job name -> True if the job converged and terminated normally."""
+        cursor = self.conn.execute(
+            "SELECT job_name, hurray_found = 1 AND terminated_normally = 1 FROM results")
+        return {name: bool(ok) for name, ok in cursor.fetchall()}
+
+    def query(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+def import_directory(table, base_dir):
+    """Fill the table from already finished outputs, e.g. for runs made before the table existed."""
+    count = 0
+    for root, _, files in os.walk(base_dir):
+        for file in files:
+            if not has_extension(file, '.out'):
+                continue
+            out_path = os.path.join(root, file)
+            job_name = os.path.splitext(strip_compression_suffix(file))[0]
+            result = parse_xtb_output_file(out_path)
+            result.update({
+                'job_name': job_name,
+                'output_file': out_path,
+                'success': result['hurray_found'],
+            })
+            table.add_result(result)
+            count += 1
+    table.commit()
+    logger.info(f"Imported {count} outputs from '{base_dir}' into {table.db_path}")
+    return count
+
+def print_table_summary(table):
+    total, successful, avg_cycles, avg_time = table.query(
+        "SELECT COUNT(*), SUM(success), AVG(opt_cycles), AVG(wall_time) FROM results")[0]
+    print(f"Jobs in table: {total}")
+    print(f"Successful jobs: {successful or 0}")
+    if avg_cycles is not None:
+        print(f"Average optimization cycles: {avg_cycles:.1f}")
+    if avg_time is not None:
+        print(f"Average ORCA wall time: {avg_time:.1f} s")
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build or inspect the xTB results table")
+    parser.add_argument("db", help="Path to the SQLite results table (e.g. xtb_results.db)")
+    parser.add_argument("--import-dir", "-i", type=str, default=None,
+                        help="Parse all .out files (also compressed) below this directory into the table")
+    args = parser.parse_args()
+
+    table = ResultsTable(args.db)
+    if args.import_dir:
+        import_directory(table, args.import_dir)
+    print_table_summary(table)
+    table.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Storage saved and read-time cost of compressing pipeline outputs.
+
+Synthetic but realistic files are generated: an xTB optimization .out (per-cycle
+SCF/gradient blocks) and a GOAT .finalensemble.xyz (many conformers of the same
+complex). Each file is written uncompressed, with gzip and with zstd (if a zstd
+module is installed), then read back through CompressedIO.open_text the way the
+pipeline scripts do (full readlines and a scan for the completion marker).
+
+Example:
+  python bench_compression.py --cycles 200 --conformers 500 --repeat 5
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from CompressedIO import compressed_name, open_text, zstd_available
+
+ELEMENTS = ["Fe", "C", "O", "N", "H", "P", "S", "Cl"]
+
+def fake_xtb_output(path, n_atoms, cycles, compression=None):
+    rng = random.Random(1)
+    with open_text(path, 'w', compression) as f:
+        f.write("                                 * O   R   C   A *\n\n")
+        for cycle in range(1, cycles + 1):
+            f.write(f"\n                *************************************************\n"
+                    f"                *        GEOMETRY OPTIMIZATION CYCLE {cycle:3d}        *\n"
+                    f"                *************************************************\n")
+            for it in range(1, 12):
+                f.write(f"   {it:3d}    {-42.0 - rng.random() * 1e-3:.10f}  {rng.random() * 1e-4:.7e}"
+                        f"  {rng.random() * 1e-3:.7e}  {rng.random() * 10:.3f}\n")
+            f.write("CARTESIAN GRADIENT\n")
+            for i in range(n_atoms):
+                f.write(f"{i:4d}   {ELEMENTS[i % len(ELEMENTS)]:2s}   :  {rng.uniform(-1e-3, 1e-3):12.9f}"
+                        f"  {rng.uniform(-1e-3, 1e-3):12.9f}  {rng.uniform(-1e-3, 1e-3):12.9f}\n")
+            f.write(f"FINAL SINGLE POINT ENERGY     {-42.0 - cycle * 1e-5:.12f}\n")
+        f.write("\n                    ***               HURRAY                ***\n"
+                "                    ***        THE OPTIMIZATION HAS CONVERGED     ***\n"
+                "                             ****ORCA TERMINATED NORMALLY****\n"
+                "TOTAL RUN TIME: 0 days 0 hours 1 minutes 3 seconds 12 msec\n")
+
+def fake_ensemble(path, n_atoms, conformers, compression=None):
+    rng = random.Random(2)
+    base = [(ELEMENTS[i % len(ELEMENTS)], rng.uniform(-4, 4), rng.uniform(-4, 4), rng.uniform(-4, 4))
+            for i in range(n_atoms)]
+    with open_text(path, 'w', compression) as f:
+        for c in range(conformers):
+            f.write(f"{n_atoms}\n{-42.1 + c * 1e-4:.8f}\n")
+            for el, x, y, z in base:
+                f.write(f"{el:2s} {x + rng.gauss(0, 0.2):14.8f} {y + rng.gauss(0, 0.2):14.8f} "
+                        f"{z + rng.gauss(0, 0.2):14.8f}\n")
+
+def time_reads(path, repeat):
+    """Mean seconds for a full readlines and for a marker scan"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with open_text(path) as f:
+            f.readlines()
+    full = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with open_text(path) as f:
+            any("HURRAY" in line for line in f)
+    scan = (time.perf_counter() - start) / repeat
+    return full, scan
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gzip/zstd compression of xTB outputs and GOAT ensembles")
+    parser.add_argument("--atoms", type=int, default=40)
+    parser.add_argument("--cycles", type=int, default=200, help="Optimization cycles in the fake .out")
+    parser.add_argument("--conformers", type=int, default=500, help="Conformers in the fake ensemble")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    methods = [None, 'gzip'] + (['zstd'] if zstd_available() else [])
+    if not zstd_available():
+        print("zstd not installed (Python >= 3.14 or 'pip install zstandard'), only gzip is measured")
+
+    work_dir = tempfile.mkdtemp(prefix="compression_bench_")
+    try:
+        for kind, writer, amount in (("xtb .out", fake_xtb_output, args.cycles),
+                                     ("finalensemble.xyz", fake_ensemble, args.conformers)):
+            print(f"\n{kind}")
+            print(f"{'method':8s} {'size MB':>9s} {'ratio':>7s} {'write s':>8s} {'read s':>8s} {'scan s':>8s}")
+            raw_size = None
+            for method in methods:
+                path = compressed_name(os.path.join(work_dir, f"bench_{kind.split()[0]}"), method)
+                start = time.perf_counter()
+                writer(path, args.atoms, amount, method)
+                write_time = time.perf_counter() - start
+                size = os.path.getsize(path)
+                raw_size = raw_size or size
+                full, scan = time_reads(path, args.repeat)
+                print(f"{method or 'none':8s} {size / 1024 ** 2:9.2f} {raw_size / size:7.1f} "
+                      f"{write_time:8.3f} {full:8.4f} {scan:8.4f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
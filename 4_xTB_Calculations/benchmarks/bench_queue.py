@@ -0,0 +1,244 @@
+"""
+Benchmark of OrcaFlotte's own overhead, without a real ORCA installation.
+
+Modes:
+  full      every job runs fake_orca.py as a subprocess (sleep/CPU/failure rate configurable),
+            including output writing, .xyz files and cleanup - for campaigns up to ~10k jobs
+  dispatch  run_job is replaced by an in-process stub, so only the queue itself is measured
+            (submission, result handling, summaries, metrics) - for campaigns up to 1M jobs
+
+Measured: makespan, dispatcher throughput, max RSS of the dispatcher and of a worker process
+(Unix only) and the number of filesystem operations. Every run is appended to bench_results.jsonl and
+compared with the last run with the same parameters.
+
+Example:
+  python bench_queue.py --mode full --jobs 1000 --workers 8 --sleep 0.05 --fail-rate 0.05
+  python bench_queue.py --mode dispatch --jobs 1000 100000 1000000
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import builtins
+import argparse
+import logging
+import subprocess
+import tempfile
+import multiprocessing
+
+try:
+    import resource  # Unix only, RSS is not measured on Windows
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from OrcaFlotte import OrcaJobQueue
+from JobPolicy import JobPolicy
+from fake_orca import fake_outcome
+
+FAKE_ORCA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_orca.py")
+GEOMETRIES = ["L", "TP", "T", "SP", "TBPY", "OC"]
+METALS = ["Fe", "Co", "Ni", "Cu", "Zn", "Ru", "Pd", "Pt"]
+FS_OPERATIONS = ["open", "listdir", "remove", "stat", "makedirs", "replace", "copyfile"]
+REGRESSION_THRESHOLD = 0.10  # flag runs that are more than 10% slower than the last comparable run
+
+# --- Filesystem operation counters (shared with forked worker processes) ---
+
+# Default start method: with fork (Linux) the workers inherit the counters, with spawn (Windows)
+# only the operations of the dispatcher are counted (see 'fs_operations_scope')
+fs_counts = multiprocessing.Array('l', len(FS_OPERATIONS), lock=False)
+
+def count_fs_operations():
+    """Wrap the filesystem functions used by OrcaFlotte so that every call is counted."""
+    def wrap(module, name, index):
+        original = getattr(module, name)
+
+        def counted(*args, **kwargs):
+            fs_counts[index] += 1
+            return original(*args, **kwargs)
+        setattr(module, name, counted)
+
+    targets = {"open": builtins, "listdir": os, "remove": os, "stat": os, "makedirs": os,
+               "replace": os, "copyfile": shutil}
+    for index, name in enumerate(FS_OPERATIONS):
+        wrap(targets[name], name, index)
+
+# --- Synthetic campaigns ---
+
+def job_names(n_jobs):
+    for i in range(n_jobs):
+        geometry = GEOMETRIES[i % len(GEOMETRIES)]
+        metal = METALS[(i // len(GEOMETRIES)) % len(METALS)]
+        yield geometry, metal, f"{geometry}_{metal}_2_L{i}_Spin_1"
+
+def create_campaign(base_dir, n_jobs, atoms_per_job=7):
+    """Write n_jobs small inputs in the folder layout of StartUp.py"""
+    coords = "\n".join(f"H {i * 0.9:.6f} 0.000000 0.000000" for i in range(atoms_per_job))
+    for geometry, metal, name in job_names(n_jobs):
+        folder = os.path.join(base_dir, geometry, metal, name)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"{name}.inp"), "w") as f:
+            f.write(f"!XTB VERYTIGHTSCF LooseOpt\n%geom MaxIter 500 end\n* xyz 0 1\n{coords}\n*\n")
+
+class SyntheticJobQueue(OrcaJobQueue):
+    """OrcaJobQueue whose jobs finish immediately, to measure the dispatcher alone."""
+
+    def __init__(self, fail_rate=0.0, no_hurray_rate=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_rate = fail_rate
+        self.no_hurray_rate = no_hurray_rate
+
+    def run_job(self, input_file, attempt=0, input_lines=None):
+        job_name = os.path.basename(input_file).replace('.inp', '')
+        outcome = fake_outcome(job_name, self.fail_rate, self.no_hurray_rate)
+        success = outcome == 'success'
+        return {'job_name': job_name, 'success': success, 'process_success': outcome != 'failed',
+                'hurray_found': success, 'input_file': input_file, 'time_taken': 0.0,
+                'attempt': attempt, 'completion_time': ''}
+
+    def cleanup_job_files(self, job_info):
+        pass
+
+# --- Benchmark runs ---
+
+def max_rss_mb(who):
+    # ru_maxrss is in kB on Linux
+    if resource is None:
+        return None
+    return round(resource.getrusage(getattr(resource, who)).ru_maxrss / 1024, 1)
+
+def fake_orca_launcher(directory):
+    """
+    Executable that runs fake_orca.py with this Python interpreter, called by OrcaJobQueue like ORCA:
+    a .cmd file on Windows, a shell script elsewhere (no dependence on the shebang of fake_orca.py)
+    """
+    if os.name == "nt":
+        launcher = os.path.join(directory, "fake_orca.cmd")
+        with open(launcher, "w") as f:
+            f.write(f'@"{sys.executable}" "{FAKE_ORCA}" %*\n')
+    else:
+        launcher = os.path.join(directory, "fake_orca")
+        with open(launcher, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_ORCA}" "$@"\n')
+        os.chmod(launcher, 0o755)
+    return launcher
+
+def run_benchmark(args, n_jobs):
+    os.environ["FAKE_ORCA_SLEEP"] = str(args.sleep)
+    os.environ["FAKE_ORCA_CPU"] = str(args.cpu)
+    os.environ["FAKE_ORCA_FAIL_RATE"] = str(args.fail_rate)
+    os.environ["FAKE_ORCA_NO_HURRAY_RATE"] = str(args.no_hurray_rate)
+
+    work_dir = tempfile.mkdtemp(prefix="orca_bench_", dir=args.work_dir)
+    try:
+        queue_args = dict(orca_path=fake_orca_launcher(work_dir), max_workers=args.workers, scratch_dir=args.scratch_dir,
+                          policy=JobPolicy(failure_log=None))
+        setup_start = time.time()
+        if args.mode == "full":
+            create_campaign(work_dir, n_jobs)
+            job_queue = OrcaJobQueue(**queue_args)
+        else:
+            job_queue = SyntheticJobQueue(fail_rate=args.fail_rate, no_hurray_rate=args.no_hurray_rate, **queue_args)
+        setup_time = time.time() - setup_start
+
+        for i in range(len(FS_OPERATIONS)):
+            fs_counts[i] = 0
+
+        scan_start = time.time()
+        if args.mode == "full":
+            job_queue.add_jobs_from_directory(work_dir)
+        else:
+            for _, _, name in job_names(n_jobs):
+                job_queue.pending_jobs.append(os.path.join(work_dir, f"{name}.inp"))
+        scan_time = time.time() - scan_start
+
+        run_start = time.time()
+        job_queue.run_all_jobs()
+        makespan = time.time() - run_start
+
+        # Lower bound of the makespan if ORCA itself were the only cost
+        ideal = n_jobs * (args.sleep + args.cpu) / args.workers if args.mode == "full" else 0.0
+        return {
+            'mode': args.mode,
+            'jobs': n_jobs,
+            'workers': args.workers,
+            'sleep': args.sleep,
+            'cpu': args.cpu,
+            'fail_rate': args.fail_rate,
+            'no_hurray_rate': args.no_hurray_rate,
+            'scratch': bool(args.scratch_dir),
+            'setup_seconds': round(setup_time, 3),
+            'scan_seconds': round(scan_time, 3),
+            'makespan_seconds': round(makespan, 3),
+            'throughput_jobs_per_second': round(n_jobs / makespan, 1) if makespan else None,
+            'overhead_per_job_ms': round((makespan - ideal) / n_jobs * 1000, 3),
+            'completed': len(job_queue.completed_jobs),
+            'failed': len(job_queue.failed_jobs),
+            'dispatcher_max_rss_mb': max_rss_mb('RUSAGE_SELF'),
+            'worker_max_rss_mb': max_rss_mb('RUSAGE_CHILDREN'),
+            'fs_operations': {name: fs_counts[i] for i, name in enumerate(FS_OPERATIONS)},
+            'fs_operations_per_job': round(sum(fs_counts) / n_jobs, 2),
+            'fs_operations_scope': 'all' if multiprocessing.get_start_method() == 'fork' else 'dispatcher',
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare_with_previous(results_file, entry):
+    """Return the last recorded run with the same parameters (or None)."""
+    if not os.path.exists(results_file):
+        return None
+    keys = ('mode', 'jobs', 'workers', 'sleep', 'cpu', 'fail_rate', 'no_hurray_rate', 'scratch')
+    previous = None
+    with open(results_file) as f:
+        for line in f:
+            old = json.loads(line)
+            if all(old.get(k) == entry.get(k) for k in keys):
+                previous = old
+    return previous
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OrcaFlotte job queue with a fake ORCA executable")
+    parser.add_argument("--mode", choices=["full", "dispatch"], default="full")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1000], help="Campaign sizes to run")
+    parser.add_argument("--workers", "-w", type=int, default=max(1, multiprocessing.cpu_count() - 1))
+    parser.add_argument("--sleep", type=float, default=0.0, help="Seconds each fake ORCA job sleeps")
+    parser.add_argument("--cpu", type=float, default=0.0, help="Seconds of CPU each fake ORCA job burns")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of failing jobs")
+    parser.add_argument("--no-hurray-rate", type=float, default=0.0,
+                        help="Fraction of jobs that terminate normally but without HURRAY")
+    parser.add_argument("--scratch-dir", default=None, help="Benchmark the scratch mode of OrcaFlotte")
+    parser.add_argument("--work-dir", default=None, help="Where the synthetic campaign is written (default: system temp)")
+    parser.add_argument("--results", default="bench_results.jsonl", help="File the results are appended to")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    count_fs_operations()
+
+    for n_jobs in args.jobs:
+        entry = run_benchmark(args, n_jobs)
+        entry['revision'] = git_revision()
+        entry['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        previous = compare_with_previous(args.results, entry)
+        with open(args.results, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+        print(f"{entry['mode']} | {n_jobs} jobs | makespan {entry['makespan_seconds']:.2f} s | "
+              f"{entry['throughput_jobs_per_second']} jobs/s | overhead {entry['overhead_per_job_ms']} ms/job | "
+              f"{entry['fs_operations_per_job']} fs ops/job ({entry['fs_operations_scope']}) | "
+              f"dispatcher {entry['dispatcher_max_rss_mb']} MB | worker {entry['worker_max_rss_mb']} MB")
+        if previous and previous.get('makespan_seconds'):
+            change = entry['makespan_seconds'] / previous['makespan_seconds'] - 1
+            print(f"  vs. {previous.get('revision')} ({previous.get('time')}): makespan {change * 100:+.1f}%")
+            if change > REGRESSION_THRESHOLD:
+                print(f"  WARNING: possible regression (> {REGRESSION_THRESHOLD * 100:.0f}% slower)")
+
+if __name__ == "__main__":
+    main()
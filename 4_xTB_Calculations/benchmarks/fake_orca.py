@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the ORCA executable, used by bench_queue.py to measure OrcaFlotte without ORCA.
+Called like ORCA (fake_orca.py <job>.inp, from the job directory). Writes an xTB-like output
+to stdout and the optimized <job>.xyz, plus some temporary files like ORCA does.
+
+Behaviour is controlled by environment variables:
+  FAKE_ORCA_SLEEP      seconds to sleep (default 0)
+  FAKE_ORCA_CPU        seconds to burn CPU (default 0)
+  FAKE_ORCA_FAIL_RATE  fraction of jobs that fail (default 0), chosen deterministically from the job name
+  FAKE_ORCA_NO_HURRAY_RATE  fraction of jobs that terminate normally but without HURRAY (default 0),
+                       chosen from the jobs that do not fail
+  FAKE_ORCA_CYCLES     optimization cycles to print (default 10)
+"""
+import os
+import re
+import sys
+import time
+import zlib
+
+def fake_outcome(job_name, fail_rate, no_hurray_rate):
+    """'failed', 'no_hurray' or 'success', deterministic per job name"""
+    u = (zlib.crc32(job_name.encode()) % 10000) / 10000
+    if u < fail_rate:
+        return 'failed'
+    if u < fail_rate + no_hurray_rate:
+        return 'no_hurray'
+    return 'success'
+
+def main():
+    input_file = sys.argv[1]
+    job_name = os.path.splitext(os.path.basename(input_file))[0]
+    sleep = float(os.environ.get("FAKE_ORCA_SLEEP", 0))
+    cpu = float(os.environ.get("FAKE_ORCA_CPU", 0))
+    fail_rate = float(os.environ.get("FAKE_ORCA_FAIL_RATE", 0))
+    no_hurray_rate = float(os.environ.get("FAKE_ORCA_NO_HURRAY_RATE", 0))
+    cycles = int(os.environ.get("FAKE_ORCA_CYCLES", 10))
+
+    atoms = []
+    in_block = False
+    with open(input_file) as f:
+        for line in f:
+            stripped = line.strip()
+            if not in_block:
+                in_block = re.match(r"\*\s*xyz", stripped) is not None
+            elif stripped == "*":
+                break
+            elif len(stripped.split()) == 4:
+                atoms.append(stripped)
+
+    if sleep:
+        time.sleep(sleep)
+    end = time.process_time() + cpu
+    while time.process_time() < end:
+        pass
+
+    # Temporary files ORCA leaves behind (removed by cleanup_job_files)
+    for ext in (".gbw", ".engrad", ".opt", "_trj.xyz"):
+        with open(job_name + ext, "w") as f:
+            f.write("temporary\n")
+
+    outcome = fake_outcome(job_name, fail_rate, no_hurray_rate)
+    out = sys.stdout
+    out.write("                                 * O   R   C   A *\n\n")
+    for cycle in range(1, cycles + 1):
+        out.write(f"                       *   GEOMETRY OPTIMIZATION CYCLE {cycle:4d}   *\n")
+        out.write(f"FINAL SINGLE POINT ENERGY       {-10.0 - cycle * 1e-4:.9f}\n")
+        out.write("          | HOMO-LUMO GAP               2.345678 eV   |\n")
+    if outcome == 'failed':
+        out.write("The optimization did not converge but reached the maximum number of optimization cycles.\n")
+        sys.exit(1)
+    if outcome == 'no_hurray':
+        # Return code 0, but no converged geometry: only the HURRAY check catches this
+        out.write("                             ****ORCA TERMINATED NORMALLY****\n")
+        out.write(f"TOTAL RUN TIME: 0 days 0 hours 0 minutes {int(sleep + cpu)} seconds 0 msec\n")
+        return
+    out.write("                    ***        THE OPTIMIZATION HAS CONVERGED     ***\n")
+    out.write("                             ***HURRAY***\n")
+    out.write("                             ****ORCA TERMINATED NORMALLY****\n")
+    out.write(f"TOTAL RUN TIME: 0 days 0 hours 0 minutes {int(sleep + cpu)} seconds 0 msec\n")
+
+    with open(job_name + ".xyz", "w") as f:
+        f.write(f"{len(atoms)}\nCoordinates from ORCA-job {job_name} E {-10.0 - cycles * 1e-4:.9f}\n")
+        f.write("\n".join(atoms) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import os
+import sys
+import json
+import time
+import heapq
+import signal
+import argparse
+import subprocess
+
+from GoatResources import DEFAULT_NODE, job_memory, parse_node, read_goat_resources
+
+# The xTB tools provide the tail-based completion check
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from CompressedIO import read_tail
+
+# Batch-scheduler job arrays for the GOAT inputs written by XTBzuGOAT.
+#
+# The inputs are bundled into a fixed number of array tasks. Every task has its own manifest
+# (task_NNNN.json) and runs its GOAT jobs side by side within the cores of the task; a finished
+# job leaves a resume marker (markers/<job>.done), so a resubmitted or restarted task only runs
+# what is missing. "run-local" executes the same tasks on one machine without a scheduler.
+#
+# Layout of an array directory:
+#   arrays.json             task count, scheduler, resources per task
+#   task_0000.json, ...     per-task manifest (inputs relative to the array directory)
+#   submit_goat_array.sh    job array script for sbatch / qsub
+#   markers/                <job>.done / <job>.failed
+#   logs/                   scheduler output per task
+
+SCHEDULER_TEMPLATES = {
+    'slurm': """#!/bin/bash
+#SBATCH --job-name={name}
+#SBATCH --array=0-{last_task}
+#SBATCH --nodes=1
+#SBATCH --cpus-per-task={cpus}
+#SBATCH --mem={memory_mb}M
+#SBATCH --time={walltime}
+#SBATCH --output={array_dir}/logs/task_%a.log
+
+{python} {script} run-task {array_dir} $SLURM_ARRAY_TASK_ID --orca-path {orca_path}
+""",
+    'pbs': """#!/bin/bash
+#PBS -N {name}
+#PBS -J 0-{last_task}
+#PBS -l select=1:ncpus={cpus}:mem={memory_mb}mb
+#PBS -l walltime={walltime}
+#PBS -o {array_dir}/logs/
+
+{python} {script} run-task {array_dir} $PBS_ARRAY_INDEX --orca-path {orca_path}
+""",
+}
+
+POLL_INTERVAL = 1.0  # longest wait between checks of the running GOAT jobs of a task
+
+def job_name(goat_input):
+    return os.path.splitext(os.path.basename(goat_input))[0]
+
+def bundle_jobs(jobs, n_tasks):
+    """
+    Distribute (goat_input, resources) over n_tasks bundles of similar total cost
+    (longest processing time first, the cores of a job as its cost). Deterministic for a given input.
+    """
+    n_tasks = max(1, min(n_tasks, len(jobs)))
+    heap = [(0, task, []) for task in range(n_tasks)]
+    for goat_input, resources in sorted(jobs, key=lambda j: (-j[1]['nprocs'], j[0])):
+        load, task, bundle = heapq.heappop(heap)
+        bundle.append((goat_input, resources))
+        heapq.heappush(heap, (load + resources['nprocs'], task, bundle))
+    return [bundle for _, _, bundle in sorted(heap, key=lambda t: t[1])]
+
+def concurrent_memory(bundle, cpus):
+    """
+    Largest memory of the jobs of a bundle that can run at the same time within cpus cores
+    (0/1 knapsack over the cores); a single job larger than the task counts on its own.
+    """
+    best = [0.0] * (cpus + 1)  # best[c]: most memory of jobs using at most c cores
+    for _, resources in bundle:
+        nprocs, memory = resources['nprocs'], job_memory(resources)
+        for c in range(cpus, nprocs - 1, -1):
+            best[c] = max(best[c], best[c - nprocs] + memory)
+    return max([best[cpus]] + [job_memory(r) for _, r in bundle])
+
+def task_file(array_dir, task_id):
+    return os.path.join(array_dir, f"task_{task_id:04d}.json")
+
+def write_arrays(jobs, array_dir, n_tasks, node=DEFAULT_NODE, scheduler='slurm', orca_path='orca',
+                 walltime='24:00:00', name='goat'):
+    """Write the task manifests and the job array script for (goat_input, resources) jobs."""
+    os.makedirs(os.path.join(array_dir, "markers"), exist_ok=True)
+    os.makedirs(os.path.join(array_dir, "logs"), exist_ok=True)
+    array_dir = os.path.abspath(array_dir)
+
+    # Task manifests of an earlier, larger bundling would be picked up by the scheduler script
+    for file in os.listdir(array_dir):
+        if file.startswith("task_") and file.endswith(".json"):
+            os.remove(os.path.join(array_dir, file))
+
+    bundles = bundle_jobs(jobs, n_tasks)
+    cpus = min(node.cores, max((r['nprocs'] for _, r in jobs), default=1))
+    # run_task starts as many jobs at once as fit into the cores: request the memory of all of them
+    # (capped at the node, run_task then also waits for free memory)
+    memory_mb = int(min(node.memory_mb, max((concurrent_memory(b, cpus) for b in bundles), default=1000)))
+    for task_id, bundle in enumerate(bundles):
+        manifest = {
+            'task': task_id,
+            'cpus': cpus,
+            'memory_mb': memory_mb,
+            'jobs': [{'name': job_name(goat_input),
+                      'input': os.path.relpath(os.path.abspath(goat_input), array_dir),
+                      'nprocs': resources['nprocs'], 'maxcore': resources['maxcore'],
+                      'memory_mb': round(job_memory(resources))}
+                     for goat_input, resources in bundle],
+        }
+        with open(task_file(array_dir, task_id), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    index = {'tasks': len(bundles), 'jobs': len(jobs), 'scheduler': scheduler, 'cpus_per_task': cpus,
+             'memory_mb_per_task': memory_mb, 'node': node._asdict(), 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(os.path.join(array_dir, "arrays.json"), 'w') as f:
+        json.dump(index, f, indent=2)
+
+    script = SCHEDULER_TEMPLATES[scheduler].format(
+        name=name, last_task=len(bundles) - 1, cpus=cpus, memory_mb=memory_mb, walltime=walltime,
+        array_dir=array_dir, python=sys.executable or "python3", script=os.path.abspath(__file__),
+        orca_path=orca_path)
+    script_path = os.path.join(array_dir, "submit_goat_array.sh")
+    with open(script_path, 'w') as f:
+        f.write(script)
+    os.chmod(script_path, 0o755)
+    return index
+
+def marker_path(array_dir, name, state):
+    return os.path.join(array_dir, "markers", f"{name}.{state}")
+
+def write_marker(array_dir, name, state, **info):
+    path = marker_path(array_dir, name, state)
+    with open(path + ".part", 'w') as f:
+        json.dump(dict(info, time=time.strftime('%Y-%m-%d %H:%M:%S')), f)
+    os.replace(path + ".part", path)
+
+def goat_finished(out_path):
+    try:
+        return "ORCA TERMINATED NORMALLY" in read_tail(out_path)
+    except FileNotFoundError:
+        return False
+
+def run_task(array_dir, task_id, orca_path, retry_failed=True):
+    """
+    Run the GOAT jobs of one array task that have no .done marker, as many at once as
+    the cores and the memory of the task allow. Returns (done, failed) counts of this run.
+    """
+    with open(task_file(array_dir, task_id)) as f:
+        manifest = json.load(f)
+    cpus = manifest['cpus']
+    # Manifests of older arrays have no memory entries: cores only
+    memory = manifest.get('memory_mb', float('inf'))
+
+    pending = []
+    for job in manifest['jobs']:
+        if os.path.exists(marker_path(array_dir, job['name'], "done")):
+            continue
+        if not retry_failed and os.path.exists(marker_path(array_dir, job['name'], "failed")):
+            continue
+        pending.append(job)
+    print(f"Task {task_id}: {len(manifest['jobs']) - len(pending)} of {len(manifest['jobs'])} jobs already done", flush=True)
+
+    running = {}
+    free = cpus
+    free_memory = memory
+    done = failed = 0
+    idle = 0
+
+    def preempted(sig, frame):
+        """Scheduler preemption or wall-time limit: stop the running jobs and mark them, so GoatRestart can continue them"""
+        # All jobs at once: the scheduler kills the task after its kill wait (SLURM: 30 s by default)
+        for process in running:
+            process.terminate()
+        deadline = time.time() + 10
+        for process, (job, _, start) in running.items():
+            try:
+                process.wait(timeout=max(0.0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            write_marker(array_dir, job['name'], "failed", task=task_id, seconds=round(time.time() - start, 1),
+                         return_code=process.returncode, preempted=True, signal=sig)
+        print(f"Task {task_id}: stopped by signal {sig}, {len(running)} running jobs marked as preempted", flush=True)
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, preempted)
+    while pending or running:
+        # Start jobs while their cores and memory fit (the largest waiting job first, a job larger than the task runs alone)
+        for job in list(pending):
+            if (job['nprocs'] <= free and job.get('memory_mb', 0) <= free_memory) or not running:
+                input_path = os.path.normpath(os.path.join(array_dir, job['input']))
+                out_path = os.path.splitext(input_path)[0] + ".out"
+                with open(out_path, 'w') as out:
+                    process = subprocess.Popen([orca_path, os.path.basename(input_path)], stdout=out,
+                                               stderr=subprocess.STDOUT, cwd=os.path.dirname(input_path))
+                running[process] = (job, out_path, time.time())
+                free -= job['nprocs']
+                free_memory -= job.get('memory_mb', 0)
+                pending.remove(job)
+        # Short jobs are noticed quickly, long ones are checked at most every POLL_INTERVAL
+        time.sleep(min(POLL_INTERVAL, 0.05 * 2 ** idle))
+        finished = [p for p in running if p.poll() is not None]
+        idle = 0 if finished else idle + 1
+        for process in finished:
+            job, out_path, start = running.pop(process)
+            free += job['nprocs']
+            free_memory += job.get('memory_mb', 0)
+            seconds = round(time.time() - start, 1)
+            state = "done" if process.returncode == 0 and goat_finished(out_path) else "failed"
+            if state == "done":
+                write_marker(array_dir, job['name'], "done", task=task_id, seconds=seconds)
+                failed_marker = marker_path(array_dir, job['name'], "failed")
+                if os.path.exists(failed_marker):
+                    os.remove(failed_marker)
+                done += 1
+            else:
+                write_marker(array_dir, job['name'], "failed", task=task_id, seconds=seconds,
+                             return_code=process.returncode)
+                failed += 1
+            print(f"Task {task_id}: {job['name']} {state} ({seconds} s)", flush=True)
+    print(f"Task {task_id} finished: {done} done, {failed} failed", flush=True)
+    return done, failed
+
+def _run_task_args(args):
+    return run_task(*args)
+
+def run_local(array_dir, orca_path, parallel_tasks=1, retry_failed=True):
+    """Stand-in for the scheduler: run all array tasks on this machine, parallel_tasks at a time."""
+    from concurrent.futures import ProcessPoolExecutor
+    with open(os.path.join(array_dir, "arrays.json")) as f:
+        n_tasks = json.load(f)['tasks']
+    tasks = [(array_dir, task_id, orca_path, retry_failed) for task_id in range(n_tasks)]
+    with ProcessPoolExecutor(max_workers=parallel_tasks) as executor:
+        results = list(executor.map(_run_task_args, tasks))
+    done = sum(d for d, _ in results)
+    failed = sum(f for _, f in results)
+    print(f"All {n_tasks} tasks finished: {done} jobs done, {failed} failed in this run")
+    return done, failed
+
+def array_status(array_dir):
+    """Done / failed / pending jobs per task, from the resume markers"""
+    with open(os.path.join(array_dir, "arrays.json")) as f:
+        n_tasks = json.load(f)['tasks']
+    status = []
+    for task_id in range(n_tasks):
+        with open(task_file(array_dir, task_id)) as f:
+            names = [job['name'] for job in json.load(f)['jobs']]
+        done = sum(os.path.exists(marker_path(array_dir, n, "done")) for n in names)
+        failed = sum(os.path.exists(marker_path(array_dir, n, "failed")) and
+                     not os.path.exists(marker_path(array_dir, n, "done")) for n in names)
+        status.append({'task': task_id, 'jobs': len(names), 'done': done, 'failed': failed,
+                       'pending': len(names) - done - failed})
+    return status
+
+def collect_goat_inputs(goat_dir):
+    """All GOAT inputs of a directory with the resources written into them"""
+    return [(os.path.join(goat_dir, file), read_goat_resources(os.path.join(goat_dir, file)))
+            for file in sorted(os.listdir(goat_dir)) if file.endswith(".inp")]
+
+def main():
+    parser = argparse.ArgumentParser(description="Bundle GOAT inputs into batch-scheduler job arrays and run them")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    build = sub.add_parser("build", help="Write task manifests and the job array script for a GOAT input directory")
+    build.add_argument("goat_dir")
+    build.add_argument("--array-dir", default=None, help="Default: <goat_dir>/arrays")
+    build.add_argument("--tasks", "-n", type=int, required=True, help="Number of array tasks")
+    build.add_argument("--node", default=None, help="Node the tasks run on, 'cores,memory_GB' (default: 8,32)")
+    build.add_argument("--scheduler", choices=sorted(SCHEDULER_TEMPLATES), default="slurm")
+    build.add_argument("--walltime", default="24:00:00")
+    build.add_argument("--orca-path", default="orca", help="ORCA executable on the cluster (full path for parallel runs)")
+
+    task = sub.add_parser("run-task", help="Run one array task (called by the job array script)")
+    task.add_argument("array_dir")
+    task.add_argument("task_id", type=int)
+    task.add_argument("--orca-path", default="orca")
+    task.add_argument("--skip-failed", action="store_true", help="Do not retry jobs with a .failed marker")
+
+    local = sub.add_parser("run-local", help="Run all array tasks on this machine (no scheduler)")
+    local.add_argument("array_dir")
+    local.add_argument("--orca-path", default="orca")
+    local.add_argument("--parallel", "-p", type=int, default=1, help="Tasks running at the same time")
+    local.add_argument("--skip-failed", action="store_true")
+
+    status = sub.add_parser("status", help="Show done/failed/pending jobs per task")
+    status.add_argument("array_dir")
+
+    args = parser.parse_args()
+    if args.mode == "build":
+        jobs = collect_goat_inputs(args.goat_dir)
+        node = parse_node(args.node) if args.node else DEFAULT_NODE
+        array_dir = args.array_dir or os.path.join(args.goat_dir, "arrays")
+        index = write_arrays(jobs, array_dir, args.tasks, node, args.scheduler, args.orca_path, args.walltime)
+        print(f"{index['jobs']} GOAT inputs in {index['tasks']} array tasks "
+              f"({index['cpus_per_task']} cores, {index['memory_mb_per_task']} MB each) in {array_dir}")
+    elif args.mode == "run-task":
+        run_task(args.array_dir, args.task_id, args.orca_path, not args.skip_failed)
+    elif args.mode == "run-local":
+        run_local(args.array_dir, args.orca_path, args.parallel, not args.skip_failed)
+    else:
+        rows = array_status(args.array_dir)
+        for row in rows:
+            print(f"task {row['task']:4d}: {row['done']}/{row['jobs']} done, {row['failed']} failed, {row['pending']} pending")
+        print(f"total: {sum(r['done'] for r in rows)}/{sum(r['jobs'] for r in rows)} done")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+
+# Output files may be compressed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from CompressedIO import open_text, resolve_path
+
+from GoatResources import read_goat_structure
+
+# ORCA multi-job inputs for small GOAT calculations.
+#
+# Thousands of tiny linear and trigonal complexes each start their own ORCA process, which costs
+# more than the GOAT run itself. Here several GOAT inputs with the same resources are concatenated
+# into one input (blocks separated by $new_job). Every block sets %base to the name of its GOAT job,
+# so the .finalensemble.xyz (and the other GOAT files) already carry the name Ordnen.py expects;
+# only the common .out has to be split into one output per job afterwards.
+#
+#   <goat_dir>/bundle_NNNN.inp     the multi-job inputs (run like any other GOAT input)
+#   <goat_dir>/bundled/            the single inputs they were made from
+#   <goat_dir>/bundle_map.json     bundle -> GOAT jobs in order
+
+BUNDLE_MAX_ATOMS = 12       # GOAT inputs up to this size are bundled
+JOBS_PER_BUNDLE = 20
+BUNDLED_DIR = "bundled"
+BUNDLE_MAP = "bundle_map.json"
+PARTIAL_DIR = "partial"  # runs interrupted and archived by GoatRestart.py
+JOB_SEPARATOR = "$new_job"
+JOB_START = re.compile(r"JOB\s+NUMBER\s+(\d+)")  # banner ORCA prints before the 2nd, 3rd, ... job
+BASE_LINE = re.compile(r'^(?:\|\s*\d+>)?\s*%base\s+"([^"]+)"', re.IGNORECASE)  # also in ORCA's input echo "|  1> %base ..."
+
+def bundle_name(index):
+    return f"bundle_{index:04d}"
+
+def header_key(goat_content):
+    """Lines before the coordinates (keywords, %PAL, %maxcore, %GOAT): only inputs with equal headers are bundled"""
+    return tuple(line.strip() for line in goat_content.split("* xyz")[0].splitlines() if line.strip())
+
+def bundle_block(job_name, goat_content):
+    return f'%base "{job_name}"\n{goat_content.strip()}\n'
+
+def bundle_started(goat_dir, name):
+    """True once a bundle has run: it has an output (or other run files) or a run archived by GoatRestart"""
+    return any(file.startswith(f"{name}.") and not file.endswith(".inp") for file in os.listdir(goat_dir)) \
+        or os.path.isdir(os.path.join(goat_dir, PARTIAL_DIR, f"{name}_1"))
+
+def read_bundle_map(goat_dir):
+    map_file = os.path.join(goat_dir, BUNDLE_MAP)
+    if not os.path.exists(map_file):
+        return {}
+    with open(map_file) as f:
+        return json.load(f)
+
+def write_bundles(goat_inputs, goat_dir, jobs_per_bundle=JOBS_PER_BUNDLE):
+    """
+    Concatenate the given GOAT inputs (paths, all already judged small) into multi-job inputs in goat_dir.
+    Bundles of an earlier run keep their members, so bundle_map.json still matches the bundle outputs:
+    a bundle that has already run is never rewritten (its members stay in bundled/), one that has not
+    run yet is rewritten with the current inputs of the same members as long as all of them are given
+    with equal headers, otherwise it is dissolved. Only the inputs in no remaining bundle (and without
+    a final ensemble) are grouped by their header, sorted by name and cut into new bundles of
+    jobs_per_bundle; the single inputs are moved to bundled/, inputs left out of any bundle go back
+    to goat_dir. Returns {bundle name: [GOAT job names]} (also in bundle_map.json, which is removed
+    when there are no bundles).
+    """
+    bundled_dir = os.path.join(goat_dir, BUNDLED_DIR)
+    inputs = {}
+    for goat_input in goat_inputs:
+        with open(goat_input, 'r') as f:
+            content = f.read()
+        inputs[os.path.splitext(os.path.basename(goat_input))[0]] = (goat_input, content)
+
+    def move(goat_input, directory):
+        target = os.path.join(directory, os.path.basename(goat_input))
+        if os.path.abspath(goat_input) != os.path.abspath(target):
+            os.makedirs(directory, exist_ok=True)
+            os.replace(goat_input, target)
+
+    def write(name, jobs):
+        blocks = [bundle_block(job, inputs[job][1]) for job in jobs]
+        with open(os.path.join(goat_dir, f"{name}.inp"), 'w') as f:
+            f.write(f"\n{JOB_SEPARATOR}\n\n".join(blocks))
+        for job in jobs:
+            move(inputs[job][0], bundled_dir)
+
+    bundle_map = {}
+    for name, jobs in read_bundle_map(goat_dir).items():
+        if bundle_started(goat_dir, name):
+            # The output belongs to exactly these members; a newer single input of one of them is set aside too
+            bundle_map[name] = jobs
+            for job in jobs:
+                if os.path.exists(os.path.join(goat_dir, f"{job}.inp")):
+                    move(os.path.join(goat_dir, f"{job}.inp"), bundled_dir)
+        elif all(job in inputs for job in jobs) and len({header_key(inputs[job][1]) for job in jobs}) == 1:
+            bundle_map[name] = jobs
+            write(name, jobs)
+    for file in os.listdir(goat_dir):
+        if file.startswith("bundle_") and file.endswith(".inp") and file[:-len(".inp")] not in bundle_map \
+                and not bundle_started(goat_dir, file[:-len(".inp")]):
+            os.remove(os.path.join(goat_dir, file))
+
+    bundled = {job for jobs in bundle_map.values() for job in jobs}
+    groups = {}
+    for job in sorted(inputs):
+        if job in bundled or resolve_path(os.path.join(goat_dir, f"{job}.finalensemble.xyz")):
+            continue
+        groups.setdefault(header_key(inputs[job][1]), []).append(job)
+
+    index = 0
+    for header in sorted(groups):
+        members = groups[header]
+        for start in range(0, len(members), jobs_per_bundle):
+            chunk = members[start:start + jobs_per_bundle]
+            if len(chunk) < 2:
+                # A single job gains nothing from a bundle
+                move(inputs[chunk[0]][0], goat_dir)
+                continue
+            while bundle_name(index) in bundle_map or bundle_started(goat_dir, bundle_name(index)) \
+                    or os.path.exists(os.path.join(goat_dir, f"{bundle_name(index)}.inp")):
+                index += 1
+            bundle_map[bundle_name(index)] = chunk
+            write(bundle_name(index), chunk)
+
+    map_file = os.path.join(goat_dir, BUNDLE_MAP)
+    if bundle_map:
+        with open(map_file, 'w') as f:
+            json.dump(dict(sorted(bundle_map.items())), f, indent=2)
+    elif os.path.exists(map_file):
+        os.remove(map_file)
+    return bundle_map
+
+def base_names(lines):
+    """GOAT job names in the order of the %base lines of a bundle input (or of ORCA's echo of it)"""
+    names = []
+    for line in lines:
+        match = BASE_LINE.search(line)
+        if match and match.group(1) not in names:
+            names.append(match.group(1))
+    return names
+
+def split_output(bundle_out, jobs, dest_dir):
+    """
+    Split the .out of a bundle into <job>.out per GOAT job (at ORCA's JOB NUMBER banners; the part
+    before the 2nd banner, including the input echo, goes to the first job).
+    Returns False (and writes nothing) if the number of banners does not match the jobs, or if the
+    %base names of the input echo are not the jobs in this order (the bundle was run with other members).
+    """
+    with open_text(bundle_out) as f:
+        lines = f.readlines()
+    starts = [0]
+    for i, line in enumerate(lines):
+        match = JOB_START.search(line)
+        if match and int(match.group(1)) == len(starts) + 1:
+            # The banner is framed by asterisk lines, the one above belongs to the new job
+            starts.append(i - 1 if i > 0 and lines[i - 1].strip().startswith("*") else i)
+    if len(starts) != len(jobs):
+        return False
+    echoed = base_names(lines)
+    if echoed and echoed != list(jobs):
+        return False
+    starts.append(len(lines))
+    for job, begin, end in zip(jobs, starts, starts[1:]):
+        with open(os.path.join(dest_dir, f"{job}.out"), 'w') as f:
+            f.writelines(lines[begin:end])
+    return True
+
+def split_directory(run_dir, dest_dir=None, map_file=None):
+    """
+    Split all finished bundles of run_dir into per-complex results in dest_dir (default: run_dir):
+    <job>.out from the bundle output and the GOAT files of every job (<job>.finalensemble.xyz, ...),
+    which are moved when dest_dir differs. Returns a status per bundle.
+    """
+    dest_dir = dest_dir or run_dir
+    os.makedirs(dest_dir, exist_ok=True)
+    with open(map_file or os.path.join(run_dir, BUNDLE_MAP)) as f:
+        bundle_map = json.load(f)
+
+    status = {}
+    for name, jobs in sorted(bundle_map.items()):
+        bundle_out = resolve_path(os.path.join(run_dir, f"{name}.out"))
+        if not bundle_out:
+            status[name] = {'state': 'not_run'}
+            continue
+        split = split_output(bundle_out, jobs, dest_dir)
+        missing = []
+        for job in jobs:
+            files = [file for file in os.listdir(run_dir) if file.startswith(f"{job}.") and not file.endswith(".inp")]
+            if not any(".finalensemble.xyz" in file for file in files):
+                missing.append(job)
+            if os.path.abspath(dest_dir) != os.path.abspath(run_dir):
+                for file in files:
+                    if not (split and file.endswith(".out")):
+                        shutil.move(os.path.join(run_dir, file), os.path.join(dest_dir, file))
+        status[name] = {'state': 'split' if split else 'ensembles_only', 'jobs': len(jobs), 'missing_ensembles': missing}
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description="Bundle small GOAT inputs into ORCA multi-job inputs and split the results")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    bundle = sub.add_parser("bundle", help="Concatenate the small GOAT inputs of a directory")
+    bundle.add_argument("goat_dir")
+    bundle.add_argument("--max-atoms", type=int, default=BUNDLE_MAX_ATOMS,
+                        help=f"Only bundle inputs with up to this many atoms (default: {BUNDLE_MAX_ATOMS})")
+    bundle.add_argument("--jobs-per-bundle", type=int, default=JOBS_PER_BUNDLE)
+
+    split = sub.add_parser("split", help="Split finished bundles into per-complex outputs and ensembles")
+    split.add_argument("run_dir", help="Directory with the bundle outputs and bundle_map.json")
+    split.add_argument("--dest", default=None, help="Directory for the per-complex results (default: run_dir)")
+    split.add_argument("--map", default=None, help="Bundle map (default: bundle_map.json in run_dir)")
+
+    args = parser.parse_args()
+
+    if args.mode == "bundle":
+        # Bundles of an earlier run keep their members, only the inputs in none of them form new bundles
+        small = []
+        for directory in (args.goat_dir, os.path.join(args.goat_dir, BUNDLED_DIR)):
+            if not os.path.isdir(directory):
+                continue
+            small += [os.path.join(directory, file) for file in sorted(os.listdir(directory))
+                      if file.endswith(".inp") and not file.startswith("bundle_")
+                      and len(read_goat_structure(os.path.join(directory, file))[2]) <= args.max_atoms]
+        bundle_map = write_bundles(small, args.goat_dir, args.jobs_per_bundle)
+        print(f"{sum(len(j) for j in bundle_map.values())} GOAT inputs in {len(bundle_map)} bundles")
+    else:
+        status = split_directory(args.run_dir, args.dest, args.map)
+        for name, info in status.items():
+            if info['state'] != 'split' or info.get('missing_ensembles'):
+                print(f"{name}: {info}")
+        print(f"{sum(s['state'] == 'split' for s in status.values())} of {len(status)} bundles split")
+
+if __name__ == "__main__":
+    main()
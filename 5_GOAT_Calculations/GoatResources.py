@@ -0,0 +1,183 @@
+import os
+import re
+import sys
+import json
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Covalent radii of PreRelax.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "3_Complex_Generator"))
+from PreRelax import COVALENT_RADII
+
+# Resources of a GOAT run (%PAL NPROCS, %maxcore, NWORKERS) chosen per complex instead of
+# 8 cores / 3000 MB for everything, and a packing plan that fills the nodes of a cluster.
+#
+# GOAT runs its xTB workers in parallel, so the useful number of cores grows with the size
+# of the conformational space: a rigid two-atom complex gains nothing from 8 cores,
+# an octahedral complex with six NH3/CH3 rotors does.
+
+NodeSpec = namedtuple("NodeSpec", ["cores", "memory_mb"])
+
+DEFAULT_NODE = NodeSpec(cores=8, memory_mb=32000)  # matches the former fixed 8 x 3000 MB
+DEFAULT_RESOURCES = {'nprocs': 8, 'maxcore': 3000, 'nworkers': 8}
+
+BOND_TOLERANCE = 1.25      # bonded if distance < tolerance * (r_cov_i + r_cov_j)
+LINEAR_ANGLE = 170.0       # substituents within this angle of a bond axis do not rotate around it
+ATOMS_PER_CORE_STEP = 25   # number of atoms after which the core count is doubled
+MAXCORE_BASE = 500         # MB per process
+MAXCORE_PER_ATOM = 10      # MB per process and atom
+MEMORY_FRACTION = 0.75     # ORCA's maxcore should stay below ~75 % of the physical memory per core
+
+def parse_node(text):
+    """'64,256' or 'cores=64,memory=256' (memory in GB) -> NodeSpec"""
+    values = {}
+    for i, part in enumerate(text.split(",")):
+        if "=" in part:
+            key, value = part.split("=", 1)
+        else:
+            key, value = ("cores", "memory")[i], part
+        values[key.strip()] = float(value)
+    return NodeSpec(cores=int(values["cores"]), memory_mb=int(values["memory"] * 1000))
+
+def parse_coordinates(coordinates):
+    """Coordinate lines 'El x y z' -> symbols, (n, 3) array"""
+    symbols = []
+    coords = []
+    for line in coordinates:
+        parts = line.split()
+        if len(parts) >= 4:
+            symbols.append(parts[0])
+            coords.append([float(x) for x in parts[1:4]])
+    return symbols, np.array(coords, dtype=float).reshape(-1, 3)
+
+def bonded_neighbours(symbols, coords):
+    radii = np.array([COVALENT_RADII.get(s, 1.5) for s in symbols])
+    dist = np.linalg.norm(coords[:, None, :] - coords[None, :, :], axis=-1)
+    bonded = (dist < BOND_TOLERANCE * (radii[:, None] + radii[None, :])) & (dist > 0.1)
+    return [np.nonzero(row)[0] for row in bonded]
+
+def count_rotatable_bonds(symbols, coords):
+    """
+    Bonds that can rotate: on both sides of the bond there is a substituent off the bond axis,
+    so a torsion is defined (M-NH3, M-CH3, M-OH2 rotate, M-CO and M-Cl do not). Collinear
+    chains are followed, so both M-N bonds of a linear H3N-M-NH3 count.
+    Bond orders are not known, so this slightly overcounts for ligands with double bonds.
+    """
+    if len(symbols) < 3:
+        return 0
+    neighbours = bonded_neighbours(symbols, coords)
+
+    def off_axis(a, b, visited=()):
+        # Is there a substituent behind b (seen from a) that is not on the a-b axis?
+        axis = coords[a] - coords[b]
+        for c in neighbours[b]:
+            if c == a or c in visited:
+                continue
+            v = coords[c] - coords[b]
+            cos = np.dot(axis, v) / (np.linalg.norm(axis) * np.linalg.norm(v))
+            if math.degrees(math.acos(np.clip(cos, -1.0, 1.0))) < LINEAR_ANGLE:
+                return True
+            if off_axis(b, c, visited + (b,)):
+                return True
+        return False
+
+    count = 0
+    for a, neigh in enumerate(neighbours):
+        for b in neigh:
+            if b > a and off_axis(a, b) and off_axis(b, a):
+                count += 1
+    return count
+
+def choose_resources(n_atoms, n_rotors, node=DEFAULT_NODE):
+    """
+    NPROCS/NWORKERS: the next power of two >= (1 + rotors) * (1 + atoms // 25), at most the cores of a node.
+    maxcore: 500 MB + 10 MB per atom, limited to 75 % of the node memory per process.
+    """
+    wanted = (1 + n_rotors) * (1 + n_atoms // ATOMS_PER_CORE_STEP)
+    nprocs = min(node.cores, 2 ** math.ceil(math.log2(wanted)) if wanted > 1 else 1)
+    maxcore = MAXCORE_BASE + MAXCORE_PER_ATOM * n_atoms
+    maxcore = int(min(maxcore, MEMORY_FRACTION * node.memory_mb / nprocs))
+    return {'nprocs': nprocs, 'maxcore': maxcore, 'nworkers': nprocs}
+
+def resources_for_coordinates(coordinates, node=DEFAULT_NODE):
+    symbols, coords = parse_coordinates(coordinates)
+    rotors = count_rotatable_bonds(symbols, coords)
+    resources = choose_resources(len(symbols), rotors, node)
+    resources.update(atoms=len(symbols), rotors=rotors)
+    return resources
+
+def read_goat_resources(goat_input):
+    """%PAL NPROCS / %maxcore / NWORKERS of an existing GOAT input (defaults for missing entries)"""
+    resources = dict(DEFAULT_RESOURCES)
+    with open(goat_input, 'r') as f:
+        text = f.read()
+    for key, pattern in (('nprocs', r"%PAL\s+NPROCS\s+(\d+)"), ('maxcore', r"%maxcore\s+(\d+)"),
+                         ('nworkers', r"NWORKERS\s+(\d+)")):
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            resources[key] = int(match.group(1))
+    return resources
+
+def read_goat_structure(goat_input):
+    """Charge, multiplicity, element symbols and coordinates of a GOAT input"""
+    with open(goat_input, 'r') as f:
+        lines = f.read().splitlines()
+    for i, line in enumerate(lines):
+        match = re.match(r'\*\s*xyz\s+(-?\d+)\s+(\d+)', line.strip())
+        if match:
+            break
+    else:
+        raise ValueError(f"No '* xyz' block in {goat_input}")
+    coordinates = []
+    for line in lines[i + 1:]:
+        if line.strip() == "*":
+            break
+        coordinates.append(line)
+    symbols, coords = parse_coordinates(coordinates)
+    return int(match.group(1)), int(match.group(2)), symbols, coords
+
+def job_memory(resources):
+    """Memory a job may use on the node: maxcore is per process and ORCA exceeds it by ~25 %"""
+    return resources['nprocs'] * resources['maxcore'] / MEMORY_FRACTION
+
+def packing_plan(jobs, node=DEFAULT_NODE):
+    """
+    Group GOAT jobs onto nodes (first-fit decreasing on cores, then memory), so that small jobs
+    share a node instead of each one occupying a whole node.
+    jobs: list of (goat_input, resources)
+    """
+    nodes = []
+    open_nodes = []  # nodes with free cores, full ones are dropped to keep the search short
+    for goat_input, resources in sorted(jobs, key=lambda j: (-j[1]['nprocs'], -job_memory(j[1]), j[0])):
+        memory = job_memory(resources)
+        for plan in open_nodes:
+            if plan['cores'] + resources['nprocs'] <= node.cores and plan['memory_mb'] + memory <= node.memory_mb:
+                break
+        else:
+            plan = {'cores': 0, 'memory_mb': 0.0, 'jobs': []}
+            nodes.append(plan)
+            open_nodes.append(plan)
+        plan['cores'] += resources['nprocs']
+        plan['memory_mb'] += memory
+        plan['jobs'].append({'input': goat_input, 'nprocs': resources['nprocs'], 'maxcore': resources['maxcore']})
+        if plan['cores'] >= node.cores:
+            open_nodes.remove(plan)
+    for i, plan in enumerate(nodes):
+        plan['node'] = i
+        plan['memory_mb'] = int(plan['memory_mb'])
+        plan['core_utilization'] = round(plan['cores'] / node.cores, 3)
+        plan['memory_utilization'] = round(plan['memory_mb'] / node.memory_mb, 3)
+    return {
+        'node': node._asdict(),
+        'jobs': len(jobs),
+        'nodes_needed': len(nodes),
+        'cores_requested': sum(r['nprocs'] for _, r in jobs),
+        'mean_core_utilization': round(sum(p['core_utilization'] for p in nodes) / len(nodes), 3) if nodes else 0.0,
+        'nodes': nodes,
+    }
+
+def write_packing_plan(plan_file, plan):
+    with open(plan_file, 'w') as f:
+        json.dump(plan, f, indent=2)
@@ -0,0 +1,341 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import subprocess
+
+from GoatResources import DEFAULT_NODE, parse_node, read_goat_resources
+from GoatArrays import SCHEDULER_TEMPLATES, marker_path, write_arrays
+from GoatBundles import BUNDLE_MAP, BUNDLED_DIR, JOB_SEPARATOR, PARTIAL_DIR, bundle_block
+
+# Output files may be compressed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from CompressedIO import has_extension, open_text, read_tail, resolve_path
+
+# Restart of GOAT runs that were killed (preemption, wall-time limit) before they finished.
+#
+# A GOAT job in the GOAT directory is
+#   finished     <job>.finalensemble.xyz exists (and <job>.out, if there is one, ends with
+#                ORCA TERMINATED NORMALLY; the members of a bundle share the bundle .out)
+#   partial      its .out exists, the run did not finish and left intermediate structures behind
+#   started      its .out exists without any intermediate structure (running, or stopped before the first one)
+#   not_started  no output yet
+# Only partial runs that were preempted are restarted: the newest resume marker of the job in the array
+# directories (GoatArrays.py) is a .failed marker of a run stopped by a signal (preemption, wall-time
+# limit), or there is no marker and the output has not changed for stale_hours (runs started outside
+# GoatArrays, node failures, SIGKILL, out-of-memory kills). Otherwise the run may still be going; a run
+# that ended on its own (e.g. an ORCA error) would fail the same way again. force restarts every partial run.
+# For a partial run the lowest-energy structure of the files the run left behind (<job>.xyz,
+# <job>.globalminimum.xyz, intermediate ensembles: every <job>.*.xyz except the final ensemble)
+# replaces the coordinates of the GOAT input, so the rerun continues from the best structure found
+# instead of the xTB geometry. The original input is kept as <job>.inp.orig, the files of the
+# interrupted run are moved to partial/<job>_<n>/, and restart_log.json counts the restarts.
+
+FINISHED = "finished"
+PARTIAL = "partial"
+STARTED = "started"
+NOT_STARTED = "not_started"
+
+PREEMPTED = "preempted"
+FAILED = "failed"
+RUNNING = "running"  # no failure marker newer than the output
+STALE = "stale"  # no failure marker, output unchanged for stale_hours
+STALE_HOURS = 24.0
+ARRAY_DIRS = ("arrays", "arrays_restart")  # default array directories of XTBzuGOAT.py and of resubmit
+
+ORIGINAL_SUFFIX = ".orig"  # <job>.inp.orig: GOAT input before the first restart
+RESTART_LOG = "restart_log.json"
+
+def goat_jobs(goat_dir):
+    """
+    GOAT jobs of a directory: {job: (input, bundle or None)}. The members of a bundle have their
+    single input in bundled/ and are run through the bundle input (members that finished before
+    their bundle was restarted are no longer in the bundle map).
+    """
+    jobs = {}
+    for directory in (os.path.join(goat_dir, BUNDLED_DIR), goat_dir):  # an input in goat_dir is the one that runs
+        if not os.path.isdir(directory):
+            continue
+        for file in sorted(os.listdir(directory)):
+            if file.endswith(".inp") and not file.startswith("bundle_"):
+                jobs[file[:-len(".inp")]] = (os.path.join(directory, file), None)
+    map_file = os.path.join(goat_dir, BUNDLE_MAP)
+    if os.path.exists(map_file):
+        with open(map_file) as f:
+            for bundle, members in json.load(f).items():
+                for job in members:
+                    jobs[job] = (os.path.join(goat_dir, BUNDLED_DIR, f"{job}.inp"), bundle)
+    return jobs
+
+def job_state(goat_dir, job, bundle=None):
+    ensemble = resolve_path(os.path.join(goat_dir, f"{job}.finalensemble.xyz"))
+    out = resolve_path(os.path.join(goat_dir, f"{bundle or job}.out"))
+    if ensemble and (bundle or not out or "ORCA TERMINATED NORMALLY" in read_tail(out)):
+        return FINISHED
+    if out:
+        return PARTIAL if intermediate_files(goat_dir, job) else STARTED
+    return NOT_STARTED
+
+def array_dirs(goat_dir, extra=()):
+    """Existing array directories with resume markers: the default ones in goat_dir and the given ones"""
+    dirs = [os.path.join(goat_dir, name) for name in ARRAY_DIRS] + [d for d in extra if d]
+    return [d for d in dict.fromkeys(dirs) if os.path.isdir(os.path.join(d, "markers"))]
+
+def run_outcome(goat_dir, job, bundle=None, dirs=(), stale_hours=STALE_HOURS):
+    """
+    PREEMPTED, FAILED, RUNNING or STALE for the last run of a partial job (a bundle member has the markers of
+    its bundle): from the newest .done/.failed marker in the array directories, if it is not older than the
+    output; without one from the age of the output (stale_hours None or 0: never STALE).
+    """
+    name = bundle or job
+    out = resolve_path(os.path.join(goat_dir, f"{name}.out"))
+    newest = None
+    for array_dir in dirs:
+        for state in ("done", "failed"):
+            marker = marker_path(array_dir, name, state)
+            if os.path.exists(marker) and (newest is None or os.path.getmtime(marker) > newest[0]):
+                newest = (os.path.getmtime(marker), state, marker)
+    if newest is None or newest[1] != "failed" or (out and newest[0] < os.path.getmtime(out)):
+        if stale_hours and out and time.time() - os.path.getmtime(out) > stale_hours * 3600:
+            return STALE
+        return RUNNING
+    with open(newest[2]) as f:
+        info = json.load(f)
+    # run_task marks the jobs it stops on SIGTERM; a negative return code is a job killed by a signal
+    if info.get('preempted') or (info.get('return_code') or 0) < 0:
+        return PREEMPTED
+    return FAILED
+
+def scan(goat_dir):
+    """{job: state} for all GOAT jobs of goat_dir"""
+    return {job: job_state(goat_dir, job, bundle) for job, (_, bundle) in goat_jobs(goat_dir).items()}
+
+def read_frames(xyz_path):
+    """(energy, coordinate lines) of every frame of a (multi-)xyz file; energy from the comment line, inf if none"""
+    with open_text(xyz_path) as f:
+        lines = f.read().splitlines()
+    frames = []
+    i = 0
+    while i < len(lines):
+        try:
+            n_atoms = int(lines[i].strip())
+        except ValueError:
+            break
+        match = re.search(r'-?\d+\.\d+', lines[i + 1]) if i + 1 < len(lines) else None
+        frame = [line.strip() for line in lines[i + 2:i + 2 + n_atoms]]
+        if len(frame) == n_atoms:
+            frames.append((float(match.group(0)) if match else math.inf, frame))
+        i += 2 + n_atoms
+    return frames
+
+def intermediate_files(goat_dir, job):
+    """Structure files a GOAT run leaves behind before the final ensemble"""
+    return [os.path.join(goat_dir, file) for file in sorted(os.listdir(goat_dir))
+            if file.startswith(f"{job}.") and has_extension(file, ".xyz")
+            and not has_extension(file, ".finalensemble.xyz")]
+
+def best_structure(goat_dir, job):
+    """(energy, coordinate lines, file) of the lowest-energy structure of a partial run, None if there is none"""
+    best = None
+    for path in intermediate_files(goat_dir, job):
+        for energy, frame in read_frames(path):
+            if best is None or energy < best[0]:
+                best = (energy, frame, path)
+    return best
+
+def replace_coordinates(goat_content, coordinates):
+    """GOAT input with the coordinates of the * xyz block replaced"""
+    lines = goat_content.splitlines()
+    start = next(i for i, line in enumerate(lines) if line.strip().lower().startswith("* xyz"))
+    end = next(i for i in range(start + 1, len(lines)) if lines[i].strip() == "*")
+    return "\n".join(lines[:start + 1] + coordinates + lines[end:]) + "\n"
+
+def archive_partial(goat_dir, job):
+    """Move the files of an interrupted run (all <job>.* except the inputs) to partial/<job>_<n>/"""
+    files = [file for file in os.listdir(goat_dir)
+             if file.startswith(f"{job}.") and not file.endswith(".inp") and not file.endswith(".inp" + ORIGINAL_SUFFIX)]
+    n = 1
+    while os.path.exists(os.path.join(goat_dir, PARTIAL_DIR, f"{job}_{n}")):
+        n += 1
+    target = os.path.join(goat_dir, PARTIAL_DIR, f"{job}_{n}")
+    os.makedirs(target)
+    for file in files:
+        shutil.move(os.path.join(goat_dir, file), os.path.join(target, file))
+    return target
+
+def restartable(outcome, force=False):
+    return force or outcome in (PREEMPTED, STALE)
+
+def prepare_restarts(goat_dir, dirs=None, skipped=None, stale_hours=STALE_HOURS, force=False):
+    """
+    Write restart inputs for the preempted or stale partial GOAT runs of goat_dir (all of them with
+    force, see module comment); dirs are the array directories with the resume markers (default:
+    array_dirs(goat_dir)). Bundles with unfinished members are rewritten with only those members;
+    the bundle .out goes to partial/ as well.
+    Returns {job: info} of the restarted jobs; the other partial jobs go to skipped ({job: outcome}) if given.
+    """
+    dirs = array_dirs(goat_dir) if dirs is None else dirs
+    log_file = os.path.join(goat_dir, RESTART_LOG)
+    log = {}
+    if os.path.exists(log_file):
+        with open(log_file) as f:
+            log = json.load(f)
+
+    jobs = goat_jobs(goat_dir)
+    restarted = {}
+    for job, (goat_input, bundle) in jobs.items():
+        if job_state(goat_dir, job, bundle) != PARTIAL:
+            continue
+        outcome = run_outcome(goat_dir, job, bundle, dirs, stale_hours)
+        if not restartable(outcome, force):
+            if skipped is not None:
+                skipped[job] = outcome
+            continue
+        best = best_structure(goat_dir, job)
+        with open(goat_input) as f:
+            content = f.read()
+        if not os.path.exists(goat_input + ORIGINAL_SUFFIX):
+            shutil.copy2(goat_input, goat_input + ORIGINAL_SUFFIX)
+        if best is not None:
+            content = replace_coordinates(content, best[1])
+            with open(goat_input, 'w') as f:
+                f.write(content)
+        archive = archive_partial(goat_dir, job)
+        entry = log.setdefault(job, {'restarts': 0})
+        entry.update(restarts=entry['restarts'] + 1, time=time.strftime('%Y-%m-%d %H:%M:%S'),
+                     energy=None if best is None or math.isinf(best[0]) else best[0],
+                     source=os.path.basename(best[2]) if best else None, archive=archive)
+        restarted[job] = entry
+
+    # Bundles: keep the unfinished members only, with their (restarted) inputs
+    map_file = os.path.join(goat_dir, BUNDLE_MAP)
+    if os.path.exists(map_file):
+        with open(map_file) as f:
+            bundle_map = json.load(f)
+        for bundle, members in bundle_map.items():
+            if not any(job in restarted for job in members):
+                continue
+            remaining = [job for job in members if job_state(goat_dir, job, bundle) != FINISHED]
+            blocks = []
+            for job in remaining:
+                with open(jobs[job][0]) as f:
+                    blocks.append(bundle_block(job, f.read()))
+            with open(os.path.join(goat_dir, f"{bundle}.inp"), 'w') as f:
+                f.write(f"\n{JOB_SEPARATOR}\n\n".join(blocks))
+            archive_partial(goat_dir, bundle)
+            bundle_map[bundle] = remaining
+        with open(map_file, 'w') as f:
+            json.dump(bundle_map, f, indent=2)
+
+    with open(log_file, 'w') as f:
+        json.dump(log, f, indent=2)
+    return restarted
+
+def unfinished_inputs(goat_dir, dirs=None, stale_hours=STALE_HOURS, force=False):
+    """
+    GOAT inputs (single inputs and bundles) that still have to run: not started, or stopped by a
+    preemption or stale (runs that may still be going or that failed on their own are left out, unless force)
+    """
+    dirs = array_dirs(goat_dir) if dirs is None else dirs
+    inputs = set()
+    for job, (goat_input, bundle) in goat_jobs(goat_dir).items():
+        state = job_state(goat_dir, job, bundle)
+        if state == NOT_STARTED or (state != FINISHED
+                                    and restartable(run_outcome(goat_dir, job, bundle, dirs, stale_hours), force)):
+            inputs.add(os.path.join(goat_dir, f"{bundle}.inp") if bundle else goat_input)
+    return sorted(inputs)
+
+def resubmit(goat_dir, array_dir, n_tasks, node=DEFAULT_NODE, scheduler='slurm', orca_path='orca',
+             walltime='24:00:00', submit=False, markers=(), stale_hours=STALE_HOURS, force=False):
+    """
+    Job array of the unfinished GOAT jobs only (optionally submitted right away); markers are further
+    array directories with resume markers. Returns the array index.
+    """
+    inputs = unfinished_inputs(goat_dir, array_dirs(goat_dir, list(markers) + [array_dir]), stale_hours, force)
+    if not inputs:
+        return None
+    index = write_arrays([(path, read_goat_resources(path)) for path in inputs], array_dir, n_tasks, node,
+                         scheduler, orca_path, walltime, name='goat_restart')
+    # Markers of an earlier resubmission would make run-task skip these jobs
+    for path in inputs:
+        for state in ("done", "failed"):
+            marker = marker_path(array_dir, os.path.splitext(os.path.basename(path))[0], state)
+            if os.path.exists(marker):
+                os.remove(marker)
+    if submit:
+        command = "sbatch" if scheduler == 'slurm' else "qsub"
+        subprocess.run([command, os.path.join(os.path.abspath(array_dir), "submit_goat_array.sh")], check=True)
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Restart interrupted GOAT runs from their best structure and resubmit them")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    status = sub.add_parser("status", help="Count finished, partial, started and not started GOAT jobs")
+    status.add_argument("goat_dir")
+    status.add_argument("--list", action="store_true", help="Also list the unfinished jobs")
+
+    prepare = sub.add_parser("prepare", help="Write restart inputs for the preempted partial GOAT runs")
+    prepare.add_argument("goat_dir")
+
+    again = sub.add_parser("resubmit", help="Prepare restarts and write a job array of the unfinished jobs only")
+    again.add_argument("goat_dir")
+    again.add_argument("--tasks", "-n", type=int, required=True, help="Number of array tasks")
+    again.add_argument("--array-dir", default=None, help="Default: <goat_dir>/arrays_restart")
+    again.add_argument("--node", default=None, help="Node the tasks run on, 'cores,memory_GB' (default: 8,32)")
+    again.add_argument("--scheduler", choices=sorted(SCHEDULER_TEMPLATES), default="slurm")
+    again.add_argument("--walltime", default="24:00:00")
+    again.add_argument("--orca-path", default="orca")
+    again.add_argument("--submit", action="store_true", help="Submit the array with sbatch/qsub")
+    for command in (status, prepare, again):
+        command.add_argument("--markers", action="append", default=[],
+                             help=f"Further array directory with resume markers (default: {', '.join(ARRAY_DIRS)} in goat_dir)")
+        command.add_argument("--stale-hours", type=float, default=STALE_HOURS,
+                             help=f"Restart partial runs without a marker whose output has not changed for this long "
+                                  f"(default: {STALE_HOURS:g}, 0: never)")
+    for command in (prepare, again):
+        command.add_argument("--force", action="store_true",
+                             help="Restart every partial run (also those that may still be running or failed on their own)")
+
+    args = parser.parse_args()
+    dirs = array_dirs(args.goat_dir, args.markers)
+    if args.mode == "status":
+        jobs = goat_jobs(args.goat_dir)
+        states = scan(args.goat_dir)
+        for state in (FINISHED, PARTIAL, STARTED, NOT_STARTED):
+            print(f"{state}: {sum(s == state for s in states.values())}")
+        outcomes = {job: run_outcome(args.goat_dir, job, jobs[job][1], dirs, args.stale_hours)
+                    for job, state in states.items() if state == PARTIAL}
+        if outcomes:
+            print("  partial: " + ", ".join(f"{sum(o == outcome for o in outcomes.values())} {outcome}"
+                                            for outcome in (PREEMPTED, STALE, FAILED, RUNNING)))
+        if args.list:
+            for job, state in states.items():
+                if state != FINISHED:
+                    print(f"  {job}: {state}" + (f" ({outcomes[job]})" if job in outcomes else ""))
+        return
+
+    skipped = {}
+    restarted = prepare_restarts(args.goat_dir, dirs, skipped, args.stale_hours, args.force)
+    from_best = sum(info['source'] is not None for info in restarted.values())
+    print(f"{len(restarted)} preempted or stale GOAT runs prepared for restart ({from_best} from their best structure so far)")
+    if skipped:
+        print(f"Not restarted: {sum(o == RUNNING for o in skipped.values())} partial runs without a failure marker "
+              f"(possibly still running), {sum(o == FAILED for o in skipped.values())} that failed on their own "
+              f"(--force restarts them)")
+    if args.mode == "resubmit":
+        array_dir = args.array_dir or os.path.join(args.goat_dir, "arrays_restart")
+        index = resubmit(args.goat_dir, array_dir, args.tasks, parse_node(args.node) if args.node else DEFAULT_NODE,
+                         args.scheduler, args.orca_path, args.walltime, args.submit, args.markers,
+                         args.stale_hours, args.force)
+        if index is None:
+            print("All GOAT jobs are finished")
+        else:
+            print(f"{index['jobs']} unfinished GOAT inputs in {index['tasks']} array tasks in {array_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import numpy as np
+
+# RMSD of structures after optimal superposition (Kabsch), for comparing optimized complexes.
+#
+# kabsch_rmsd works on batches: P and Q of shape (..., n, 3) give (...) RMSDs in one call.
+# permutation_rmsd also allows the atoms of one element to be in a different order in the two
+# structures (isomers built with the ligands in a different order, equivalent H atoms): the atoms
+# are matched per element after aligning the principal axes, then superimposed with Kabsch.
+# Every matching it tries is a valid one, so the result is never below the true RMSD;
+# it can miss the best matching of highly symmetric structures, never merge different ones.
+
+def centered(coords):
+    return coords - coords.mean(axis=-2, keepdims=True)
+
+def kabsch_rotation(P, Q):
+    """Rotation matrices R (..., 3, 3) that best superimpose centered Q onto centered P (Q @ R ~ P)"""
+    H = np.einsum('...ni,...nj->...ij', Q, P)
+    U, _, Vt = np.linalg.svd(H)
+    d = np.sign(np.linalg.det(U @ Vt))
+    # No reflections: flip the axis of the smallest singular value where det would be -1
+    D = np.broadcast_to(np.eye(3), H.shape).copy()
+    D[..., 2, 2] = np.where(d == 0, 1.0, d)
+    return U @ D @ Vt
+
+def kabsch_rmsd(P, Q):
+    """RMSD of P and Q (..., n, 3) after centering and optimal rotation, atoms in the same order"""
+    P = centered(np.asarray(P, dtype=float))
+    Q = centered(np.asarray(Q, dtype=float))
+    R = kabsch_rotation(P, Q)
+    diff = Q @ R - P
+    return np.sqrt(np.einsum('...ni,...ni->...', diff, diff) / P.shape[-2])
+
+def linear_assignment(cost):
+    """
+    Minimum-cost matching of a square cost matrix (Hungarian algorithm with potentials, O(n^3)).
+    Returns cols with row i assigned to column cols[i].
+    """
+    n = cost.shape[0]
+    u = np.zeros(n + 1)
+    v = np.zeros(n + 1)
+    p = np.zeros(n + 1, dtype=int)   # p[j]: row matched to column j (1-based, 0 = none)
+    way = np.zeros(n + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(n + 1, np.inf)
+        used = np.zeros(n + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(masked)) + 1
+            delta = masked[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    cols = np.empty(n, dtype=int)
+    cols[p[1:] - 1] = np.arange(n)
+    return cols
+
+def element_groups(symbols):
+    """Element -> indices of its atoms"""
+    groups = {}
+    for i, symbol in enumerate(symbols):
+        groups.setdefault(symbol, []).append(i)
+    return {symbol: np.array(indices) for symbol, indices in groups.items()}
+
+def match_atoms(groups_p, P, groups_q, Q):
+    """Order of the atoms of Q that puts every atom next to the atom of the same element in P"""
+    order = np.empty(len(P), dtype=int)
+    for symbol, idx_p in groups_p.items():
+        idx_q = groups_q[symbol]
+        diff = P[idx_p][:, None, :] - Q[idx_q][None, :, :]
+        order[idx_p] = idx_q[linear_assignment(np.einsum('ijk,ijk->ij', diff, diff))]
+    return order
+
+def principal_frame(X):
+    """Centered coordinates rotated onto their principal axes (largest spread first)"""
+    _, vectors = np.linalg.eigh(X.T @ X)
+    return X @ vectors[:, ::-1]
+
+# Sign changes of the principal axes that are proper rotations
+AXIS_FLIPS = np.array([[1, 1, 1], [1, -1, -1], [-1, 1, -1], [-1, -1, 1]], dtype=float)
+
+def permutation_rmsd(symbols_p, P, symbols_q, Q, refine=2):
+    """
+    Lowest RMSD found over the atom orders of Q that keep the elements (and the order as given).
+    The structures must have the same composition.
+    """
+    P = centered(np.asarray(P, dtype=float))
+    Q = centered(np.asarray(Q, dtype=float))
+    groups_p = element_groups(symbols_p)
+    groups_q = element_groups(symbols_q)
+
+    orders = []
+    if list(symbols_p) == list(symbols_q):
+        orders.append(np.arange(len(P)))
+    P_frame = principal_frame(P)
+    Q_frame = principal_frame(Q)
+    for flip in AXIS_FLIPS:
+        orders.append(match_atoms(groups_p, P_frame, groups_q, Q_frame * flip))
+    orders = np.array(orders)
+
+    # Kabsch on all candidate orders at once, then re-match after the optimal rotation
+    for _ in range(refine):
+        candidates = Q[orders]
+        rotations = kabsch_rotation(P[None], candidates)
+        rotated = Q @ rotations
+        orders = np.array([match_atoms(groups_p, P, groups_q, r) for r in rotated])
+    return float(kabsch_rmsd(P[None], Q[orders]).min())
+
+def distance_fingerprint(coords):
+    """Sorted interatomic distances: independent of rotation and atom order"""
+    coords = np.asarray(coords, dtype=float)
+    i, j = np.triu_indices(len(coords), k=1)
+    return np.sort(np.linalg.norm(coords[i] - coords[j], axis=1))
+
+def cluster_structures(symbols_list, coords_list, threshold, order=None):
+    """
+    Greedy clustering of structures of the same composition: in the given order (e.g. by energy),
+    a structure joins the first representative within threshold (Angstrom RMSD), otherwise it
+    becomes a representative itself.
+    Returns (representative index, RMSD to it) for every structure.
+
+    Two structures with RMSD r have sorted distance lists with an RMS difference of at most 2 r,
+    so representatives failing that bound are skipped without an alignment (one batched check).
+    """
+    n = len(coords_list)
+    order = list(order) if order is not None else list(range(n))
+    fingerprints = [distance_fingerprint(c) for c in coords_list]
+    assignment = [None] * n
+    reps = []
+    rep_fingerprints = None
+    for i in order:
+        if reps:
+            fp_rms = np.sqrt(np.mean((rep_fingerprints - fingerprints[i]) ** 2, axis=1)) \
+                if fingerprints[i].size else np.zeros(len(reps))
+            for k in np.argsort(fp_rms, kind='stable'):
+                if fp_rms[k] > 2 * threshold:
+                    break
+                rep = reps[k]
+                rmsd = permutation_rmsd(symbols_list[rep], coords_list[rep], symbols_list[i], coords_list[i])
+                if rmsd <= threshold:
+                    assignment[i] = (rep, rmsd)
+                    break
+        if assignment[i] is None:
+            assignment[i] = (i, 0.0)
+            reps.append(i)
+            fp = fingerprints[i][None, :]
+            rep_fingerprints = fp if rep_fingerprints is None else np.vstack([rep_fingerprints, fp])
+    return assignment
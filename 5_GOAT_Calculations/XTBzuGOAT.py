@@ -2,51 +2,81 @@ import os
 import glob
 import shutil
 import re
+import json
+import time
+import sqlite3
 import logging
+import sys
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('goat_conversion.log')
-    ]
-)
+import numpy as np
+
+# The xTB results table lives next to OrcaFlotte
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from XTBResults import ResultsTable
+from PipelineLogging import setup_logging, worker_logging, log_event, log_sampled
+from CompressedIO import file_contains, has_extension, open_text, read_tail, resolve_path, strip_compression_suffix
+
+# Job manifest and geometry names of StartUp.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "3_Complex_Generator"))
+from Manifest import Manifest, find_manifest
+from StartUp import GERMAN_TO_ENGLISH_GEOMETRY, geometry_abbreviations as STARTUP_ABBREVIATIONS
+
+from GoatResources import (DEFAULT_NODE, DEFAULT_RESOURCES, packing_plan, parse_node, read_goat_resources,
+                           read_goat_structure, resources_for_coordinates, write_packing_plan)
+from GoatArrays import SCHEDULER_TEMPLATES, collect_goat_inputs, write_arrays
+from KabschRMSD import cluster_structures, distance_fingerprint, permutation_rmsd
+from GoatBundles import BUNDLE_MAP, BUNDLE_MAX_ATOMS, BUNDLED_DIR, JOBS_PER_BUNDLE, write_bundles
+from GoatRestart import ORIGINAL_SUFFIX, STALE_HOURS, array_dirs, prepare_restarts, unfinished_inputs
+
+# Logging is configured in main(); when OrcaFlotte imports GoatHandoff, the records go to its log
 logger = logging.getLogger('goat_converter')
+events = logging.getLogger('goat_converter.events')
+
+TAIL_BYTES = 16384  # end of an xTB output that holds HURRAY and ORCA TERMINATED NORMALLY
+DEDUP_RMSD = 0.1  # Angstrom; the same xTB minimum reached from different starts agrees far better than this
+DUPLICATES_DIR = "duplicates"  # subdirectory of the GOAT directory for inputs of duplicate structures
+
+# Mapping of geometry folder names to their polyhedral abbreviations
+GEOMETRY_ABBREVIATIONS = {
+    "Linear": "L",
+    "Oktaedrisch": "OC",
+    "Quadratisch_Planar": "SP", 
+    "Quadratisch_Pyramidal": "SPY",
+    "T_Foermig": "TS",
+    "Tetraedrisch": "T",
+    "Trigonal_Bipyramidal": "TBPY",
+    "Trigonal_Planar": "TP",
+    "Trigonal_Prismatisch": "TPR",
+    "Trigonal_Pyramidal": "TPY"
+}
+# Folders as written by StartUp.py (English names) and the German database names
+for _geom_de, _geom_en in GERMAN_TO_ENGLISH_GEOMETRY.items():
+    GEOMETRY_ABBREVIATIONS[_geom_en.replace(" ", "")] = STARTUP_ABBREVIATIONS[_geom_de]
+    GEOMETRY_ABBREVIATIONS[_geom_de] = STARTUP_ABBREVIATIONS[_geom_de]
 
 def extract_geometry_type(file_path):
     """
     Extract geometry type from file path and return its polyhedral abbreviation.
-    Example: /path/to/XTB/Linear/Ag/Ag_1_Cl_Cl/file.xyz -> LN
-    """
-    # Define mapping of geometry types to their polyhedral abbreviations
-    geometry_abbreviations = {
-        "Linear": "L",
-        "Oktaedrisch": "OC",
-        "Quadratisch_Planar": "SP", 
-        "Quadratisch_Pyramidal": "SPY",
-        "T_Foermig": "TS",
-        "Tetraedrisch": "T",
-        "Trigonal_Bipyramidal": "TBPY",
-        "Trigonal_Planar": "TP",
-        "Trigonal_Prismatisch": "TPR",
-        "Trigonal_Pyramidal": "TPY"
-    }
-    
+    Only used for outputs without a manifest record.
+    Example: /path/to/XTB/Linear/Ag/Ag_1_Cl_Cl/file.xyz -> L
+    """
     parts = Path(file_path).parts
     
     # Look for known geometry patterns in path
     for part in parts:
-        if part in geometry_abbreviations:
-            return geometry_abbreviations[part]
+        if part in GEOMETRY_ABBREVIATIONS:
+            return GEOMETRY_ABBREVIATIONS[part]
     
     return "UNK"  # Unknown geometry
 
 def read_xyz_file(xyz_path):
-    """Read an XYZ file and return atom count, title and coordinates"""
-    with open(xyz_path, 'r') as f:
+    """Read an XYZ file (possibly compressed) and return atom count, title and coordinates"""
+    with open_text(xyz_path) as f:
         lines = f.readlines()
     
     if len(lines) < 2:
@@ -58,12 +88,12 @@ def read_xyz_file(xyz_path):
     
     return atom_count, title, coordinates
 
-def create_goat_input(xyz_path, original_inp_path=None, charge=None, multiplicity=None):
-    """Create GOAT input content from XYZ file"""
+def create_goat_input(xyz_path, original_inp_path=None, charge=None, multiplicity=None, resources=None):
+    """Create GOAT input content from XYZ file (charge and multiplicity from the manifest or the original input)"""
     atom_count, title, coordinates = read_xyz_file(xyz_path)
     
-    # Try to determine charge and multiplicity from original input file if available
-    if original_inp_path and os.path.exists(original_inp_path):
+    # Without a manifest record, determine charge and multiplicity from original input file if available
+    if (charge is None or multiplicity is None) and original_inp_path and os.path.exists(original_inp_path):
         try:
             with open(original_inp_path, 'r') as f:
                 content = f.read()
@@ -79,13 +109,16 @@ def create_goat_input(xyz_path, original_inp_path=None, charge=None, multiplicit
     if charge is None or multiplicity is None:
         return None
     
+    # Cores and memory (see GoatResources.choose_resources)
+    resources = resources or DEFAULT_RESOURCES
+
     # Create GOAT input content
     input_content = [
         "!GOAT XTB TightSCF",
-        "%PAL NPROCS 8 END",
-        "%maxcore 3000",
+        f"%PAL NPROCS {resources['nprocs']} END",
+        f"%maxcore {resources['maxcore']}",
         "%GOAT",
-        "NWORKERS 8",
+        f"NWORKERS {resources['nworkers']}",
         "AUTOWALL TRUE",
         "END",
         f"* xyz {charge} {multiplicity}",
@@ -98,120 +131,640 @@ def create_goat_input(xyz_path, original_inp_path=None, charge=None, multiplicit
     return '\n'.join(input_content)
 
 def check_successful_calculation(out_path):
-    """Check if ORCA calculation was successful by looking for key strings"""
+    """
+    Check if ORCA calculation was successful by looking for key strings.
+    Both sit near the end of the output, so only the last TAIL_BYTES are read; the whole
+    file is only searched (backwards, memory-mapped) if ORCA terminated normally but
+    HURRAY is further up.
+    """
     try:
-        with open(out_path, 'r') as f:
-            content = f.read()
-            has_hurray = "HURRAY" in content
-            has_terminated = "ORCA TERMINATED NORMALLY" in content
-            return has_hurray and has_terminated
+        tail = read_tail(out_path, TAIL_BYTES)
+        if "ORCA TERMINATED NORMALLY" not in tail:
+            return False
+        return "HURRAY" in tail or file_contains(out_path, "HURRAY")
     except:
         return False
 
+class CompletionIndex:
+    """
+    Completion status of xTB outputs keyed by path, size and mtime (SQLite), so that repeated
+    conversions of a growing tree only check new or changed outputs.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS completion "
+                          "(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, success INTEGER)")
+        self.entries = {path: (size, mtime, bool(success)) for path, size, mtime, success
+                        in self.conn.execute("SELECT path, size, mtime, success FROM completion")}
+        self.updates = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, path, stat):
+        """Cached status (True/False) if the output is unchanged since it was checked, else None"""
+        entry = self.entries.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return entry[2]
+        return None
+
+    def update(self, path, stat, success):
+        self.entries[path] = (stat.st_size, stat.st_mtime, success)
+        self.updates.append((path, stat.st_size, stat.st_mtime, int(success)))
+
+    def commit(self):
+        if self.updates:
+            self.conn.executemany("INSERT OR REPLACE INTO completion VALUES (?, ?, ?, ?)", self.updates)
+            self.conn.commit()
+            self.updates = []
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
 def find_xyz_for_output(out_path):
-    """Find corresponding XYZ file for a given output file"""
-    base_path = os.path.splitext(out_path)[0]
-    xyz_path = base_path + ".xyz"
-    if os.path.exists(xyz_path):
-        return xyz_path
-    return None
-
-def process_directory(base_dir, goat_dir="<GOAT_Input>", test_mode=False, limit=5):  # Path to output containing the GOAT input files
-    """Process all XTB calculations in the 'Linear' subdirectory."""
-    # Restrict processing to the 'Linear' subdirectory
-    linear_dir = os.path.join(base_dir, "<Linear>")  # Path to the 'Linear' subdirectory 
-    if not os.path.exists(linear_dir):
-        logger.error(f"The 'Linear' subdirectory does not exist in {base_dir}.")
+    """Find corresponding XYZ file (possibly compressed) for a given output file"""
+    base_path = os.path.splitext(strip_compression_suffix(out_path))[0]
+    return resolve_path(base_path + ".xyz")
+
+def convert_output(out_path, goat_output_dir, known_success=None, record=None, node=DEFAULT_NODE, input_path=None):
+    """
+    Convert a single xTB output into a GOAT input (runs in a worker process).
+    known_success: completion status from the results table or the completion index (None: check the output)
+    record: manifest record of the xTB job (None: charge, multiplicity and geometry are taken from the files)
+    node: NodeSpec the resources are chosen for (None: fixed 8 cores / 3000 MB)
+    input_path: xTB input of the job, next to which the .xyz was written (default: next to the output)
+    Returns a dict with the status ('converted', 'not_successful', 'no_xyz', 'missing_charge', 'error');
+    'checked' holds the result of a completion check that was actually done.
+    """
+    entry = {'out_path': out_path,
+             'geometry': record['geometry_abbr'] if record else extract_geometry_type(input_path or out_path)}
+    try:
+        # Check if the calculation was successful
+        was_successful = known_success
+        if was_successful is None:
+            was_successful = entry['checked'] = check_successful_calculation(out_path)
+        if not was_successful:
+            entry['status'] = 'not_successful'
+            return entry
+
+        # Find the corresponding XYZ file
+        xyz_path = find_xyz_for_output(input_path or out_path)
+        if not xyz_path:
+            entry['status'] = 'no_xyz'
+            return entry
+
+        # Get original input file path
+        input_path = input_path or os.path.splitext(strip_compression_suffix(out_path))[0] + ".inp"
+
+        # Cores and memory from atom count and rotatable bonds
+        resources = None
+        if node is not None:
+            resources = resources_for_coordinates(read_xyz_file(xyz_path)[2], node)
+            entry['resources'] = resources
+
+        # Create GOAT input content
+        if record:
+            goat_content = create_goat_input(xyz_path, charge=record['charge'], multiplicity=record['multiplicity'],
+                                             resources=resources)
+        else:
+            goat_content = create_goat_input(xyz_path, input_path, resources=resources)
+        if goat_content is None:
+            entry['status'] = 'missing_charge'
+            return entry
+
+        # Write to new file
+        new_path = os.path.join(goat_output_dir, goat_input_name(input_path, record))
+        with open(new_path, 'w') as f:
+            f.write(goat_content)
+
+        entry['status'] = 'converted'
+        entry['goat_input'] = new_path
+    except Exception as e:
+        entry['status'] = 'error'
+        entry['error'] = str(e)
+    return entry
+
+class GoatHandoff:
+    """
+    Incremental hand-off from OrcaFlotte: called in its main process for every successful xTB job
+    (OrcaJobQueue on_success), writes the GOAT input right away instead of after the whole tree
+    has finished. The 'goat' record goes into the manifest object of the queue (a second
+    connection would be locked out by the queue's open transaction).
+    A new input within dedup_rmsd of an input already in the GOAT directory (same composition, charge
+    and multiplicity) is moved to duplicates/ and its record marked 'duplicate_structure'. Unlike
+    deduplicate_structures, the structure that finished first is kept, not the one with the lowest
+    energy; a later XTBzuGOAT run over the tree reclusters all inputs by energy.
+    """
+
+    def __init__(self, goat_dir, node=DEFAULT_NODE, manifest=None, dedup_rmsd=DEDUP_RMSD):
+        self.goat_dir = goat_dir
+        self.node = node
+        self.manifest = manifest
+        self.dedup_rmsd = dedup_rmsd
+        os.makedirs(goat_dir, exist_ok=True)
+        self.written = {}  # GOAT input name -> xTB output
+        self.skip_counts = {}
+        self.converted = 0
+        self.duplicates = 0
+        # (composition, charge, multiplicity) -> [(GOAT input name, symbols, coords, fingerprint)]
+        self.structures = {}
+        if dedup_rmsd is not None:
+            for directory in (goat_dir, os.path.join(goat_dir, BUNDLED_DIR)):
+                if not os.path.isdir(directory):
+                    continue
+                for file in sorted(os.listdir(directory)):
+                    if file.endswith(".inp") and not file.startswith("bundle_"):
+                        try:
+                            self.add_structure(os.path.join(directory, file))
+                        except (OSError, ValueError) as e:
+                            logger.warning(f"Not used for deduplication: {file}: {e}")
+
+    def add_structure(self, goat_input):
+        """Record the structure of a GOAT input; returns its group key, symbols, coordinates and fingerprint"""
+        charge, multiplicity, symbols, coords = read_goat_structure(goat_input)
+        composition = "".join(f"{el}{n}" for el, n in sorted(Counter(symbols).items()))
+        key = (composition, charge, multiplicity)
+        structure = (os.path.basename(goat_input), symbols, coords, distance_fingerprint(coords))
+        self.structures.setdefault(key, []).append(structure)
+        return key, structure
+
+    def find_duplicate(self, key, structure):
+        """(name, RMSD) of the first earlier input within dedup_rmsd of the structure, None if there is none"""
+        name, symbols, coords, fingerprint = structure
+        for other, other_symbols, other_coords, other_fingerprint in self.structures[key]:
+            if other == name:
+                continue
+            # Same bound as cluster_structures: RMSD r allows a fingerprint RMS difference of at most 2 r
+            if fingerprint.size and np.sqrt(np.mean((other_fingerprint - fingerprint) ** 2)) > 2 * self.dedup_rmsd:
+                continue
+            rmsd = permutation_rmsd(other_symbols, other_coords, symbols, coords)
+            if rmsd <= self.dedup_rmsd:
+                return other, rmsd
+        return None
+
+    def __call__(self, result):
+        record = self.manifest.get(result['job_name']) if self.manifest is not None else None
+        name = goat_input_name(result['input_file'], record)
+        if self.written.get(name, result['output_file']) != result['output_file']:
+            log_sampled(logger, self.skip_counts, 'duplicate',
+                        f"Skipping {result['output_file']}: same GOAT input name as {self.written[name]}", sample=2)
+            return None
+        entry = convert_output(result['output_file'], self.goat_dir, True, record, self.node, result['input_file'])
+        if entry['status'] != 'converted':
+            log_sampled(logger, self.skip_counts, entry['status'],
+                        f"No GOAT input for {result['job_name']}: {entry.get('error', entry['status'])}", sample=2)
+            return entry
+        self.written[name] = result['output_file']
+        goat_job = os.path.splitext(name)[0]
+        if self.dedup_rmsd is not None:
+            key, structure = self.add_structure(entry['goat_input'])
+            match = self.find_duplicate(key, structure)
+            if match is not None:
+                self.structures[key].remove(structure)
+                duplicates_dir = os.path.join(self.goat_dir, DUPLICATES_DIR)
+                os.makedirs(duplicates_dir, exist_ok=True)
+                target = os.path.join(duplicates_dir, name)
+                os.replace(entry['goat_input'], target)
+                rep_name, rmsd = match
+                entry.update(status='duplicate_structure', goat_input=target,
+                             representative=os.path.splitext(rep_name)[0], rmsd=round(rmsd, 4))
+                self.duplicates += 1
+                if record is not None:
+                    self.manifest.derive(record, goat_job, 'goat', path=target, status='duplicate_structure')
+                log_sampled(logger, self.skip_counts, 'duplicate_structure',
+                            f"{name} duplicates {rep_name} (RMSD {rmsd:.3f} A), moved to {duplicates_dir}", sample=2)
+                return entry
+        self.converted += 1
+        if record is not None:
+            self.manifest.derive(record, goat_job, 'goat', path=entry['goat_input'])
+        log_event(events, 'goat_input_created', source=result['output_file'], goat_input=entry['goat_input'])
+        return entry
+
+    def summary(self):
+        skipped = ", ".join(f"{count} {status}" for status, count in sorted(self.skip_counts.items()))
+        return f"GOAT hand-off: {self.converted} inputs written to {self.goat_dir}" + (f" ({skipped} skipped)" if skipped else "")
+
+def goat_input_name(out_path, record=None):
+    """Deterministic GOAT input name: <geometry prefix>_<job name>.inp"""
+    base_name = os.path.basename(os.path.splitext(strip_compression_suffix(out_path))[0])
+    geom_type = record['geometry_abbr'] if record else extract_geometry_type(out_path)
+    return f"{geom_type}_{base_name}.inp"
+
+def find_output_files(base_dir, geometries=None):
+    """
+    All xTB outputs below base_dir, per geometry subtree (the immediate subdirectories),
+    sorted so that the conversion order and the naming of duplicates are deterministic.
+    """
+    out_files = {}
+    for geometry in sorted(os.listdir(base_dir)):
+        geometry_dir = os.path.join(base_dir, geometry)
+        if not os.path.isdir(geometry_dir) or (geometries and geometry not in geometries):
+            continue
+        files = []
+        for root, _, names in os.walk(geometry_dir):
+            for file in names:
+                if has_extension(file, '.out'):
+                    files.append(os.path.join(root, file))
+        out_files[geometry] = sorted(files)
+    return out_files
+
+def xyz_energy(out_path):
+    """xTB energy from the title line of the optimized structure ('... E -40.123'), inf if there is none"""
+    xyz_path = find_xyz_for_output(out_path)
+    if xyz_path:
+        match = re.search(r'\bE\s+(-?\d+\.\d+)', read_xyz_file(xyz_path)[1])
+        if match:
+            return float(match.group(1))
+    return float('inf')
+
+def deduplicate_structures(results, goat_output_dir, threshold=DEDUP_RMSD, map_file=None):
+    """
+    Keep one GOAT input per distinct xTB minimum. The GOAT inputs of the results ('converted' and
+    'up_to_date') are grouped by composition, charge and multiplicity and clustered by RMSD
+    (KabschRMSD.cluster_structures, equivalent atoms may be permuted); the structure with the lowest
+    xTB energy represents its cluster. The other inputs are moved to the duplicates/ subdirectory
+    and their entries get the status 'duplicate_structure'. A representative found in duplicates/
+    from an earlier run is moved back.
+    The clusters with more than one member are written to map_file (default: dedup_map.json in the GOAT directory).
+    Returns the number of duplicate structures.
+    """
+    duplicates_dir = os.path.join(goat_output_dir, DUPLICATES_DIR)
+    groups = {}
+    for entry in results:
+        if entry['status'] not in ('converted', 'up_to_date'):
+            continue
+        charge, multiplicity, symbols, coords = read_goat_structure(entry['goat_input'])
+        composition = "".join(f"{el}{n}" for el, n in sorted(Counter(symbols).items()))
+        groups.setdefault((composition, charge, multiplicity), []).append((entry, symbols, coords))
+
+    def place(entry, directory):
+        target = os.path.join(directory, os.path.basename(entry['goat_input']))
+        if target != entry['goat_input']:
+            os.makedirs(directory, exist_ok=True)
+            os.replace(entry['goat_input'], target)
+            entry['goat_input'] = target
+
+    clusters = {}
+    removed = 0
+    for (composition, charge, multiplicity), members in groups.items():
+        if len(members) == 1:
+            place(members[0][0], goat_output_dir)
+            continue
+        energies = [xyz_energy(entry['out_path']) for entry, _, _ in members]
+        order = sorted(range(len(members)), key=lambda k: (energies[k], os.path.basename(members[k][0]['goat_input'])))
+        assignment = cluster_structures([m[1] for m in members], [m[2] for m in members], threshold, order)
+        for k in order:
+            entry = members[k][0]
+            rep, rmsd = assignment[k]
+            if rep == k:
+                place(entry, goat_output_dir)
+                continue
+            rep_name = os.path.splitext(os.path.basename(members[rep][0]['goat_input']))[0]
+            place(entry, duplicates_dir)
+            entry.update(status='duplicate_structure', representative=rep_name, rmsd=round(rmsd, 4))
+            removed += 1
+            cluster = clusters.setdefault(rep_name, {
+                'composition': composition, 'charge': charge, 'multiplicity': multiplicity,
+                'members': [{'goat_job': rep_name, 'source': members[rep][0]['out_path'],
+                             'energy': energies[rep], 'rmsd': 0.0}]})
+            cluster['members'].append({'goat_job': os.path.splitext(os.path.basename(entry['goat_input']))[0],
+                                       'source': entry['out_path'], 'energy': energies[k], 'rmsd': round(rmsd, 4)})
+
+    map_file = map_file or os.path.join(goat_output_dir, "dedup_map.json")
+    with open(map_file, 'w') as f:
+        json.dump({'rmsd_threshold': threshold, 'duplicates': removed, 'clusters': clusters}, f, indent=2)
+    return removed
+
+def write_report(report_file, report):
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+def process_directory(base_dir, goat_dir="<GOAT_Input>", test_mode=False, limit=5, results_db=None,
+                      geometries=None, max_workers=None, report_file=None, index_file=None, manifest_path=None,
+                      node=DEFAULT_NODE, plan_file=None, dedup_rmsd=DEDUP_RMSD, dedup_file=None,
+                      bundle_jobs=None, bundle_max_atoms=BUNDLE_MAX_ATOMS):  # Path to output containing the GOAT input files
+    """
+    Process the XTB calculations of all geometry subdirectories of base_dir in a process pool.
+    Returns (number of GOAT inputs written or up to date, number of failed/skipped outputs).
+    geometries: restrict to these subdirectory names (default: all)
+    If results_db (the OrcaFlotte results table) is given, the completion status of the
+    recorded jobs is taken from it and only unrecorded outputs are read.
+    The completion index (index_file, default: completion_index.db in base_dir; False disables it)
+    caches the status of every checked output; unchanged successful outputs whose GOAT input
+    already exists are skipped as 'up_to_date'.
+    With a job manifest (manifest_path), charge, multiplicity and geometry come from the records
+    of the xTB jobs, and a 'goat' record is added for every GOAT input.
+    Cores and memory of every GOAT input are chosen for node (NodeSpec, None: fixed 8 cores / 3000 MB),
+    and a packing plan of all GOAT inputs onto such nodes is written to plan_file
+    (default: packing_plan.json in the GOAT directory).
+    Structures that relaxed to the same xTB minimum (RMSD <= dedup_rmsd, None disables this) keep only
+    one GOAT input, see deduplicate_structures; the mapping goes to dedup_file.
+    With bundle_jobs, GOAT inputs of up to bundle_max_atoms atoms are concatenated into ORCA multi-job
+    inputs of bundle_jobs calculations each (GoatBundles.py, which also splits the results).
+    A combined report (counts per geometry and all skipped files) is written to report_file
+    (default: conversion_report.json in the GOAT directory).
+    """
+    out_files = find_output_files(base_dir, geometries)
+    if not out_files:
+        logger.error(f"No geometry subdirectories found in {base_dir}.")
         return 0, 0
 
     # Create GOAT output directory if it doesn't exist
     goat_output_dir = goat_dir
     os.makedirs(goat_output_dir, exist_ok=True)
 
-    # Find all .out files in the 'Linear' subdirectory
-    out_files = []
-    for root, _, files in os.walk(linear_dir):
-        for file in files:
-            if file.endswith('.out'):
-                out_files.append(os.path.join(root, file))
-
-    logger.info(f"Found {len(out_files)} output files to check in 'Linear'.")
+    logger.info("Found output files to check: " +
+                ", ".join(f"{len(files)} in '{geometry}'" for geometry, files in out_files.items()))
     logger.info(f"GOAT input files will be saved to: {goat_output_dir}")
 
-    if test_mode:
-        logger.info(f"*** TEST MODE: Will only process up to {limit} successful files ***")
+    known_status = {}
+    if results_db:
+        table = ResultsTable(results_db)
+        known_status = table.completion_status()
+        table.close()
+        logger.info(f"Loaded completion status of {len(known_status)} jobs from {results_db}")
 
-    successful = 0
-    failed = 0
+    index = None
+    if index_file is not False:
+        index = CompletionIndex(index_file or os.path.join(base_dir, "completion_index.db"))
+        logger.info(f"Completion index {index.db_path}: {len(index)} outputs known")
 
-    # Process each output file
-    for out_path in out_files:
-        try:
-            # Check if we've reached the limit in test mode
-            if test_mode and successful >= limit:
-                logger.info(f"Test mode: Reached limit of {limit} files. Stopping.")
-                break
+    manifest = None
+    records = {}
+    if manifest_path:
+        manifest = Manifest(manifest_path)
+        records = manifest.records('complex')
+        logger.info(f"Loaded {len(records)} job records from manifest {manifest_path}")
 
-            # Check if the calculation was successful
-            was_successful = check_successful_calculation(out_path)
-            if not was_successful:
-                logger.debug(f"Skipping non-successful calculation: {out_path}")
-                failed += 1
+    # Two outputs with the same job name would write the same GOAT input: the first one (sorted order) wins
+    jobs = []
+    duplicates = []
+    up_to_date = []
+    stats = {}
+    seen = {}
+    for geometry, files in out_files.items():
+        for out_path in files:
+            job_name = os.path.splitext(os.path.basename(strip_compression_suffix(out_path)))[0]
+            record = records.get(job_name)
+            name = goat_input_name(out_path, record)
+            if name in seen:
+                duplicates.append({'out_path': out_path, 'geometry': name.split("_")[0],
+                                   'status': 'duplicate', 'duplicate_of': seen[name]})
                 continue
-
-            # Find the corresponding XYZ file
-            xyz_path = find_xyz_for_output(out_path)
-            if not xyz_path:
-                logger.warning(f"No XYZ file found for successful calculation: {out_path}")
-                failed += 1
+            seen[name] = out_path
+            # A GOAT input rewritten for a restart (GoatRestart.py) keeps the structure it continues from
+            restarted = [os.path.join(goat_output_dir, aside, name) for aside in ("", BUNDLED_DIR)
+                         if os.path.exists(os.path.join(goat_output_dir, aside, name) + ORIGINAL_SUFFIX)]
+            if restarted:
+                up_to_date.append({'out_path': out_path, 'geometry': name.split("_")[0],
+                                   'status': 'up_to_date', 'goat_input': restarted[0], 'folder': geometry})
                 continue
+            known = known_status.get(job_name)
+            if index is not None:
+                stat = os.stat(out_path)
+                stats[out_path] = stat
+                if known is None:
+                    known = index.lookup(out_path, stat)
+                # Unchanged since the last run and already converted (possibly set aside as a duplicate or bundled)
+                goat_path = os.path.join(goat_output_dir, name)
+                for aside, active in ((DUPLICATES_DIR, dedup_rmsd), (BUNDLED_DIR, bundle_jobs)):
+                    if active and not os.path.exists(goat_path) \
+                            and os.path.exists(os.path.join(goat_output_dir, aside, name)):
+                        goat_path = os.path.join(goat_output_dir, aside, name)
+                if known and index.lookup(out_path, stat) and os.path.exists(goat_path) \
+                        and os.path.getmtime(goat_path) >= stat.st_mtime:
+                    up_to_date.append({'out_path': out_path, 'geometry': name.split("_")[0],
+                                       'status': 'up_to_date', 'goat_input': goat_path, 'folder': geometry})
+                    continue
+            jobs.append((geometry, out_path, known, record))
 
-            # Get original input file path
-            input_path = os.path.splitext(out_path)[0] + ".inp"
+    start = time.time()
+    results = []
+    if test_mode:
+        # Sequential, so that exactly `limit` files are converted
+        logger.info(f"*** TEST MODE: Will only process up to {limit} successful files ***")
+        for geometry, out_path, known, record in jobs:
+            if sum(r['status'] == 'converted' for r in results) >= limit:
+                logger.info(f"Test mode: Reached limit of {limit} files. Stopping.")
+                break
+            results.append(dict(convert_output(out_path, goat_output_dir, known, record, node), folder=geometry))
+    else:
+        max_workers = max_workers or max(1, multiprocessing.cpu_count() - 1)
+        chunksize = max(1, min(256, len(jobs) // (max_workers * 4)))
+        with ProcessPoolExecutor(max_workers=max_workers, **worker_logging()) as executor:
+            converted = executor.map(convert_output, [j[1] for j in jobs], repeat(goat_output_dir),
+                                     [j[2] for j in jobs], [j[3] for j in jobs], repeat(node), chunksize=chunksize)
+            for (geometry, _, _, _), entry in zip(jobs, converted):
+                results.append(dict(entry, folder=geometry))
+    for entry in duplicates:
+        results.append(entry)
+    elapsed = time.time() - start
+
+    if index is not None:
+        checked = 0
+        for entry in results:
+            if 'checked' in entry:
+                index.update(entry['out_path'], stats[entry['out_path']], entry.pop('checked'))
+                checked += 1
+        index.close()
+        logger.info(f"Checked {checked} new or changed outputs, {len(up_to_date)} unchanged and already converted")
+    results.extend(up_to_date)
 
-            # Extract geometry type and base filename
-            geom_type = extract_geometry_type(xyz_path)
-            base_name = os.path.basename(os.path.splitext(xyz_path)[0])
+    if dedup_rmsd:
+        start_dedup = time.time()
+        removed = deduplicate_structures(results, goat_output_dir, dedup_rmsd, dedup_file)
+        logger.info(f"Deduplication: {removed} GOAT inputs of duplicate structures set aside in "
+                    f"{os.path.join(goat_output_dir, DUPLICATES_DIR)} ({time.time() - start_dedup:.1f} s)")
 
-            # Create new filename with geometry prefix
-            new_filename = f"{geom_type}_{base_name}.inp"
-            new_path = os.path.join(goat_output_dir, new_filename)
+    bundle_map = {}
+    if bundle_jobs:
+        small = [r for r in results if r['status'] in ('converted', 'up_to_date')
+                 and len(read_goat_structure(r['goat_input'])[2]) <= bundle_max_atoms]
+        bundle_map = write_bundles([r['goat_input'] for r in small], goat_output_dir, bundle_jobs)
+    elif os.path.exists(os.path.join(goat_output_dir, BUNDLE_MAP)):
+        # Bundles of an earlier run would run the jobs a second time (their members are written anew above);
+        # write_bundles keeps only those that have already run
+        bundle_map = write_bundles([], goat_output_dir)
+        members = {f"{job}.inp{suffix}" for jobs in bundle_map.values() for job in jobs for suffix in ("", ORIGINAL_SUFFIX)}
+        bundled_dir = os.path.join(goat_output_dir, BUNDLED_DIR)
+        for file in os.listdir(bundled_dir) if os.path.isdir(bundled_dir) else []:
+            if file not in members:
+                os.remove(os.path.join(bundled_dir, file))
+    # write_bundles moves the members to bundled/ and the inputs left out of a bundle back
+    bundle_of = {job: name for name, jobs in bundle_map.items() for job in jobs}
+    for entry in results:
+        if entry['status'] not in ('converted', 'up_to_date'):
+            continue
+        job = os.path.splitext(os.path.basename(entry['goat_input']))[0]
+        if job in bundle_of:
+            entry['goat_input'] = os.path.join(goat_output_dir, BUNDLED_DIR, os.path.basename(entry['goat_input']))
+            entry['bundle'] = bundle_of[job]
+        elif not os.path.exists(entry['goat_input']):
+            entry['goat_input'] = os.path.join(goat_output_dir, os.path.basename(entry['goat_input']))
+    if bundle_map:
+        logger.info(f"{len(bundle_of)} small GOAT inputs in {len(bundle_map)} multi-job inputs "
+                    f"({os.path.join(goat_output_dir, BUNDLE_MAP)})" + ("" if bundle_jobs else ", kept as they have already run"))
 
-            # Create GOAT input content
-            goat_content = create_goat_input(xyz_path, input_path)
-            if goat_content is None:
-                logger.warning(f"Skipping file due to missing charge or multiplicity: {xyz_path}")
-                failed += 1
+    # Carry the manifest forward: one 'goat' record per GOAT input, derived from the xTB job.
+    # Inputs set aside as duplicates keep a record with the status 'duplicate_structure', so a
+    # record of an earlier run does not count them as GOAT jobs any more
+    if manifest is not None:
+        derived = 0
+        set_aside = 0
+        for entry in results:
+            if entry['status'] not in ('converted', 'up_to_date', 'duplicate_structure'):
                 continue
+            xtb_job = os.path.splitext(os.path.basename(strip_compression_suffix(entry['out_path'])))[0]
+            if xtb_job in records:
+                goat_job = os.path.splitext(os.path.basename(entry['goat_input']))[0]
+                if entry['status'] == 'duplicate_structure':
+                    manifest.derive(records[xtb_job], goat_job, 'goat', path=entry['goat_input'],
+                                    status='duplicate_structure')
+                    set_aside += 1
+                else:
+                    manifest.derive(records[xtb_job], goat_job, 'goat', path=entry['goat_input'])
+                    derived += 1
+        manifest.close()
+        logger.info(f"Added {derived} GOAT records to the manifest"
+                    + (f", marked {set_aside} as duplicate structures" if set_aside else ""))
 
-            # Write to new file
-            with open(new_path, 'w') as f:
-                f.write(goat_content)
+    # Combined report
+    per_geometry = {}
+    for entry in results:
+        counts = per_geometry.setdefault(entry.get('folder', entry['geometry']), Counter())
+        counts[entry['status']] += 1
+    # Individual skips are in the report, only a sample of each kind is logged
+    skip_counts = {}
+    for entry in results:
+        if entry['status'] == 'converted':
+            logger.debug(f"Created GOAT input file: {entry['goat_input']}")
+            log_event(events, 'goat_input_created', source=entry['out_path'], goat_input=entry['goat_input'])
+        elif entry['status'] == 'no_xyz':
+            log_sampled(logger, skip_counts, 'no_xyz', f"No XYZ file found for successful calculation: {entry['out_path']}", sample=2)
+        elif entry['status'] == 'missing_charge':
+            log_sampled(logger, skip_counts, 'missing_charge',
+                        f"Skipping file due to missing charge or multiplicity: {entry['out_path']}", sample=2)
+        elif entry['status'] == 'duplicate':
+            log_sampled(logger, skip_counts, 'duplicate',
+                        f"Skipping {entry['out_path']}: same GOAT input name as {entry['duplicate_of']}", sample=2)
+        elif entry['status'] == 'error':
+            log_sampled(logger, skip_counts, 'error', f"Error processing {entry['out_path']}: {entry['error']}", sample=2)
+    # One record for all geometries (the console log is rate-limited)
+    summary = []
+    for geometry, counts in per_geometry.items():
+        skipped = sum(counts.values()) - counts['converted'] - counts['not_successful'] - counts['up_to_date'] \
+            - counts['duplicate_structure']
+        summary.append(f"  {geometry}: {counts['converted']} converted, {counts['up_to_date']} up to date, "
+                       f"{counts['duplicate_structure']} duplicate structures, "
+                       f"{counts['not_successful']} not successful, {skipped} skipped")
+    logger.info("Per geometry:\n" + "\n".join(summary))
 
-            logger.info(f"Created GOAT input file: {new_path}")
-            successful += 1
+    successful = sum(r['status'] == 'converted' for r in results)
+    n_up_to_date = sum(r['status'] == 'up_to_date' for r in results)
+    deduplicated = sum(r['status'] == 'duplicate_structure' for r in results)
+    failed = len(results) - successful - n_up_to_date - deduplicated
+    report = {
+        'base_dir': base_dir,
+        'goat_dir': goat_output_dir,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'seconds': round(elapsed, 2),
+        'converted': successful,
+        'up_to_date': n_up_to_date,
+        'duplicate_structures': deduplicated,
+        'failed': failed,
+        'per_geometry': {g: dict(c) for g, c in per_geometry.items()},
+        'skipped': [r for r in results if r['status'] not in ('converted', 'up_to_date', 'not_successful',
+                                                               'duplicate_structure')],
+    }
+    report_file = report_file or os.path.join(goat_output_dir, "conversion_report.json")
+    write_report(report_file, report)
+    logger.info(f"Report written to {report_file}")
 
-        except Exception as e:
-            logger.error(f"Error processing {out_path}: {str(e)}")
-            failed += 1
+    # Packing plan of all GOAT inputs (up-to-date inputs keep the resources they were written with)
+    plan_jobs = [(r['goat_input'], r.get('resources') or read_goat_resources(r['goat_input']))
+                 for r in results if r['status'] in ('converted', 'up_to_date') and 'bundle' not in r]
+    plan_jobs += [(path, read_goat_resources(path)) for path in
+                  (os.path.join(goat_output_dir, f"{name}.inp") for name in bundle_map)]
+    plan = packing_plan(plan_jobs, node or DEFAULT_NODE)
+    plan_file = plan_file or os.path.join(goat_output_dir, "packing_plan.json")
+    write_packing_plan(plan_file, plan)
+    logger.info(f"Packing plan written to {plan_file}: {plan['jobs']} GOAT jobs on {plan['nodes_needed']} nodes "
+                f"({plan['mean_core_utilization'] * 100:.0f}% of the cores used)")
 
     # Log summary with test mode indication
     if test_mode:
         logger.info(f"TEST MODE: Conversion complete: {successful} files converted successfully (limited to {limit}), {failed} failed")
     else:
-        logger.info(f"Conversion complete: {successful} files converted successfully, {failed} failed")
+        logger.info(f"Conversion complete: {successful} files converted successfully, {n_up_to_date} up to date, "
+                    f"{deduplicated} duplicate structures, {failed} failed ({elapsed:.1f} s)")
 
-    return successful, failed
+    # Up-to-date inputs count as successful for the caller
+    return successful + n_up_to_date, failed
 
 def main():
     import argparse
 
+    # Configure logging (asynchronous, human-readable log and machine-readable event log)
+    setup_logging('goat_conversion.log', event_file='goat_events.jsonl')
+
     parser = argparse.ArgumentParser(description="Convert successful XTB calculations to GOAT inputs")
     parser.add_argument("--dir", "-d", default="<XTB>") # Path to the base directory containing the XTB calculations
     parser.add_argument("--goat-dir", "-g", default="<GOAT_Inputs>", 
                         help="Output directory for GOAT input files (default: GOAT_Inputs)")
     parser.add_argument("--test-mode", "-t", action="store_true", help="Enable test mode (process limited number of files)")
     parser.add_argument("--limit", "-l", type=int, default=5, help="Limit number of files to process in test mode (default: 5)")
+    parser.add_argument("--results-db", "-r", default=None,
+                        help="Results table written by OrcaFlotte (--results-db); avoids re-reading the outputs")
+    parser.add_argument("--geometry", nargs="+", default=None,
+                        help="Only convert these geometry subdirectories (default: all)")
+    parser.add_argument("--max-workers", "-w", type=int, default=None,
+                        help="Number of worker processes (default: CPU count - 1)")
+    parser.add_argument("--index", default=None,
+                        help="Completion index of checked outputs (default: completion_index.db in --dir)")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Check every output again and do not write a completion index")
+    parser.add_argument("--manifest", "-m", default=None,
+                        help="Job manifest written by StartUp.py (default: manifest.db in --dir or above)")
+    parser.add_argument("--node", default=None,
+                        help="Cluster node the GOAT jobs are sized for, 'cores,memory_GB' (default: 8,32)")
+    parser.add_argument("--fixed-resources", action="store_true",
+                        help="Write %%PAL NPROCS 8 / %%maxcore 3000 / NWORKERS 8 for every complex")
+    parser.add_argument("--plan", default=None,
+                        help="Packing plan of the GOAT jobs (default: packing_plan.json in the GOAT directory)")
+    parser.add_argument("--array-tasks", type=int, default=None,
+                        help="Also bundle all GOAT inputs into this many batch-scheduler array tasks (see GoatArrays.py)")
+    parser.add_argument("--array-dir", default=None, help="Directory of the job array (default: <goat-dir>/arrays)")
+    parser.add_argument("--scheduler", choices=sorted(SCHEDULER_TEMPLATES), default="slurm")
+    parser.add_argument("--orca-path", default="orca", help="ORCA executable used in the job array script")
+    parser.add_argument("--report", default=None,
+                        help="Combined conversion report (default: conversion_report.json in the GOAT directory)")
+    parser.add_argument("--dedup-rmsd", type=float, default=DEDUP_RMSD,
+                        help=f"RMSD (Angstrom) below which two optimized structures get one GOAT input (default: {DEDUP_RMSD})")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Write a GOAT input for every successful xTB job, even for identical structures")
+    parser.add_argument("--dedup-map", default=None,
+                        help="Representative -> members mapping (default: dedup_map.json in the GOAT directory)")
+    parser.add_argument("--bundle", type=int, default=None, metavar="JOBS",
+                        help=f"Concatenate small GOAT inputs into ORCA multi-job inputs of JOBS calculations "
+                             f"(e.g. {JOBS_PER_BUNDLE}; split the results with 'GoatBundles.py split')")
+    parser.add_argument("--bundle-max-atoms", type=int, default=BUNDLE_MAX_ATOMS,
+                        help=f"Largest complex that is bundled (default: {BUNDLE_MAX_ATOMS} atoms)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Write restart inputs for preempted GOAT runs in --goat-dir (continuing from their "
+                             "best structure) and put only unfinished jobs into the job array (see GoatRestart.py)")
+    parser.add_argument("--stale-hours", type=float, default=STALE_HOURS,
+                        help=f"With --restart: also restart partial runs without a resume marker whose output has not "
+                             f"changed for this long (default: {STALE_HOURS:g}, 0: never)")
+    parser.add_argument("--force-restart", action="store_true",
+                        help="With --restart: restart every partial run, also those that may still be running")
+    parser.add_argument("--watch", type=float, default=None, metavar="SECONDS",
+                        help="Keep polling --dir for new successful outputs every SECONDS while OrcaFlotte "
+                             "is still running (stop with Ctrl+C or --stop-file)")
+    parser.add_argument("--stop-file", default=None,
+                        help="In --watch mode, stop after the next pass once this file exists")
 
     args = parser.parse_args()
 
@@ -221,13 +774,54 @@ def main():
         logger.error(f"Directory not found: {base_dir}")
         return
 
+    if args.watch and args.no_index:
+        logger.warning("--watch without the completion index checks every output again in every pass")
+
     logger.info(f"Processing directory: {base_dir}")
-    successful, failed = process_directory(base_dir, args.goat_dir, args.test_mode, args.limit)
+    # In watch mode the completion index keeps every pass to the new or changed outputs
+    while True:
+        successful, failed = process_directory(base_dir, args.goat_dir, args.test_mode, args.limit, args.results_db,
+                                               args.geometry, args.max_workers, args.report,
+                                               False if args.no_index else args.index,
+                                               args.manifest or find_manifest(base_dir),
+                                               None if args.fixed_resources else (parse_node(args.node) if args.node else DEFAULT_NODE),
+                                               args.plan, None if args.no_dedup else args.dedup_rmsd, args.dedup_map,
+                                               args.bundle, args.bundle_max_atoms)
+        if not args.watch or (args.stop_file and os.path.exists(args.stop_file)):
+            break
+        try:
+            time.sleep(args.watch)
+        except KeyboardInterrupt:
+            logger.info("Watch stopped")
+            break
 
     if successful > 0:
         logger.info(f"Successfully converted {successful} files. GOAT input files are in the directory: {args.goat_dir}")
     else:
         logger.warning("No successful calculations were found or converted.")
 
+    if args.restart:
+        marker_dirs = array_dirs(args.goat_dir, [args.array_dir])
+        skipped = {}
+        restarted = prepare_restarts(args.goat_dir, marker_dirs, skipped, args.stale_hours, args.force_restart)
+        from_best = sum(info['source'] is not None for info in restarted.values())
+        logger.info(f"Prepared {len(restarted)} preempted or stale GOAT runs for restart ({from_best} from their best structure so far)"
+                    + (f", {len(skipped)} partial runs not restarted (still running or failed on their own)" if skipped else ""))
+
+    if args.array_tasks and successful > 0:
+        array_dir = args.array_dir or os.path.join(args.goat_dir, "arrays")
+        node = parse_node(args.node) if args.node else DEFAULT_NODE
+        if args.restart:
+            unfinished = unfinished_inputs(args.goat_dir, marker_dirs, args.stale_hours, args.force_restart)
+            jobs = [(path, read_goat_resources(path)) for path in unfinished]
+        else:
+            jobs = collect_goat_inputs(args.goat_dir)
+        if not jobs:
+            logger.info("All GOAT jobs are finished, no job array written")
+            return
+        index = write_arrays(jobs, array_dir, args.array_tasks, node, args.scheduler, args.orca_path)
+        logger.info(f"Job array with {index['tasks']} tasks written to {array_dir} "
+                    f"(submit with {'sbatch' if args.scheduler == 'slurm' else 'qsub'} submit_goat_array.sh)")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
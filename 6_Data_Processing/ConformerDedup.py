@@ -0,0 +1,172 @@
+import os
+import sys
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+# Compressed ensembles (.xyz.gz / .xyz.zst) are read via CompressedIO from the xTB folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from CompressedIO import has_extension, open_text, strip_compression_suffix
+
+# Batched Kabsch RMSD of the GOAT deduplication
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "5_GOAT_Calculations"))
+from KabschRMSD import kabsch_rmsd
+
+from EnsembleStore import EnsembleStore, ensemble_name, parse_ensemble
+
+# Deduplication of the conformers of a complex over all its multiplicities.
+#
+# The final ensembles of different spin states of one complex often hold nearly the same
+# geometries, which are then counted several times (e.g. in the comparison with the CSD).
+# All conformers of a complex with the same atom order are aligned pairwise (Kabsch, batched SVD),
+# clustered in order of increasing energy (a conformer joins the first lower-energy representative
+# within the RMSD threshold), and only the representatives are written, each into the file of its
+# own multiplicity with the size of its cluster in the comment line.
+
+DEFAULT_RMSD = 0.1      # Angstrom, as for the xTB structures before GOAT
+PAIR_BATCH = 20000      # pairs aligned per batch
+DEDUP_REPORT = "dedup_report.tsv"
+
+def pairwise_rmsd(coords, batch=PAIR_BATCH):
+    """Symmetric matrix of the aligned RMSDs of conformers (n, n_atoms, 3), atoms in the same order"""
+    n = len(coords)
+    matrix = np.zeros((n, n))
+    i, j = np.triu_indices(n, k=1)
+    for start in range(0, len(i), batch):
+        a, b = i[start:start + batch], j[start:start + batch]
+        matrix[a, b] = matrix[b, a] = kabsch_rmsd(coords[a], coords[b])
+    return matrix
+
+def cluster_by_energy(rmsd, energies, threshold):
+    """
+    Greedy clustering in order of increasing energy (conformers without energy last): every conformer
+    joins the first representative within threshold or becomes one. Returns the representative of every conformer.
+    """
+    order = np.lexsort((np.arange(len(energies)), np.nan_to_num(energies, nan=np.inf)))
+    representative = np.full(len(energies), -1)
+    for i in order:
+        if representative[i] >= 0:
+            continue
+        representative[i] = i
+        members = (representative < 0) & (rmsd[i] <= threshold)
+        representative[members] = i
+    return representative
+
+def deduplicate_complex(ensembles, threshold=DEFAULT_RMSD, batch=PAIR_BATCH):
+    """
+    ensembles: list of (multiplicity, symbols, coords (n, n_atoms, 3), energies) of one complex.
+    Conformers are compared within sets of the same atom order only.
+    Returns per ensemble the indices of the kept conformers and the sizes of their clusters.
+    """
+    sets = defaultdict(list)
+    for k, (_, symbols, _, _) in enumerate(ensembles):
+        sets[tuple(symbols)].append(k)
+
+    kept = [([], []) for _ in ensembles]
+    for members in sets.values():
+        coords = np.concatenate([ensembles[k][2] for k in members])
+        energies = np.concatenate([np.asarray(ensembles[k][3], dtype=float) for k in members])
+        owner = np.repeat(members, [len(ensembles[k][2]) for k in members])
+        local = np.concatenate([np.arange(len(ensembles[k][2])) for k in members])
+        representative = cluster_by_energy(pairwise_rmsd(coords, batch), energies, threshold)
+        sizes = np.bincount(representative, minlength=len(representative))
+        for r in np.nonzero(representative == np.arange(len(representative)))[0]:
+            kept[owner[r]][0].append(int(local[r]))
+            kept[owner[r]][1].append(int(sizes[r]))
+    return kept
+
+def write_conformers(src_lines, dst, indices, cluster_sizes):
+    """Write the conformers with the given indices of a multi-xyz file (as lines), cluster size in the comment line"""
+    frames = []
+    i = 0
+    while i + 1 < len(src_lines):
+        try:
+            n_atoms = int(src_lines[i].strip())
+        except ValueError:
+            break
+        frames.append((i, n_atoms))
+        i += n_atoms + 2
+    with open(dst, 'w') as f:
+        for index, size in sorted(zip(indices, cluster_sizes)):
+            start, n_atoms = frames[index]
+            f.write(src_lines[start])
+            f.write(f"{src_lines[start + 1].rstrip()}  cluster= {size}\n")
+            f.writelines(src_lines[start + 2:start + 2 + n_atoms])
+
+def group_files(root_dir):
+    """Ensemble files per complex (<complex>_Mult_<m>.xyz as written by Ordnen.py): {complex: [(mult, path)]}"""
+    groups = defaultdict(list)
+    for dirpath, _, filenames in os.walk(root_dir):
+        for filename in sorted(filenames):
+            if not has_extension(filename, ".xyz"):
+                continue
+            parts = ensemble_name(filename).rsplit("_Mult_", 1)
+            if len(parts) == 2 and parts[1].isdigit():
+                groups[parts[0]].append((int(parts[1]), os.path.join(dirpath, filename)))
+            else:
+                print(f"    -> WARNING: Filename does not match expected pattern: {filename}")
+    return groups
+
+def deduplicate_tree(root_dir, out_dir, threshold=DEFAULT_RMSD, store_path=None):
+    """
+    Deduplicate the conformers of every complex below root_dir and write the representatives to out_dir
+    (same subfolders). Ensembles unchanged in the store are taken from it instead of being parsed.
+    Writes out_dir/dedup_report.tsv and returns (conformers, representatives).
+    """
+    store = EnsembleStore(store_path) if store_path else None
+    report = []
+    total = kept_total = 0
+    for name, files in sorted(group_files(root_dir).items()):
+        ensembles = []
+        for mult, path in sorted(files):
+            if store is not None and store.lookup(path, os.stat(path)) is not None:
+                ensembles.append((mult,) + tuple(store.get(path)))
+            else:
+                try:
+                    ensembles.append((mult,) + parse_ensemble(path))
+                except ValueError as e:
+                    print(f"    -> WARNING: {e}")
+                    ensembles.append((mult, [], np.empty((0, 0, 3)), np.empty(0)))
+        kept = deduplicate_complex(ensembles, threshold)
+
+        n_conformers = sum(len(e[2]) for e in ensembles)
+        n_kept = sum(len(indices) for indices, _ in kept)
+        for (mult, path), (indices, sizes) in zip(sorted(files), kept):
+            if not indices:
+                continue
+            target_subfolder = os.path.join(out_dir, os.path.relpath(os.path.dirname(path), root_dir))
+            os.makedirs(target_subfolder, exist_ok=True)
+            with open_text(path) as f:
+                lines = f.readlines()  # the kept conformers are copied as text lines
+            write_conformers(lines, os.path.join(target_subfolder, strip_compression_suffix(os.path.basename(path))),
+                             indices, sizes)
+        report.append((name, len(files), n_conformers, n_kept))
+        total += n_conformers
+        kept_total += n_kept
+    if store is not None:
+        store.close()
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, DEDUP_REPORT), "w", encoding="utf-8") as f:
+        f.write(f"# RMSD threshold = {threshold} Angstrom\n")
+        f.write("complex\tmultiplicities\tconformers\tkept\tcompression\n")
+        for name, n_files, n_conformers, n_kept in report:
+            f.write(f"{name}\t{n_files}\t{n_conformers}\t{n_kept}\t{n_conformers / n_kept if n_kept else 0:.3f}\n")
+    ratio = total / kept_total if kept_total else 0.0
+    print(f"{len(report)} complexes: {total} conformers -> {kept_total} after deduplication "
+          f"(compression ratio {ratio:.2f}, RMSD {threshold} Angstrom)")
+    return total, kept_total
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove near-identical conformers of a complex over all multiplicities")
+    parser.add_argument("root_dir", help="Sorted ensembles (<complex>_Mult_<m>.xyz), e.g. <GOAT_Sorted_New>")
+    parser.add_argument("out_dir", help="Folder for the deduplicated ensembles and dedup_report.tsv")
+    parser.add_argument("--rmsd", type=float, default=DEFAULT_RMSD,
+                        help=f"Conformers within this aligned RMSD (Angstrom) are duplicates (default: {DEFAULT_RMSD})")
+    parser.add_argument("--store", default=None, help="Ensemble store (EnsembleStore.py pack) to take the coordinates from")
+    args = parser.parse_args()
+    deduplicate_tree(args.root_dir, args.out_dir, args.rmsd, args.store)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+import sys
+import sqlite3
+import argparse
+from collections import Counter
+
+# Compressed ensembles keep their compression suffix
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from CompressedIO import strip_compression_suffix
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "3_Complex_Generator"))
+from Manifest import Manifest
+
+from Ordnen import LINK_MODES, describe_ensemble, place_file, scan_parallel, sorted_name
+from SPIN_Cleanup_New import HARTREE_TO_KCAL, collect_energies
+
+# Catalog of the GOAT final ensembles (SQLite) instead of sorting by copying and moving files.
+#
+# One indexing pass over the GOAT output tree records every ensemble with geometry, metal,
+# oxidation state, grouped ligands (as named by Ordnen.py), multiplicity, number of conformers,
+# lowest/highest energy and path. Unchanged files (same size and mtime) are not read again.
+# The choice of the best multiplicity (what SPIN_Cleanup_New.py does by moving files) is a query
+# on the catalog, so it can be re-evaluated with other criteria without touching the ensembles.
+# Writing the familiar folders (<GOAT_Sorted_New>, <GOAT_Mult_Unguenstig>, <GOAT_Mult_Unsicher>)
+# is an optional last step.
+
+CATALOG_NAME = "ensemble_catalog.db"
+
+# Decisions of the selection
+BEST = "best"                  # lowest energy of its complex
+SINGLE = "single"              # only multiplicity of its complex
+UNFAVOURABLE = "unfavourable"  # another multiplicity is lower in energy
+UNCERTAIN = "uncertain"        # no energies, or the lowest multiplicities are closer than min_gap
+SUPERSEDED = "superseded"      # another ensemble of the same complex and multiplicity has the later path
+                               # (Ordnen.py lets the last one win as well); not compared, not written
+
+CATALOG_COLUMNS = [
+    ("path", "TEXT PRIMARY KEY"),
+    ("job_name", "TEXT"),          # GOAT job the ensemble belongs to
+    ("complex", "TEXT"),           # <abbr>_<metal>_<ox>_<grouped ligands>, shared by all multiplicities
+    ("geometry_abbr", "TEXT"),
+    ("metal", "TEXT"),
+    ("oxidation", "INTEGER"),
+    ("ligands", "TEXT"),           # grouped as in Ordnen.py, e.g. "(CO)2(NH3)4"
+    ("multiplicity", "INTEGER"),
+    ("conformers", "INTEGER"),     # conformers with an energy
+    ("e_min", "REAL"),             # Hartree, NULL without energies
+    ("e_max", "REAL"),
+    ("size", "INTEGER"),
+    ("mtime", "REAL"),
+]
+
+SELECTION_QUERY = """
+WITH latest AS (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY complex, multiplicity ORDER BY path DESC) AS copy
+    FROM ensembles
+), ranked AS (
+    SELECT path, complex, geometry_abbr, metal, oxidation, ligands, multiplicity, e_min,
+           COUNT(*) OVER grp AS members,
+           COUNT(e_min) OVER grp AS with_energy,
+           ROW_NUMBER() OVER ordered AS rank,
+           NTH_VALUE(e_min, 1) OVER whole AS e_best,
+           NTH_VALUE(e_min, 2) OVER whole AS e_second
+    FROM latest
+    WHERE copy = 1
+    WINDOW grp AS (PARTITION BY complex),
+           ordered AS (PARTITION BY complex ORDER BY e_min IS NULL, e_min, multiplicity),
+           whole AS (ordered ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+)
+SELECT path, complex, geometry_abbr, metal, oxidation, ligands, multiplicity, e_min,
+       (e_second - e_best) * ? AS gap,
+       CASE
+           WHEN members = 1 THEN 'single'
+           WHEN with_energy = 0 THEN 'uncertain'
+           WHEN (e_second - e_best) * ? < ? THEN 'uncertain'
+           WHEN rank = 1 THEN 'best'
+           ELSE 'unfavourable'
+       END AS decision
+FROM ranked
+UNION ALL
+SELECT path, complex, geometry_abbr, metal, oxidation, ligands, multiplicity, e_min, NULL, 'superseded'
+FROM latest
+WHERE copy > 1
+ORDER BY complex, multiplicity, path
+"""
+
+class EnsembleCatalog:
+    """SQLite table with one row per GOAT final ensemble, keyed by its path"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        columns = ", ".join(f"{name} {sql_type}" for name, sql_type in CATALOG_COLUMNS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS ensembles ({columns})")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ensembles_complex ON ensembles (complex)")
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM ensembles").fetchone()[0]
+
+    def stats(self):
+        """{path: (size, mtime)} of all rows"""
+        return {path: (size, mtime) for path, size, mtime in self.conn.execute("SELECT path, size, mtime FROM ensembles")}
+
+    def add(self, rows):
+        names = [name for name, _ in CATALOG_COLUMNS]
+        self.conn.executemany(f"INSERT OR REPLACE INTO ensembles ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})",
+                              [[row.get(name) for name in names] for row in rows])
+        self.conn.commit()
+
+    def remove(self, paths):
+        self.conn.executemany("DELETE FROM ensembles WHERE path = ?", [(path,) for path in paths])
+        self.conn.commit()
+
+    def select(self, min_gap=0.0):
+        """
+        Decision for every ensemble (see BEST ... UNCERTAIN): list of dicts with path, complex,
+        its naming fields, multiplicity, e_min, gap (kcal/mol between the two lowest ensembles
+        of the complex) and decision.
+        min_gap: complexes whose two lowest ensembles are closer than this (kcal/mol) are uncertain.
+        """
+        cursor = self.conn.execute(SELECTION_QUERY, (HARTREE_TO_KCAL, HARTREE_TO_KCAL, min_gap))
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def close(self):
+        self.conn.close()
+
+def catalog_row(path, energies, stat, record=None):
+    """Catalog row of one ensemble; metadata from the manifest record or the GOAT job name"""
+    filename = os.path.basename(path)
+    job_name = strip_compression_suffix(filename)[:-len(".finalensemble.xyz")]
+    abbr, metal, oxidation, ligands, mult = describe_ensemble(job_name, record)
+    return {
+        'path': path, 'job_name': job_name, 'complex': f"{abbr}_{metal}_{oxidation}_{ligands}",
+        'geometry_abbr': abbr, 'metal': metal, 'oxidation': int(oxidation), 'ligands': ligands,
+        'multiplicity': int(mult), 'conformers': len(energies),
+        'e_min': min(energies) if energies else None, 'e_max': max(energies) if energies else None,
+        'size': stat.st_size, 'mtime': stat.st_mtime,
+    }
+
+def index_tree(goat_root, catalog_path, manifest_path=None, workers=None):
+    """
+    Add the final ensembles below goat_root to the catalog in one pass: new or changed files are read
+    (energies in a process pool), unchanged ones are kept, rows of vanished files are removed.
+    Returns (indexed, unchanged, removed).
+    """
+    catalog = EnsembleCatalog(catalog_path)
+    records = {}
+    if manifest_path:
+        manifest = Manifest(manifest_path)
+        records = manifest.records("goat")
+        manifest.close()
+
+    known = catalog.stats()
+    found = [os.path.abspath(path) for path in scan_parallel(goat_root, workers)]
+    stats = {path: os.stat(path) for path in found}
+    changed = [path for path in found
+               if known.get(path) != (stats[path].st_size, stats[path].st_mtime)]
+
+    rows = []
+    skipped = 0
+    for path, energies in collect_energies(changed, None, workers).items():
+        job_name = strip_compression_suffix(os.path.basename(path))[:-len(".finalensemble.xyz")]
+        try:
+            rows.append(catalog_row(path, energies, stats[path], records.get(job_name)))
+        except (IndexError, ValueError):
+            print(f"    -> WARNING: Cannot derive complex and multiplicity of {path}")
+            skipped += 1
+    if skipped and not rows:
+        catalog.close()
+        raise ValueError(f"Cannot derive complex and multiplicity of any of the {skipped} changed ensembles "
+                         f"from their names; index with --manifest")
+    catalog.add(rows)
+
+    prefix = os.path.join(os.path.abspath(goat_root), "")
+    found_set = set(found)
+    vanished = [path for path in known if path.startswith(prefix) and path not in found_set]
+    catalog.remove(vanished)
+    print(f"{len(rows)} ensembles indexed, {len(found) - len(changed)} unchanged, {len(vanished)} removed"
+          + (f", {skipped} skipped" if skipped else "") + f" ({len(catalog)} in {catalog_path})")
+    catalog.close()
+    return len(rows), len(found) - len(changed), len(vanished)
+
+def materialize(catalog_path, sorted_dir, unfavourable_dir, uncertain_dir, min_gap=0.0, mode="copy"):
+    """
+    Write the selection as folders like Ordnen.py and SPIN_Cleanup_New.py did: best and single
+    ensembles to sorted_dir, the others to unfavourable_dir / uncertain_dir, each as
+    <name>_Mult_<m>/<name>_Mult_<m>.xyz (superseded ensembles are left out). A file placed in another
+    of the folders by an earlier selection is removed there.
+    """
+    catalog = EnsembleCatalog(catalog_path)
+    selection = catalog.select(min_gap)
+    catalog.close()
+
+    folders = {BEST: sorted_dir, SINGLE: sorted_dir, UNFAVOURABLE: unfavourable_dir, UNCERTAIN: uncertain_dir}
+    used = Counter()
+    for entry in selection:
+        basename = sorted_name(entry['geometry_abbr'], entry['metal'], entry['oxidation'], entry['ligands'],
+                               entry['multiplicity'])
+        filename = os.path.basename(entry['path'])
+        new_name = basename + ".xyz" + filename[len(strip_compression_suffix(filename)):]
+        if entry['decision'] == SUPERSEDED:
+            continue
+        for folder in dict.fromkeys(folders.values()):
+            target = os.path.join(folder, basename, new_name)
+            if folder == folders[entry['decision']]:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                used[place_file(entry['path'], target, mode)] += 1
+            elif os.path.lexists(target):
+                os.remove(target)
+    print(f"{sum(used.values())} ensembles placed ({dict(used)})")
+    return used
+
+def print_summary(selection, min_gap, list_decision=None):
+    counts = Counter(entry['decision'] for entry in selection)
+    complexes = len({entry['complex'] for entry in selection})
+    print(f"{len(selection)} ensembles of {complexes} complexes (min gap {min_gap} kcal/mol)")
+    for decision in (BEST, SINGLE, UNFAVOURABLE, UNCERTAIN, SUPERSEDED):
+        print(f"  {decision}: {counts.get(decision, 0)}")
+    if list_decision:
+        for entry in selection:
+            if entry['decision'] == list_decision:
+                gap = f", gap {entry['gap']:.2f} kcal/mol" if entry['gap'] is not None else ""
+                print(f"  {entry['complex']} Mult {entry['multiplicity']}: {entry['path']}{gap}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog of GOAT final ensembles and selection of the best multiplicity")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    index = sub.add_parser("index", help="Add the final ensembles of a GOAT output tree to the catalog")
+    index.add_argument("goat_root")
+    index.add_argument("--catalog", default=None, help=f"Catalog file (default: {CATALOG_NAME} in goat_root)")
+    index.add_argument("--manifest", default=None, help="Job manifest of StartUp.py (otherwise names are parsed)")
+    index.add_argument("--workers", type=int, default=None, help="Processes reading the energies")
+
+    select = sub.add_parser("select", help="Choose the best multiplicity of every complex (no file access)")
+    select.add_argument("catalog")
+    select.add_argument("--min-gap", type=float, default=0.0,
+                        help="Complexes whose two lowest multiplicities are closer (kcal/mol) are uncertain")
+    select.add_argument("--list", choices=(BEST, SINGLE, UNFAVOURABLE, UNCERTAIN, SUPERSEDED), default=None,
+                        help="List the ensembles with this decision")
+
+    write = sub.add_parser("materialize", help="Write the selection as sorted / unfavourable / uncertain folders")
+    write.add_argument("catalog")
+    write.add_argument("sorted_dir")
+    write.add_argument("unfavourable_dir")
+    write.add_argument("uncertain_dir")
+    write.add_argument("--min-gap", type=float, default=0.0)
+    write.add_argument("--mode", choices=LINK_MODES, default="copy")
+
+    args = parser.parse_args()
+    if args.command == "index":
+        index_tree(args.goat_root, args.catalog or os.path.join(args.goat_root, CATALOG_NAME), args.manifest, args.workers)
+    elif args.command == "select":
+        catalog = EnsembleCatalog(args.catalog)
+        print_summary(catalog.select(args.min_gap), args.min_gap, args.list)
+        catalog.close()
+    else:
+        materialize(args.catalog, args.sorted_dir, args.unfavourable_dir, args.uncertain_dir, args.min_gap, args.mode)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+
+# Compressed ensembles (.xyz.gz / .xyz.zst) are read via CompressedIO from the xTB folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from CompressedIO import has_extension, open_text, strip_compression_suffix
+
+# Binary store of GOAT ensembles, so that analysis passes do not parse thousands of .xyz files again.
+#
+# A store is a directory of flat arrays that only grow at the end:
+#   coords.f32     coordinates of all conformers of all ensembles (float32, x y z per atom)
+#   energies.f64   energy of every conformer (float64: Hartree energies need more than float32 digits)
+#   elements.u1    element of every atom of an ensemble, as index into symbols.txt
+#   index.bin      one INDEX_DTYPE record per ensemble: offsets into the arrays above and sizes
+#   names.txt      name, source file, size and mtime per ensemble, line i belongs to record i
+#   symbols.txt    element symbols, one per line
+# The arrays are memory-mapped, so an ensemble is a view into them (no parsing, no copy).
+# Appending writes the arrays first and the index record and name last; an interrupted append
+# leaves data behind the last record, which the next append overwrites.
+# Records are keyed by the absolute path of their source file, so ensembles of the same name in
+# different folders are kept apart. A changed file is appended again and its later record wins;
+# "compact" drops the old ones.
+
+COORDS_FILE = "coords.f32"
+ENERGIES_FILE = "energies.f64"
+ELEMENTS_FILE = "elements.u1"
+INDEX_FILE = "index.bin"
+NAMES_FILE = "names.txt"
+SYMBOLS_FILE = "symbols.txt"
+
+INDEX_DTYPE = np.dtype([('coord_offset', '<i8'), ('energy_offset', '<i8'), ('element_offset', '<i8'),
+                        ('n_conformers', '<i4'), ('n_atoms', '<i4')])
+
+def ensemble_name(filename):
+    """Name of an ensemble file without directory, compression suffix and .finalensemble.xyz / .xyz"""
+    name = strip_compression_suffix(os.path.basename(filename))
+    for extension in (".finalensemble.xyz", ".xyz"):
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+def parse_ensemble(filepath):
+    """
+    Symbols, coordinates (n_conformers, n_atoms, 3) and energies (NaN if a comment line has none)
+    of a multi-xyz file. All conformers must have the same atoms.
+    """
+    with open_text(filepath) as f:
+        lines = f.read().splitlines()
+    symbols = None
+    coords = []
+    energies = []
+    i = 0
+    while i + 1 < len(lines):
+        try:
+            n_atoms = int(lines[i].strip())
+        except ValueError:
+            break
+        block = [line.split() for line in lines[i + 2:i + 2 + n_atoms]]
+        if len(block) < n_atoms:
+            break  # truncated last conformer
+        frame_symbols = [parts[0] for parts in block]
+        if symbols is None:
+            symbols = frame_symbols
+        elif frame_symbols != symbols:
+            raise ValueError(f"{filepath}: conformers with different atoms")
+        coords.append([parts[1:4] for parts in block])  # converted by numpy at the end
+        try:
+            energies.append(float(lines[i + 1].split()[0]))
+        except (ValueError, IndexError):
+            energies.append(np.nan)
+        i += n_atoms + 2
+    if symbols is None:
+        raise ValueError(f"{filepath}: no conformers")
+    return symbols, np.array(coords, dtype=float).reshape(len(coords), len(symbols), 3), np.array(energies)
+
+class EnsembleStore:
+    """
+    Directory store of ensembles (see module comment). mode 'r' reads, 'a' also appends.
+    get(key) returns (symbols, coords view (n_conformers, n_atoms, 3) float32, energies view); the key is
+    the source file of the ensemble, or its name if only one source file has that name.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        if mode == 'a':
+            os.makedirs(path, exist_ok=True)
+        elif not os.path.isfile(os.path.join(path, INDEX_FILE)):
+            raise FileNotFoundError(f"No ensemble store in {path}")
+        self.symbols = self._read_lines(SYMBOLS_FILE)
+        names = [line.split("\t") for line in self._read_lines(NAMES_FILE)]
+        index = self._map(INDEX_FILE, INDEX_DTYPE)
+        count = min(len(names), len(index))  # an interrupted append may have written one of them only
+        self.index = np.array(index[:count])
+        self.entries = [(name, source, int(size), float(mtime)) for name, source, size, mtime in names[:count]]
+        self.sources = {entry[1]: i for i, entry in enumerate(self.entries)}  # later records win
+        self.names = {}  # name -> current records of the source files with that name
+        for i in self.sources.values():
+            self.names.setdefault(self.entries[i][0], []).append(i)
+        self._arrays = {}
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_lines(self, name):
+        if not os.path.exists(self._file(name)):
+            return []
+        with open(self._file(name)) as f:
+            return [line.rstrip("\n") for line in f if line.strip()]
+
+    def _map(self, name, dtype):
+        """Read-only memory map of a flat array file (empty array for a missing or empty file)"""
+        path = self._file(name)
+        if not os.path.exists(path) or os.path.getsize(path) < np.dtype(dtype).itemsize:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(os.path.getsize(path) // np.dtype(dtype).itemsize,))
+
+    def _array(self, name, dtype):
+        if name not in self._arrays:
+            self._arrays[name] = self._map(name, dtype)
+        return self._arrays[name]
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __contains__(self, key):
+        try:
+            self.position(key)
+        except KeyError:
+            return False
+        return True
+
+    def position(self, key):
+        """Index of the current record of an ensemble given by its source file or its unambiguous name"""
+        i = self.sources.get(os.path.abspath(key))
+        if i is not None:
+            return i
+        matches = self.names.get(key, [])
+        if len(matches) > 1:
+            raise KeyError(f"{key}: packed from {len(matches)} files, give the source file")
+        if not matches:
+            raise KeyError(key)
+        return matches[0]
+
+    def record(self, key):
+        return self.index[self.position(key)]
+
+    def get(self, key):
+        """Symbols, coordinates and energies of an ensemble (KeyError if it is not in the store)"""
+        rec = self.record(key)
+        n_conformers, n_atoms = int(rec['n_conformers']), int(rec['n_atoms'])
+        coords = self._array(COORDS_FILE, np.float32)[rec['coord_offset']:rec['coord_offset'] + n_conformers * n_atoms * 3]
+        energies = self._array(ENERGIES_FILE, np.float64)[rec['energy_offset']:rec['energy_offset'] + n_conformers]
+        elements = self._array(ELEMENTS_FILE, np.uint8)[rec['element_offset']:rec['element_offset'] + n_atoms]
+        return [self.symbols[e] for e in elements], coords.reshape(n_conformers, n_atoms, 3), energies
+
+    def energies(self, key):
+        rec = self.record(key)
+        return self._array(ENERGIES_FILE, np.float64)[rec['energy_offset']:rec['energy_offset'] + rec['n_conformers']]
+
+    def lookup(self, path, stat):
+        """Index of the record of the file path if it was packed with this size and mtime, else None"""
+        i = self.sources.get(os.path.abspath(path))
+        if i is not None and self.entries[i][2] == stat.st_size and self.entries[i][3] == stat.st_mtime:
+            return i
+        return None
+
+    def _ends(self):
+        """Offsets behind the last record"""
+        if not len(self.index):
+            return 0, 0, 0
+        last = self.index[-1]
+        return (int(last['coord_offset'] + last['n_conformers'] * last['n_atoms'] * 3),
+                int(last['energy_offset'] + last['n_conformers']), int(last['element_offset'] + last['n_atoms']))
+
+    def append(self, entries):
+        """
+        Append ensembles: entries of (name, source file, size, mtime, symbols, coords, energies).
+        Returns the number of ensembles added.
+        """
+        if self.mode != 'a':
+            raise ValueError("Store opened read-only")
+        entries = list(entries)
+        if not entries:
+            return 0
+        coord_end, energy_end, element_end = self._ends()
+        symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        records = np.zeros(len(entries), dtype=INDEX_DTYPE)
+        with open(self._file(COORDS_FILE), 'ab') as fc, open(self._file(ENERGIES_FILE), 'ab') as fe, \
+                open(self._file(ELEMENTS_FILE), 'ab') as fx:
+            # Data of an interrupted append behind the last record is overwritten
+            fc.truncate(coord_end * 4)
+            fe.truncate(energy_end * 8)
+            fx.truncate(element_end)
+            for k, (*_, symbols, coords, energies) in enumerate(entries):
+                for symbol in symbols:
+                    if symbol not in symbol_ids:
+                        symbol_ids[symbol] = len(self.symbols)
+                        self.symbols.append(symbol)
+                if len(self.symbols) > 256:
+                    raise ValueError("More than 256 element symbols in one store")
+                coords = np.asarray(coords, dtype='<f4')
+                records[k] = (coord_end, energy_end, element_end, coords.shape[0], coords.shape[1])
+                fc.write(coords.tobytes())
+                fe.write(np.asarray(energies, dtype='<f8').tobytes())
+                fx.write(np.array([symbol_ids[s] for s in symbols], dtype=np.uint8).tobytes())
+                coord_end += coords.size
+                energy_end += coords.shape[0]
+                element_end += coords.shape[1]
+        with open(self._file(SYMBOLS_FILE), 'w') as f:
+            f.write("".join(f"{symbol}\n" for symbol in self.symbols))
+        with open(self._file(INDEX_FILE), 'r+b' if os.path.exists(self._file(INDEX_FILE)) else 'wb') as f:
+            f.truncate(len(self.index) * INDEX_DTYPE.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(records.tobytes())
+        with open(self._file(NAMES_FILE), 'a') as f:
+            for name, source, size, mtime, *_ in entries:
+                f.write(f"{name}\t{source}\t{size}\t{mtime!r}\n")
+        # The maps of the arrays are renewed on the next access
+        for name, source, size, mtime, *_ in entries:
+            previous = self.sources.get(source)
+            if previous is not None:
+                self.names[self.entries[previous][0]].remove(previous)
+            self.sources[source] = len(self.entries)
+            self.names.setdefault(name, []).append(len(self.entries))
+            self.entries.append((name, source, size, mtime))
+        self.index = np.concatenate([self.index, records])
+        self._arrays = {}
+        return len(entries)
+
+    def close(self):
+        self._arrays = {}
+
+def find_xyz_files(folders):
+    found = []
+    for folder in folders:
+        for dirpath, _, filenames in os.walk(folder):
+            for filename in filenames:
+                if has_extension(filename, ".xyz"):
+                    found.append(os.path.join(dirpath, filename))
+    return sorted(found)
+
+def pack(store_path, folders, batch=500):
+    """
+    Add the .xyz ensembles of the folders to the store. Files already packed with the same size and
+    mtime are skipped, changed ones are appended again. Returns (added, unchanged, failed).
+    """
+    store = EnsembleStore(store_path, mode='a')
+    added = unchanged = failed = 0
+    pending = []
+    for path in find_xyz_files(folders):
+        stat = os.stat(path)
+        if store.lookup(path, stat) is not None:
+            unchanged += 1
+            continue
+        try:
+            pending.append((ensemble_name(path), os.path.abspath(path), stat.st_size, stat.st_mtime) + parse_ensemble(path))
+        except ValueError as e:
+            print(f"    -> WARNING: {e}")
+            failed += 1
+        if len(pending) >= batch:
+            added += store.append(pending)
+            pending = []
+    added += store.append(pending)
+    print(f"{added} ensembles packed, {unchanged} unchanged, {failed} failed ({len(store)} in {store_path})")
+    store.close()
+    return added, unchanged, failed
+
+def compact(store_path):
+    """Rewrite the store with the latest record of every ensemble only"""
+    store = EnsembleStore(store_path)
+    target = store_path.rstrip(os.sep) + ".compact"
+    new = EnsembleStore(target, mode='a')
+    latest = sorted(store.sources.values())
+    for start in range(0, len(latest), 500):
+        chunk = []
+        for i in latest[start:start + 500]:
+            chunk.append(store.entries[i] + store.get(store.entries[i][1]))
+        new.append(chunk)
+    dropped = len(store.entries) - len(latest)
+    store.close()
+    new.close()
+    for name in (COORDS_FILE, ENERGIES_FILE, ELEMENTS_FILE, INDEX_FILE, NAMES_FILE, SYMBOLS_FILE):
+        if os.path.exists(os.path.join(target, name)):
+            os.replace(os.path.join(target, name), os.path.join(store_path, name))
+    os.rmdir(target)
+    print(f"{len(latest)} ensembles kept, {dropped} old records dropped")
+    return dropped
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary store of GOAT ensembles (memory-mapped, appendable)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    add = sub.add_parser("pack", help="Add the .xyz ensembles of folders to a store")
+    add.add_argument("store")
+    add.add_argument("folders", nargs="+")
+
+    info = sub.add_parser("info", help="Number of ensembles and conformers of a store")
+    info.add_argument("store")
+    info.add_argument("--name", default=None, help="Show one ensemble (its source file, or its name if that is unique)")
+
+    rewrite = sub.add_parser("compact", help="Drop the records of ensembles that were packed again")
+    rewrite.add_argument("store")
+
+    args = parser.parse_args()
+    if args.command == "pack":
+        pack(args.store, args.folders)
+    elif args.command == "compact":
+        compact(args.store)
+    else:
+        store = EnsembleStore(args.store)
+        if args.name:
+            symbols, coords, energies = store.get(args.name)
+            print(f"{args.name}: {coords.shape[0]} conformers, {coords.shape[1]} atoms ({''.join(symbols)}), "
+                  f"lowest energy {np.nanmin(energies) if len(energies) else None}")
+        else:
+            latest = store.index[sorted(store.sources.values())]
+            print(f"{len(store)} ensembles, {int(latest['n_conformers'].sum())} conformers, "
+                  f"{len(store.entries) - len(store)} old records")
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,17 @@ import os
 import re
 import shutil
 import sys
+import argparse
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Compressed ensembles (.finalensemble.xyz.gz / .zst) keep their compression suffix
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from CompressedIO import strip_compression_suffix
+
+# Job-Manifest von StartUp.py → job manifest written by StartUp.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "3_Complex_Generator"))
+from Manifest import Manifest
 
 # Gruppen Liganden für einfachere Benennung → Group ligands for easier naming
 def gruppiere_liganden(liganden):  # group ligands
@@ -38,51 +48,196 @@ def extract_mult_from_name(parts, metall, ox_stufe):  # ox_stufe = oxidation sta
         return max(mults) if parts[-1] == "highS" else min(mults)
     return 1  # default multiplicity
 
-# Hauptfunktion zum Umbenennen und Kopieren → Main function for renaming and copying
-def rename_and_copy_xyz_files(src_root, dst_root):
-    count = 0
-    for dirpath, _, filenames in os.walk(src_root):  # walk through all subdirectories
-        for filename in filenames:
-            if not filename.endswith(".finalensemble.xyz"):
-                continue
-
-            name = filename[:-len(".finalensemble.xyz")]
-            parts = name.split("_")
-
-            konf_idx = parts[0]  # conformer index
-            metall = parts[1]    # metal name
-            ox_stufe = parts[2]  # oxidation state
-
-            # Extrahiere Liganden → extract ligands
-            if "Spin" in parts:
-                spin_idx = parts.index("Spin")
-                liganden = parts[3:spin_idx]
-            elif parts[-1] in ("highS", "lowS"):
-                liganden = parts[3:-1]
+# Geometrie, Metall, Oxidationsstufe, gruppierte Liganden und Multiplizität eines GOAT-Jobs
+# → geometry, metal, oxidation state, grouped ligands and multiplicity of a GOAT job
+# Mit Manifest-Eintrag nachgeschlagen, sonst aus dem Namen gelesen → looked up with a manifest record, else parsed from the name
+def describe_ensemble(name, record=None):
+    if record:
+        konf_idx = record["geometry_abbr"]
+        metall = record["metal"]
+        ox_stufe = record["oxidation"]
+        liganden = list(record["ligands"])
+        mult = record["multiplicity"]
+    else:
+        parts = name.split("_")
+        # XTBzuGOAT stellt dem Namen die Geometrie voran (OC_OC_Fe_3_...) → drop the geometry prefix XTBzuGOAT adds
+        if len(parts) > 3 and not parts[2].isdigit() and parts[3].isdigit():
+            parts = parts[1:]
+
+        konf_idx = parts[0]  # conformer index
+        metall = parts[1]    # metal name
+        ox_stufe = parts[2]  # oxidation state
+
+        # Extrahiere Liganden → extract ligands
+        if "Spin" in parts:
+            spin_idx = parts.index("Spin")
+            liganden = parts[3:spin_idx]
+        elif parts[-1] in ("highS", "lowS"):
+            liganden = parts[3:-1]
+        else:
+            liganden = parts[3:]
+
+        mult = extract_mult_from_name(parts, metall, ox_stufe)
+    return konf_idx, metall, ox_stufe, gruppiere_liganden(liganden), mult
+
+# Name des Komplexes, gemeinsam für alle Multiplizitäten → name of the complex, shared by all multiplicities
+def complex_name(konf_idx, metall, ox_stufe, gruppiert):
+    return f"{konf_idx}_{metall}_{ox_stufe}_{gruppiert}"
+
+# Name in der sortierten Ansicht → name in the sorted view
+def sorted_name(konf_idx, metall, ox_stufe, gruppiert, mult):
+    return f"{complex_name(konf_idx, metall, ox_stufe, gruppiert)}_Mult_{mult}"
+
+# Arten, eine Datei in die sortierte Ansicht zu legen → ways to put a file into the sorted view
+# copy: eigene Kopie (wie bisher) → own copy (as before)
+# hardlink: gleicher Inhalt, kein zusätzlicher Speicher (gleiches Dateisystem) → same data, no extra storage (same filesystem)
+# reflink: Copy-on-Write-Klon (Btrfs, XFS), sonst Kopie → copy-on-write clone (Btrfs, XFS), otherwise a copy
+# symlink: Verweis auf die Quelle → link to the source
+LINK_MODES = ("copy", "hardlink", "reflink", "symlink")
+FICLONE = 0x40049409  # Linux ioctl für Reflinks → Linux ioctl for reflinks
+VIEW_MAP = "ordnen_map.tsv"  # Quelle → Ziel jeder Datei der Ansicht → source → destination of every file of the view
+
+def reflink(src, dst):
+    import fcntl  # nur Unix → Unix only (ImportError → Kopie/copy)
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    shutil.copystat(src, dst)
+
+# Lege src als dst ab; gibt die tatsächlich verwendete Art zurück → place src as dst; returns the mode actually used
+def place_file(src, dst, mode="copy"):
+    if os.path.lexists(dst):
+        os.remove(dst)  # auch alte Links ersetzen → also replace old links
+    if mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+        return mode
+    if mode in ("hardlink", "reflink"):
+        try:
+            if mode == "hardlink":
+                os.link(src, dst)
             else:
-                liganden = parts[3:]
-
-            mult = extract_mult_from_name(parts, metall, ox_stufe)
-            gruppiert = gruppiere_liganden(liganden)
-
-            # Erstelle neuen Dateinamen → construct new filename
-            basename = f"{konf_idx}_{metall}_{ox_stufe}_{gruppiert}_Mult_{mult}"
-            new_name = f"{basename}.xyz"
-            dst_subfolder = os.path.join(dst_root, basename)
-            os.makedirs(dst_subfolder, exist_ok=True)
-            src_path = os.path.join(dirpath, filename)
-            dst_path = os.path.join(dst_subfolder, new_name)
-            shutil.copy2(src_path, dst_path)
-            count += 1
-    print(f"{count} Dateien kopiert.  # {count} files copied.")
+                reflink(src, dst)
+            return mode
+        except (OSError, ImportError):
+            # Anderes Dateisystem / keine Reflinks → other filesystem / no reflink support: copy
+            if os.path.lexists(dst):
+                os.remove(dst)
+    shutil.copy2(src, dst)
+    return "copy"
+
+# Durchsuche einen Teilbaum → scan one subtree
+def find_ensembles(root):
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if strip_compression_suffix(filename).endswith(".finalensemble.xyz"):
+                found.append(os.path.join(dirpath, filename))
+    return found
+
+# Parallele Suche je Unterordner der ersten Ebene → parallel scan per top-level subfolder
+def scan_parallel(src_root, workers=None):
+    entries = sorted(os.scandir(src_root), key=lambda e: e.name)
+    found = [e.path for e in entries if e.is_file() and strip_compression_suffix(e.name).endswith(".finalensemble.xyz")]
+    subdirs = [e.path for e in entries if e.is_dir()]
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        for files in pool.map(find_ensembles, subdirs):
+            found.extend(files)
+    return sorted(found)
+
+# Tabelle Quelle → Ziel (Ziel relativ zu dst_root) → table source → destination (destination relative to dst_root)
+def write_view_map(map_file, placed):
+    with open(map_file + ".part", "w") as f:
+        f.write("source\tdestination\tmode\n")
+        for src, rel_dst, mode in placed:
+            f.write(f"{src}\t{rel_dst}\t{mode}\n")
+    os.replace(map_file + ".part", map_file)
+
+def read_view_map(map_file):
+    with open(map_file) as f:
+        next(f)
+        return [tuple(line.rstrip("\n").split("\t")) for line in f if line.strip()]
+
+# Baue die sortierte Ansicht aus der Tabelle neu auf, ohne zu suchen oder Namen zu lesen
+# → rebuild the sorted view from the table, without scanning or parsing names
+def rebuild_view(map_file, dst_root=None, mode=None, workers=None):
+    dst_root = dst_root or os.path.dirname(os.path.abspath(map_file))
+    rows = read_view_map(map_file)
+    for folder in {os.path.dirname(rel_dst) for _, rel_dst, _ in rows}:
+        os.makedirs(os.path.join(dst_root, folder), exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        used = list(pool.map(lambda row: place_file(row[0], os.path.join(dst_root, row[1]), mode or row[2]), rows))
+    print(f"{len(rows)} Dateien neu abgelegt.  # {len(rows)} files placed again ({dict(Counter(used))}).")
+    return len(rows)
+
+# Hauptfunktion zum Umbenennen und Kopieren → Main function for renaming and copying
+# Mit Manifest werden Metall, Oxidationsstufe, Liganden und Multiplizität nachgeschlagen statt aus dem Namen gelesen
+# → with a manifest, metal, oxidation state, ligands and multiplicity are looked up instead of parsed from the name
+# mode: copy / hardlink / reflink / symlink (siehe oben → see above); die Zuordnung geht nach dst_root/ordnen_map.tsv
+# → the mapping is written to dst_root/ordnen_map.tsv
+def rename_and_copy_xyz_files(src_root, dst_root, manifest_path=None, mode="copy", workers=None):
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown mode {mode}, use one of {LINK_MODES}")
+    manifest = Manifest(manifest_path) if manifest_path else None
+    records = manifest.records("goat") if manifest else {}  # GOAT job name → record
+    targets = {}  # Ziel → Quelle, die letzte gewinnt wie beim Kopieren → destination → source, the last one wins as with copying
+    derived = {}
+    for src_path in scan_parallel(src_root, workers):  # walk through all subdirectories
+        filename = os.path.basename(src_path)
+        uncompressed = strip_compression_suffix(filename)
+        compression_suffix = filename[len(uncompressed):]
+
+        name = uncompressed[:-len(".finalensemble.xyz")]
+        record = records.get(name)
+        konf_idx, metall, ox_stufe, gruppiert, mult = describe_ensemble(name, record)
+
+        # Erstelle neuen Dateinamen → construct new filename
+        basename = sorted_name(konf_idx, metall, ox_stufe, gruppiert, mult)
+        new_name = f"{basename}.xyz{compression_suffix}"
+        rel_dst = os.path.join(basename, new_name)
+        targets[rel_dst] = os.path.abspath(src_path)
+        if record:
+            derived[basename] = (record, os.path.join(dst_root, rel_dst))
+
+    for folder in {os.path.dirname(rel_dst) for rel_dst in targets}:
+        os.makedirs(os.path.join(dst_root, folder), exist_ok=True)
+    rows = sorted(targets.items())
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        used = list(pool.map(lambda row: place_file(row[1], os.path.join(dst_root, row[0]), mode), rows))
+    # Einträge früherer Läufe (z. B. anderer Unterordner) bleiben erhalten → entries of earlier runs (e.g. other subfolders) are kept
+    map_file = os.path.join(dst_root, VIEW_MAP)
+    view = {rel_dst: (src, m) for src, rel_dst, m in read_view_map(map_file)} if os.path.exists(map_file) else {}
+    view.update((rel_dst, (src, m)) for (rel_dst, src), m in zip(rows, used))
+    write_view_map(map_file, [(src, rel_dst, m) for rel_dst, (src, m) in sorted(view.items())])
+
+    if manifest:
+        for basename, (record, dst_path) in derived.items():
+            manifest.derive(record, basename, "ensemble", path=dst_path)
+        manifest.close()
+    count = len(rows)
+    fallbacks = sum(m != mode for m in used)
+    print(f"{count} Dateien abgelegt ({mode}).  # {count} files placed ({mode})."
+          + (f" {fallbacks} davon kopiert → {fallbacks} of them copied (no {mode} possible)." if fallbacks else ""))
 
 # Hauptausführung → Main script entry
 if __name__ == "__main__":
     quellordner = r"<quellordner>"  # source folder
     zielordner = r"<zielordner>"  # target folder
+    manifest = r"<manifest.db>"  # Job-Manifest von StartUp.py (optional) → job manifest (optional)
+    manifest = manifest if os.path.isfile(manifest) else None
+
+    parser = argparse.ArgumentParser(description="Sort GOAT final ensembles into one folder per complex")
+    parser.add_argument("nummer", nargs="?", help="Only the source subfolder starting with '<nummer>_'")
+    parser.add_argument("--mode", choices=LINK_MODES, default=None,
+                        help="copy (default), hardlink, reflink (copy-on-write, falls back to copy) or symlink; "
+                             "with --rebuild the modes in the table are used unless given")
+    parser.add_argument("--workers", type=int, default=None, help="Threads for scanning and placing the files")
+    parser.add_argument("--rebuild", action="store_true",
+                        help=f"Rebuild the sorted view from {VIEW_MAP} in the target folder without scanning")
+    args = parser.parse_args()
 
-    if len(sys.argv) > 1:
-        nummer = sys.argv[1]
+    if args.rebuild:
+        rebuild_view(os.path.join(zielordner, VIEW_MAP), zielordner, args.mode, args.workers)
+    elif args.nummer:
+        nummer = args.nummer
         # Suche passenden Unterordner → Find matching subfolder
         matching = [d for d in os.listdir(quellordner) if d.startswith(nummer + "_")]
         if not matching:
@@ -93,8 +248,8 @@ if __name__ == "__main__":
             sys.exit(1)
         quellordner = os.path.join(quellordner, matching[0])
         print(f"Using source folder: {quellordner}")
-        rename_and_copy_xyz_files(quellordner, zielordner)
+        rename_and_copy_xyz_files(quellordner, zielordner, manifest, args.mode or "copy", args.workers)
     else:
         Check = input("Search all subfolders? Y/N: ")
         if Check.lower() == "y":
-            rename_and_copy_xyz_files(quellordner, zielordner)
+            rename_and_copy_xyz_files(quellordner, zielordner, manifest, args.mode or "copy", args.workers)
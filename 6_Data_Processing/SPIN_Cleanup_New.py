@@ -1,30 +1,300 @@
 import os
+import sys
+import json
+import math
+import mmap
 import shutil
+import sqlite3
+import argparse
+import itertools
+import multiprocessing
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-# Extract all energies from a .xyz file (multiple conformers)
-def extract_energien_from_xyz(filepath):
+import numpy as np
+
+# Compressed ensembles (.xyz.gz / .xyz.zst) are read via CompressedIO from the xTB folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from CompressedIO import has_extension, is_compressed, open_text, strip_compression_suffix
+
+# Job manifest written by StartUp.py (records of the sorted ensembles are added by Ordnen.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "3_Complex_Generator"))
+from Manifest import Manifest
+
+# Complex names as in the sorted view of Ordnen.py (grouped ligands), with or without a manifest record
+from Ordnen import complex_name, describe_ensemble
+
+# Packed ensembles (EnsembleStore.py) are read without parsing the .xyz files
+from EnsembleStore import EnsembleStore
+
+ENERGY_CACHE = "energy_cache.db"  # in the root directory of the cleanup
+BOLTZMANN_SUMMARY = "boltzmann.tsv"  # in the folder of the selected conformers
+
+HARTREE_TO_KCAL = 627.5095
+BOLTZMANN_KCAL = 0.0019872043  # kcal/(mol K)
+DEFAULT_TEMPERATURE = 298.15   # K
+DEFAULT_WINDOW = 3.0           # kcal/mol above the lowest conformer of the complex
+
+def first_float(line):
+    """Energy of a comment line (its first entry), None if it is not a number"""
+    try:
+        return float(line.split()[0])
+    except (ValueError, IndexError):
+        return None
+
+def skip_lines(data, pos, n_lines):
+    """Position after the next n_lines lines"""
+    size = len(data)
+    for _ in range(n_lines):
+        eol = data.find(b"\n", pos)
+        pos = size if eol == -1 else eol + 1
+    return pos
+
+def scan_energies(data):
+    """
+    Energies of the comment lines of a multi-xyz file given as bytes or mmap. The atom lines are
+    not decoded: ORCA writes every conformer with the same line widths, so after the first block of
+    a size the next header is expected the same number of bytes further on. If no header is found
+    there, the block is walked again newline by newline.
+    """
     energies = []
-    with open(filepath, 'r', errors='ignore') as f:
-        lines = f.readlines()
-    i = 0
-    while i < len(lines):
+    size = len(data)
+    pos = 0
+    block = {}      # n_atoms -> byte length of the last atom block
+    jumped = None   # (start, n_atoms) of the block skipped by a jump
+    while pos < size:
+        eol = data.find(b"\n", pos)
+        eol = size if eol == -1 else eol
         try:
-            n_atoms = int(lines[i].strip())  # number of atoms
+            n_atoms = int(data[pos:eol])  # number of atoms
         except ValueError:
+            if jumped is None:
+                break
+            start, n_atoms = jumped  # the block had other widths
+            jumped = None
+            pos = skip_lines(data, start, n_atoms)
+            block[n_atoms] = pos - start
+            continue
+        if eol >= size:
             break
-        if i + 1 < len(lines):
-            comment = lines[i + 1].strip()
+        comment_end = data.find(b"\n", eol + 1)
+        comment_end = size if comment_end == -1 else comment_end
+        energy = first_float(data[eol + 1:comment_end])
+        if energy is not None:
+            energies.append(energy)
+        start = comment_end + 1
+        length = block.get(n_atoms)
+        if length is not None and start + length <= size and data[start + length - 1] == 10:  # ends with newline
+            jumped = (start, n_atoms)
+            pos = start + length
+        else:
+            # skip to next conformer line by line
+            jumped = None
+            pos = skip_lines(data, start, n_atoms)
+            block[n_atoms] = pos - start
+    return energies
+
+# Extract all energies from a .xyz file (multiple conformers)
+def extract_energien_from_xyz(filepath):
+    """Uncompressed files are memory-mapped and scanned as bytes, compressed ones streamed line by line"""
+    if not is_compressed(filepath):
+        with open(filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return scan_energies(m)
+    energies = []
+    with open_text(filepath) as f:
+        for line in f:
             try:
-                energy = float(comment.split()[0])  # assume first entry is the energy
+                n_atoms = int(line.strip())  # number of atoms
+            except ValueError:
+                break
+            comment = next(f, None)
+            if comment is None:
+                break
+            energy = first_float(comment)
+            if energy is not None:
                 energies.append(energy)
-            except Exception:
-                pass
-        i += n_atoms + 2  # skip to next conformer
+            next(itertools.islice(f, n_atoms, n_atoms), None)  # skip the atom lines
+    return energies
+
+class EnergyCache:
+    """
+    Energies of ensemble files keyed by path, size and mtime (SQLite), so that repeated cleanup
+    passes only read new or changed ensembles.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS energies "
+                          "(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, energies TEXT)")
+        self.entries = {path: (size, mtime, energies) for path, size, mtime, energies
+                        in self.conn.execute("SELECT path, size, mtime, energies FROM energies")}
+        self.updates = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, path, stat):
+        """Cached energies if the file is unchanged since it was read, else None"""
+        entry = self.entries.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return json.loads(entry[2])
+        return None
+
+    def update(self, path, stat, energies):
+        text = json.dumps(energies)
+        self.entries[path] = (stat.st_size, stat.st_mtime, text)
+        self.updates.append((path, stat.st_size, stat.st_mtime, text))
+
+    def commit(self):
+        if self.updates:
+            self.conn.executemany("INSERT OR REPLACE INTO energies VALUES (?, ?, ?, ?)", self.updates)
+            self.conn.commit()
+            self.updates = []
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+def collect_energies(filepaths, cache=None, max_workers=None, store=None):
+    """
+    Energies of many ensemble files: {path: [energies]}. Files packed unchanged into the store or
+    unchanged since the last pass come from the store or the cache, the others are scanned in a process pool.
+    """
+    energies = {}
+    stats = {}
+    missing = []
+    for path in filepaths:
+        stats[path] = os.stat(path)
+        if store is not None and store.lookup(path, stats[path]) is not None:
+            values = store.energies(path)
+            energies[path] = [float(e) for e in values[~np.isnan(values)]]
+            continue
+        cached = cache.lookup(os.path.abspath(path), stats[path]) if cache is not None else None
+        if cached is None:
+            missing.append(path)
+        else:
+            energies[path] = cached
+
+    max_workers = max_workers or max(1, multiprocessing.cpu_count() - 1)
+    if max_workers > 1 and len(missing) > 1:
+        chunksize = max(1, min(256, len(missing) // (max_workers * 4)))
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+            scanned = list(executor.map(extract_energien_from_xyz, missing, chunksize=chunksize))
+    else:
+        scanned = [extract_energien_from_xyz(path) for path in missing]
+
+    for path, values in zip(missing, scanned):
+        energies[path] = values
+        if cache is not None:
+            cache.update(os.path.abspath(path), stats[path], values)
+    if cache is not None:
+        cache.commit()
+    print(f"Energies of {len(filepaths)} ensembles: {len(filepaths) - len(missing)} from store/cache, {len(missing)} scanned")
     return energies
 
+def boltzmann_table(groups, temperature=DEFAULT_TEMPERATURE, window=DEFAULT_WINDOW):
+    """
+    Boltzmann weights of the conformers of all complexes at once. groups: list of lists of energy
+    lists (one list per multiplicity file of a complex, Hartree). Energies are taken relative to the
+    lowest conformer of the complex, over all its multiplicities.
+    Returns per complex the lowest energy and the partition sum, and per file (in input order)
+    population (summed weight), conformers inside the window, weighted mean and lowest relative energy (kcal/mol).
+    """
+    sizes = [len(energies) for files in groups for energies in files]
+    group_of_file = np.repeat(np.arange(len(groups)), [len(files) for files in groups])
+    file_of = np.repeat(np.arange(len(sizes)), sizes)
+    energies = np.array([e for files in groups for values in files for e in values], dtype=float)
+    group_of = group_of_file[file_of]
+
+    e_min = np.full(len(groups), np.inf)
+    np.minimum.at(e_min, group_of, energies)
+    rel = (energies - e_min[group_of]) * HARTREE_TO_KCAL
+    boltzmann = np.exp(-rel / (BOLTZMANN_KCAL * temperature))
+    partition = np.zeros(len(groups))
+    np.add.at(partition, group_of, boltzmann)
+    weights = boltzmann / partition[group_of]
+
+    population = np.bincount(file_of, weights=weights, minlength=len(sizes))
+    min_rel = np.full(len(sizes), np.inf)
+    np.minimum.at(min_rel, file_of, rel)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_rel = np.bincount(file_of, weights=weights * rel, minlength=len(sizes)) / population
+    return {
+        'e_min': e_min, 'partition': partition, 'group_of_file': group_of_file,
+        'population': population, 'in_window': np.bincount(file_of, weights=rel <= window, minlength=len(sizes)).astype(int),
+        'mean_rel': mean_rel, 'min_rel': min_rel,
+    }
+
+def write_window(src, dst, e_min, partition, temperature=DEFAULT_TEMPERATURE, window=DEFAULT_WINDOW):
+    """
+    Copy the conformers of src within window (kcal/mol) above e_min to dst (uncompressed), with
+    relative energy and Boltzmann weight appended to the comment line. Returns the number written.
+    """
+    kept = 0
+    with open_text(src) as f, open(dst, 'w') as out:
+        for header in f:
+            try:
+                n_atoms = int(header.strip())
+            except ValueError:
+                break
+            comment = next(f, None)
+            if comment is None:
+                break
+            atoms = list(itertools.islice(f, n_atoms))
+            energy = first_float(comment)
+            if energy is None or len(atoms) < n_atoms:
+                continue
+            rel = (energy - e_min) * HARTREE_TO_KCAL
+            if rel <= window:
+                weight = math.exp(-rel / (BOLTZMANN_KCAL * temperature)) / partition
+                out.write(header)
+                out.write(f"{comment.rstrip()}  dE= {rel:.4f} kcal/mol  w= {weight:.6f}\n")
+                out.writelines(atoms)
+                kept += 1
+    return kept
+
+def select_conformers(mult_files, all_energies, root_dir, selected_dir, temperature=DEFAULT_TEMPERATURE,
+                      window=DEFAULT_WINDOW):
+    """
+    Keep only the conformers within the energy window of every complex (over all multiplicities),
+    as trimmed copies in selected_dir (same subfolders as in root_dir), and write the populations
+    of the multiplicities to selected_dir/boltzmann.tsv. Returns (conformers, conformers kept).
+    """
+    names = list(mult_files)
+    groups = [[all_energies[filepath] for _, filepath in mult_files[name]] for name in names]
+    table = boltzmann_table(groups, temperature, window)
+
+    summary = []
+    kept_total = 0
+    i = 0
+    for g, name in enumerate(names):
+        for mult, filepath in mult_files[name]:
+            if table['in_window'][i]:
+                target_subfolder = os.path.join(selected_dir, os.path.relpath(os.path.dirname(filepath), root_dir))
+                os.makedirs(target_subfolder, exist_ok=True)
+                target = os.path.join(target_subfolder, strip_compression_suffix(os.path.basename(filepath)))
+                kept_total += write_window(filepath, target, table['e_min'][g], table['partition'][g], temperature, window)
+            summary.append((name, mult, len(all_energies[filepath]), table['in_window'][i], table['population'][i],
+                            table['mean_rel'][i], table['min_rel'][i], filepath))
+            i += 1
+
+    os.makedirs(selected_dir, exist_ok=True)
+    with open(os.path.join(selected_dir, BOLTZMANN_SUMMARY), "w", encoding="utf-8") as f:
+        f.write(f"# T = {temperature} K, window = {window} kcal/mol\n")
+        f.write("complex\tmultiplicity\tconformers\tin_window\tpopulation\tmean_rel_kcal\tmin_rel_kcal\tfile\n")
+        for name, mult, conformers, in_window, population, mean_rel, min_rel, filepath in summary:
+            f.write(f"{name}\t{mult}\t{conformers}\t{in_window}\t{population:.6f}\t{mean_rel:.4f}\t{min_rel:.4f}\t{filepath}\n")
+    total = sum(len(energies) for files in groups for energies in files)
+    print(f"Energy window {window} kcal/mol at {temperature} K: kept {kept_total} of {total} conformers in {selected_dir}")
+    return total, kept_total
+
 # Cleanup function that selects the best multiplicity based on minimum energy
-def cleanup_mult_folders(root_dir, target_dir, unsicher_dir):
+def cleanup_mult_folders(root_dir, target_dir, unsicher_dir, manifest_path=None, cache_path=None, max_workers=None,
+                         store_path=None, selected_dir=None, temperature=DEFAULT_TEMPERATURE, window=DEFAULT_WINDOW):
     borderline_counter = 0   # files where no best multiplicity was found
     moved_counter = 0        # number of moved files
     single_counter = 0       # systems with only one multiplicity
@@ -33,13 +303,27 @@ def cleanup_mult_folders(root_dir, target_dir, unsicher_dir):
 
     print(f"Starting scan in root directory: {root_dir}")
 
+    # Ensemble records: complex and multiplicity are looked up instead of parsed from the file name
+    records = {}
+    if manifest_path:
+        manifest = Manifest(manifest_path)
+        records = manifest.records("ensemble")
+        manifest.close()
+        print(f"Loaded {len(records)} ensemble records from {manifest_path}")
+
     # 1. Collect all .xyz files in the directory tree
     all_files = []
     for dirpath, _, filenames in os.walk(root_dir):
         for filename in filenames:
-            if filename.endswith(".xyz"):
-                parts = filename.rsplit("_Mult_", 1)
-                if len(parts) == 2:
+            if has_extension(filename, ".xyz"):
+                name = strip_compression_suffix(filename)[:-len(".xyz")]
+                record = records.get(name)
+                parts = strip_compression_suffix(filename).rsplit("_Mult_", 1)
+                if record:
+                    # Same key as the name fallback: Ordnen's complex name with the grouped ligands
+                    abbr, metal, oxidation, grouped, mult = describe_ensemble(name, record)
+                    all_files.append((complex_name(abbr, metal, oxidation, grouped), mult, os.path.join(dirpath, filename)))
+                elif len(parts) == 2:
                     basename = parts[0]
                     mult = parts[1].replace(".xyz", "")
                     all_files.append((basename, int(mult), os.path.join(dirpath, filename)))
@@ -51,7 +335,22 @@ def cleanup_mult_folders(root_dir, target_dir, unsicher_dir):
     for basename, mult, filepath in all_files:
         mult_files[basename].append((mult, filepath))
 
-    # 3. Compare multiplicities and determine which file to keep
+    # 3. Read the energies of all groups at once (process pool, cached per path, size and mtime);
+    #    the conformer selection also needs the complexes with a single multiplicity
+    compared = [filepath for files in mult_files.values() if len(files) > 1 or selected_dir for _, filepath in files]
+    cache = EnergyCache(cache_path) if cache_path else None
+    store = EnsembleStore(store_path) if store_path else None
+    all_energies = collect_energies(compared, cache, max_workers, store)
+    if cache is not None:
+        cache.close()
+    if store is not None:
+        store.close()
+
+    # Optional: conformers within the energy window, Boltzmann-weighted over all multiplicities
+    if selected_dir:
+        select_conformers(mult_files, all_energies, root_dir, selected_dir, temperature, window)
+
+    # 4. Compare multiplicities and determine which file to keep
     for basename, files in mult_files.items():
         if len(files) < 2:
             single_counter += 1
@@ -61,7 +360,7 @@ def cleanup_mult_folders(root_dir, target_dir, unsicher_dir):
         multiple_mult_names.append(basename)
         print(f"\n  Comparing group: {basename}")
         files.sort(key=lambda x: x[0])  # sort by multiplicity
-        energies = [(mult, extract_energien_from_xyz(filepath)) for mult, filepath in files]
+        energies = [(mult, all_energies[filepath]) for mult, filepath in files]
         print(f"    Extracted energies: {energies}")
 
         # Determine lowest minimum energy → best multiplicity
@@ -116,4 +415,23 @@ if __name__ == "__main__":
     sorted_folder = r"<GOAT_Sorted_New>"       # root folder with all multiplicities
     target_folder = r"<GOAT_Mult_Unguenstig>"  # folder for non-optimal multiplicities
     uncertain_folder = r"<GOAT_Mult_Unsicher>" # folder for unclear energy cases
-    cleanup_mult_folders(sorted_folder, target_folder, uncertain_folder)
+    manifest = r"<manifest.db>"                # job manifest (optional)
+
+    parser = argparse.ArgumentParser(description="Keep the lowest-energy multiplicity of every complex")
+    parser.add_argument("--workers", type=int, default=None, help="Processes reading the ensemble energies")
+    parser.add_argument("--cache", default=None,
+                        help=f"Energy cache (default: {ENERGY_CACHE} in the root folder)")
+    parser.add_argument("--no-cache", action="store_true", help="Read all ensembles again")
+    parser.add_argument("--store", default=None, help="Ensemble store (EnsembleStore.py pack) to take the energies from")
+    parser.add_argument("--selected-dir", default=None,
+                        help="Also write the conformers within the energy window of every complex to this folder")
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW,
+                        help=f"Energy window above the lowest conformer in kcal/mol (default: {DEFAULT_WINDOW})")
+    parser.add_argument("--temperature", type=float, default=DEFAULT_TEMPERATURE,
+                        help=f"Temperature of the Boltzmann weights in K (default: {DEFAULT_TEMPERATURE})")
+    args = parser.parse_args()
+
+    cache_file = None if args.no_cache else args.cache or os.path.join(sorted_folder, ENERGY_CACHE)
+    cleanup_mult_folders(sorted_folder, target_folder, uncertain_folder,
+                         manifest if os.path.isfile(manifest) else None, cache_file, args.workers, args.store,
+                         args.selected_dir, args.temperature, args.window)
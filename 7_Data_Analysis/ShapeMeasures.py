@@ -0,0 +1,252 @@
+"""
+Continuous Shape Measures (CShM) der Koordinationspolyeder aller Konformere gegen die idealen Polyeder aus GEOMETRIEN in StartUp.py.
+# Continuous shape measures (CShM) of the coordination polyhedra of all conformers against the ideal polyhedra of GEOMETRIEN in StartUp.py.
+
+Prüft, ob ein Komplex nach xTB und GOAT noch die angenommene Geometrie hat (z.B. OC_... noch oktaedrisch),
+und markiert oder klassifiziert Strukturen neu, bevor sie mit CSD-Daten verglichen werden.
+# Checks whether a complex still has its assumed geometry after xTB and GOAT (e.g. OC_... still octahedral)
+# and flags or reclassifies structures before they are compared with CSD data.
+
+S(Q, P) = 100 * min |Q - s R P|² / |Q|² über Rotation R, Skalierung s und Zuordnung der Donoratome zu den Ecken
+(Q, P zentriert, Metall als Zentrum mit dabei). 0 = ideales Polyeder, < 1 leicht, > 3 deutlich verzerrt.
+# S(Q, P) = 100 * min |Q - s R P|² / |Q|² over rotation R, scale s and assignment of donor atoms to vertices
+# (Q, P centered, the metal included as center). 0 = ideal polyhedron, < 1 slightly, > 3 clearly distorted.
+
+Benötigt: numpy
+# Requirements: numpy
+"""
+
+import os
+import sys
+import argparse
+from itertools import permutations
+
+import numpy as np
+
+# Ideale Polyeder und Abkürzungen von StartUp.py, kovalente Radien von PreRelax.py
+# Ideal polyhedra and abbreviations of StartUp.py, covalent radii of PreRelax.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "3_Complex_Generator"))
+from StartUp import GEOMETRIEN, geometry_abbreviations
+from PreRelax import COVALENT_RADII
+
+# Gepackte Ensembles (EnsembleStore.py) werden ohne Textparsen gelesen
+# Packed ensembles (EnsembleStore.py) are read without text parsing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "6_Data_Processing"))
+from EnsembleStore import EnsembleStore, ensemble_name, find_xyz_files, parse_ensemble
+
+BOND_TOLERANCE = 1.25      # Donor gebunden, wenn Abstand < 1.25 * (r_M + r_D) → donor bonded if distance < 1.25 * (r_M + r_D)
+DISTORTION_LIMIT = 3.0     # CShM, ab dem die angenommene Geometrie als verzerrt gilt → CShM above which the assumed geometry counts as distorted
+TIE_MARGIN = 0.01          # eine andere Geometrie muss um so viel besser sein → another geometry has to be better by this much
+MAX_DONORS = 6             # größte Koordinationszahl in GEOMETRIEN → largest coordination number in GEOMETRIEN
+CONFORMER_BATCH = 512      # Konformere pro Block (Speicher: Block x Permutationen x 9) → conformers per block (memory: block x permutations x 9)
+SHAPE_REPORT = "shape_report.tsv"
+
+def reference_polyhedra():
+    """
+    Ideale Polyeder {Abkürzung: (Koordinationszahl, Punkte (n+1, 3) mit dem Metall als letztem Punkt)}.
+    # Ideal polyhedra {abbreviation: (coordination number, points (n+1, 3) with the metal as last point)}.
+    """
+    references = {}
+    for geom_de, geom_data in GEOMETRIEN.items():
+        vertices = np.array(geom_data["positions"], dtype=float)
+        references[geometry_abbreviations[geom_de]] = (geom_data["coord"], np.vstack([vertices, np.zeros(3)]))
+    return references
+
+REFERENCES = reference_polyhedra()
+
+def vertex_permutations(n):
+    """Alle Zuordnungen der n Ecken, das Zentrum bleibt letzter Punkt → all assignments of the n vertices, the center stays last"""
+    return np.array([list(p) + [n] for p in permutations(range(n))], dtype=int)
+
+def signed_overlaps(Q, P_perm):
+    """
+    (Σ Singulärwerte von Q^T P)² je Konformer und Zuordnung, ohne Spiegelung; Q (m, n+1, 3), P_perm (p, n+1, 3).
+    # (Σ singular values of Q^T P)² per conformer and assignment, without reflection; Q (m, n+1, 3), P_perm (p, n+1, 3).
+    """
+    H = np.einsum('mki,pkj->mpij', Q, P_perm)               # (m, p, 3, 3)
+    singular = np.linalg.svd(H, compute_uv=False)
+    # Kleinster Singulärwert mit Vorzeichen von det(H) → smallest singular value signed by det(H)
+    singular[..., 2] *= np.where(np.linalg.det(H) < 0, -1.0, 1.0)
+    return singular.sum(axis=-1) ** 2                        # (m, p)
+
+def distinct_permutations(P):
+    """
+    Zuordnungen bis auf die Drehsymmetrie des (normierten, zentrierten) Polyeders P: Zuordnungen, die sich nur um
+    eine Drehung von P unterscheiden, ergeben denselben CShM (OC: 720 → 30).
+    # Assignments up to the rotational symmetry of the (normalized, centered) polyhedron P: assignments differing
+    # only by a rotation of P give the same CShM (OC: 720 → 30).
+    """
+    perms = vertex_permutations(len(P) - 1)
+    symmetry = perms[signed_overlaps(P[None], P[perms])[0] > 1.0 - 1e-12]
+    index = {tuple(p): k for k, p in enumerate(perms)}
+    covered = np.zeros(len(perms), dtype=bool)
+    distinct = []
+    for k, p in enumerate(perms):
+        if covered[k]:
+            continue
+        distinct.append(k)
+        covered[[index[tuple(g[p])] for g in symmetry]] = True
+    return perms[distinct]
+
+def shape_measures(polyhedra, reference, batch=CONFORMER_BATCH):
+    """
+    CShM vieler Koordinationspolyeder (m, n+1, 3) gegen ein ideales Polyeder (n+1, 3), alle Zuordnungen auf einmal.
+    # CShM of many coordination polyhedra (m, n+1, 3) against one ideal polyhedron (n+1, 3), all assignments at once.
+    Rückgabe: Messwerte (m,) und beste Zuordnung (m, n+1) als Index der Ecke je Punkt
+    # Returns: measures (m,) and best assignment (m, n+1) as vertex index per point
+    """
+    Q = polyhedra - polyhedra.mean(axis=1, keepdims=True)
+    P = reference - reference.mean(axis=0)
+    P = P / np.sqrt((P ** 2).sum())
+    perms = distinct_permutations(P)
+    P_perm = P[perms]                                        # (p, n+1, 3)
+    norms = (Q ** 2).sum(axis=(1, 2))
+    measures = np.empty(len(Q))
+    best = np.empty(len(Q), dtype=int)
+    for start in range(0, len(Q), batch):
+        overlap = signed_overlaps(Q[start:start + batch], P_perm)
+        best[start:start + batch] = overlap.argmax(axis=1)
+        measures[start:start + batch] = 100.0 * (1.0 - overlap.max(axis=1) / norms[start:start + batch])
+    return np.clip(measures, 0.0, 100.0), perms[best]
+
+def coordination_polyhedra(symbols, coords, metal, max_donors=MAX_DONORS):
+    """
+    Donoratome aller Konformere eines Ensembles: die nächsten Atome am Metall, die gebunden sind.
+    # Donor atoms of all conformers of an ensemble: the atoms closest to the metal that are bonded to it.
+    Rückgabe: Koordinationszahl (m,), Punkte (m, max_donors+1, 3) nach Abstand sortiert (fehlende Atome NaN),
+    Metall als letzter Punkt
+    # Returns: coordination number (m,), points (m, max_donors+1, 3) sorted by distance (missing atoms NaN),
+    # metal as last point
+    """
+    metal_idx = symbols.index(metal)
+    others = np.array([i for i in range(len(symbols)) if i != metal_idx], dtype=int)
+    dist = np.linalg.norm(coords[:, others] - coords[:, [metal_idx]], axis=-1)    # (m, atoms-1)
+    nearest = np.argsort(dist, axis=1)[:, :max_donors]
+    radii = np.array([COVALENT_RADII.get(symbols[i], 1.5) for i in others])
+    limit = BOND_TOLERANCE * (COVALENT_RADII.get(metal, 1.5) + radii[nearest])
+    bonded = np.take_along_axis(dist, nearest, axis=1) < limit
+    # Gebunden zählt nur, solange die näheren Atome auch gebunden sind → counted only while the closer atoms are bonded too
+    cn = np.cumprod(bonded, axis=1).sum(axis=1)
+    points = np.full((len(coords), max_donors + 1, 3), np.nan)
+    points[:, :nearest.shape[1]] = np.take_along_axis(coords[:, others], nearest[..., None], axis=1)
+    points[:, -1] = coords[:, metal_idx]
+    return cn, points
+
+def classify(ensembles, references=REFERENCES):
+    """
+    CShM aller Konformere aller Ensembles, gebündelt nach Koordinationszahl.
+    # CShM of all conformers of all ensembles, batched by coordination number.
+    ensembles: Liste von (angenommene Abkürzung, Metall, Symbole, Koordinaten (m, Atome, 3))
+    # ensembles: list of (assumed abbreviation, metal, symbols, coordinates (m, atoms, 3))
+    Rückgabe je Ensemble: Koordinationszahl, CShM der angenommenen Geometrie (NaN bei anderer Koordinationszahl),
+    beste Geometrie und ihr CShM je Konformer
+    # Returns per ensemble: coordination number, CShM of the assumed geometry (NaN for another coordination number),
+    # best geometry and its CShM per conformer
+    """
+    cns, polys, owners = [np.empty(0, dtype=int)], [np.empty((0, MAX_DONORS + 1, 3))], [np.empty(0, dtype=int)]
+    for k, (_, metal, symbols, coords) in enumerate(ensembles):
+        cn, poly = coordination_polyhedra(symbols, np.asarray(coords, dtype=float), metal)
+        cns.append(cn)
+        polys.append(poly)
+        owners.append(np.full(len(cn), k))
+    cn = np.concatenate(cns)
+    poly = np.concatenate(polys)
+    owner = np.concatenate(owners)
+    assumed = np.array([ensembles[k][0] for k in owner], dtype=object)
+
+    assumed_measure = np.full(len(cn), np.nan)
+    best_measure = np.full(len(cn), np.inf)
+    best_geometry = np.full(len(cn), "", dtype=object)
+    for n in np.unique(cn):
+        rows = np.nonzero(cn == n)[0]
+        # Donoren + Metall der Konformere mit n Donoren → donors + metal of the conformers with n donors
+        points = np.concatenate([poly[rows, :n], poly[rows, -1:]], axis=1)
+        for abbr, (coordination, reference) in references.items():
+            if coordination != n:
+                continue
+            measures, _ = shape_measures(points, reference)
+            better = measures < best_measure[rows] - TIE_MARGIN
+            best_measure[rows[better]] = measures[better]
+            best_geometry[rows[better]] = abbr
+            is_assumed = assumed[rows] == abbr
+            assumed_measure[rows[is_assumed]] = measures[is_assumed]
+        # Gleichstand mit der angenommenen Geometrie: diese behalten → tie with the assumed geometry: keep it
+        keep = ~np.isnan(assumed_measure[rows]) & (assumed_measure[rows] <= best_measure[rows] + TIE_MARGIN)
+        best_geometry[rows[keep]] = assumed[rows[keep]]
+        best_measure[rows[keep]] = assumed_measure[rows[keep]]
+
+    results = []
+    for k in range(len(ensembles)):
+        rows = owner == k
+        results.append((cn[rows], assumed_measure[rows], best_geometry[rows], best_measure[rows]))
+    return results
+
+def ensemble_flag(assumed, cn, assumed_measure, best_geometry, energies):
+    """
+    Bewertung eines Ensembles am energetisch niedrigsten Konformer.
+    # Verdict on an ensemble from its lowest-energy conformer.
+    ok / distorted (angenommene Geometrie, CShM > DISTORTION_LIMIT) / reclassified (andere Geometrie gleicher
+    Koordinationszahl passt besser) / coordination_changed (andere Zahl gebundener Donoren)
+    # ok / distorted (assumed geometry, CShM > DISTORTION_LIMIT) / reclassified (another geometry of the same
+    # coordination number fits better) / coordination_changed (another number of bonded donors)
+    """
+    i = int(np.nanargmin(energies)) if len(energies) and not np.all(np.isnan(energies)) else 0
+    if cn[i] != REFERENCES[assumed][0]:
+        return "coordination_changed", i
+    if best_geometry[i] != assumed:
+        return "reclassified", i
+    if assumed_measure[i] > DISTORTION_LIMIT:
+        return "distorted", i
+    return "ok", i
+
+def analyse_folder(ordner, store_path=None, report_file=None):
+    """
+    CShM aller Ensembles eines Ordners (Namen wie von Ordnen.py: <Abk>_<Metall>_...), Bericht als TSV.
+    # CShM of all ensembles of a folder (names as written by Ordnen.py: <abbr>_<metal>_...), report as TSV.
+    """
+    store = EnsembleStore(store_path) if store_path else None
+    ensembles, names, energies = [], [], []
+    for path in find_xyz_files([ordner]):
+        name = ensemble_name(path)
+        parts = name.split("_")
+        if len(parts) < 3 or parts[0] not in REFERENCES:
+            print(f"    -> WARNING: Keine bekannte Geometrie → no known geometry: {name}")
+            continue
+        if store is not None and store.lookup(path, os.stat(path)) is not None:
+            symbols, coords, e = store.get(path)
+        else:
+            try:
+                symbols, coords, e = parse_ensemble(path)
+            except ValueError as error:
+                print(f"    -> WARNING: {error}")
+                continue
+        if parts[1] not in symbols:
+            print(f"    -> WARNING: Metall {parts[1]} fehlt → metal {parts[1]} missing: {name}")
+            continue
+        ensembles.append((parts[0], parts[1], symbols, coords))
+        names.append(name)
+        energies.append(np.asarray(e, dtype=float))
+
+    results = classify(ensembles)
+    report_file = report_file or os.path.join(ordner, SHAPE_REPORT)
+    counts = {}
+    with open(report_file, "w", encoding="utf-8") as f:
+        f.write("name\tassumed\tconformers\tcn\tcshm_assumed\tgeometry\tcshm_geometry\tconformers_assumed\tflag\n")
+        for name, (assumed, *_), e, (cn, assumed_measure, best_geometry, best_measure) in zip(names, ensembles, energies, results):
+            flag, i = ensemble_flag(assumed, cn, assumed_measure, best_geometry, e)
+            counts[flag] = counts.get(flag, 0) + 1
+            n_assumed = int(np.sum((best_geometry == assumed) & (assumed_measure <= DISTORTION_LIMIT)))
+            f.write(f"{name}\t{assumed}\t{len(cn)}\t{cn[i]}\t{assumed_measure[i]:.3f}\t{best_geometry[i] or '-'}\t"
+                    f"{best_measure[i]:.3f}\t{n_assumed}\t{flag}\n")
+    if store is not None:
+        store.close()
+    print(f"{len(names)} Ensembles geprüft → ensembles checked: {counts} ({report_file})")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Continuous shape measures of the final ensembles against the ideal polyhedra")
+    parser.add_argument("ordner", help="Folder with the sorted ensembles (<abbr>_<metal>_..._Mult_<m>.xyz)")
+    parser.add_argument("--store", default=None, help="Ensemble store (EnsembleStore.py pack) to take the coordinates from")
+    parser.add_argument("--report", default=None, help=f"Report file (default: {SHAPE_REPORT} in the folder)")
+    args = parser.parse_args()
+    analyse_folder(args.ordner, args.store, args.report)
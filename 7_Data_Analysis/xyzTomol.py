@@ -11,9 +11,20 @@ Benötigt: RDKit, numpy
 
 import os
 import re
+import sys
 import numpy as np
 from rdkit import Chem
 
+# Komprimierte Ensembles (.xyz.gz / .xyz.zst) werden über CompressedIO gelesen
+# Compressed ensembles (.xyz.gz / .xyz.zst) are read via CompressedIO
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_xTB_Calculations"))
+from CompressedIO import has_extension, open_text, strip_compression_suffix
+
+# Gepackte Ensembles (EnsembleStore.py) werden ohne Textparsen gelesen
+# Packed ensembles (EnsembleStore.py) are read without text parsing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "6_Data_Processing"))
+from EnsembleStore import EnsembleStore
+
 # Liganden-Ladungen (nach Bedarf erweitern)
 # Ligand charges (extend if needed)
 LIGAND_CHARGES = {
@@ -54,12 +65,12 @@ LIGAND_ANCHOR_ATOM = {
 
 def read_xyz_all_conformers(filename):
     """
-    Liest alle Konformere aus einer XYZ-Datei.
-    # Reads all conformers from an XYZ file.
+    Liest alle Konformere aus einer (ggf. komprimierten) XYZ-Datei.
+    # Reads all conformers from an (optionally compressed) XYZ file.
     Rückgabe: Liste von Tupeln (atoms, coords)
     # Returns: list of tuples (atoms, coords)
     """
-    with open(filename, 'r') as f:
+    with open_text(filename) as f:
         lines = f.readlines()
     conformers = []
     i = 0
@@ -81,6 +92,16 @@ def read_xyz_all_conformers(filename):
         i += n_atoms + 2
     return conformers
 
+def read_store_conformers(store, xyz_file):
+    """
+    Liest alle Konformere der gepackten Datei xyz_file aus dem Ensemble-Store (Speicherabbild, kein Textparsen).
+    # Reads all conformers of the packed file xyz_file from the ensemble store (memory-mapped, no text parsing).
+    Rückgabe wie read_xyz_all_conformers: Liste von Tupeln (atoms, coords)
+    # Returns the same as read_xyz_all_conformers: list of tuples (atoms, coords)
+    """
+    atoms, coords, _ = store.get(xyz_file)
+    return [(atoms, conformer.astype(float)) for conformer in coords]
+
 def parse_filename(filename):
     """
     Extrahiert Zentralatom, Oxidationszahl und Liganden aus dem Dateinamen.
@@ -254,11 +275,20 @@ if __name__ == "__main__":
     # Ordner mit .xyz-Dateien
     # Folder containing .xyz files
     ordner = r"<xyz_ordner>>"  # Replace with your folder path
+    # Ensemble-Store (optional), gepackt mit "EnsembleStore.py pack <store> <xyz_ordner>"
+    # Ensemble store (optional), packed with "EnsembleStore.py pack <store> <xyz_ordner>"
+    store_pfad = r"<ensemble_store>"
+    store = EnsembleStore(store_pfad) if os.path.isdir(store_pfad) else None
     for filename in os.listdir(ordner):
-        if filename.endswith(".xyz"):
+        if has_extension(filename, ".xyz"):
             xyz_file = os.path.join(ordner, filename)
-            zentralatom, oxzahl, liganden = parse_filename(filename)
-            conformers = read_xyz_all_conformers(xyz_file)
+            zentralatom, oxzahl, liganden = parse_filename(strip_compression_suffix(filename))
+            # Aus dem Store, wenn die Datei seit dem Packen unverändert ist
+            # From the store if the file is unchanged since it was packed
+            if store is not None and store.lookup(xyz_file, os.stat(xyz_file)) is not None:
+                conformers = read_store_conformers(store, xyz_file)
+            else:
+                conformers = read_xyz_all_conformers(xyz_file)
             for idx, (atoms, coords) in enumerate(conformers):
                 bonds, charges, total_charge = build_bonds_and_charges(atoms, zentralatom, liganden, oxzahl)
                 mol = build_mol_with_coords(atoms, coords, bonds, charges)